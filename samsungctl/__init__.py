@@ -21,8 +21,12 @@ from .remote import Remote # NOQA
 from .config import Config # NOQA
 
 
-def discover(timeout=5):
-    from .upnp.discover import discover as _discover
-
-    for config in _discover(timeout=timeout):
+def discover(timeout=5, stop_after=None, networks=None):
+    from .upnp.discover import iter_discover
+
+    for config in iter_discover(
+        timeout=timeout,
+        stop_after=stop_after,
+        networks=networks
+    ):
         yield Remote(config)
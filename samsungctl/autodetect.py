@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Detects which connection method a TV uses.
+
+All of the ports a Samsung TV can listen on and its ``/api/v2/`` url are
+probed at the same time and the method is chosen from the first answer
+that settles it. The results are kept per host and per MAC address so a
+TV is only probed once.
+
+>>> detected = detect('192.168.1.100')
+>>> print(detected.method, detected.port)
+"""
+
+import errno
+import logging
+import socket
+import threading
+import time
+import requests
+
+from . import models
+from .utils import LogItWithReturn, get_session
+from .upnp.UPNP_Device.discover import Poller
+
+logger = logging.getLogger('samsungctl')
+
+PORTS = (55000, 8001, 8002, 8080)
+API_URL = 'http://{0}:8001/api/v2/'
+
+_OPEN = 'open'
+_CLOSED = 'closed'
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class Detected(object):
+    """
+    What was found out about a TV.
+
+    :ivar method: ``"legacy"``, ``"websocket"`` or ``"encrypted"``
+    :ivar port: port to connect to
+    :ivar mac: MAC address if the TV reported it, otherwise `None`
+    :ivar device: the ``device`` section of ``/api/v2/`` or `None`
+    :ivar duration: seconds the detection took
+    """
+
+    def __init__(self, method, port, mac=None, device=None, duration=0.0):
+        self.method = method
+        self.port = port
+        self.mac = mac
+        self.device = device
+        self.duration = duration
+
+    def __repr__(self):
+        return '<Detected method={0} port={1} mac={2}>'.format(
+            self.method,
+            self.port,
+            self.mac
+        )
+
+
+def _from_device(device):
+    model = device['modelName']
+
+    if device.get('networkType') == 'wired':
+        mac = None
+    else:
+        mac = device.get('wifiMac')
+        if mac:
+            mac = mac.upper()
+
+    info = models.get_database().lookup(model)
+    token = str(device.get('TokenAuthSupport', '')).lower()
+
+    if token in ('true', 'false'):
+        token = token == 'true'
+    elif info is not None:
+        token = info.get('token')
+    else:
+        token = None
+
+    if info is not None and info.get('method') in ('encrypted', 'legacy'):
+        method = info['method']
+        port = info['port']
+    else:
+        method = 'websocket'
+        port = 8002 if token else 8001
+
+    models.get_database().learn(model, method=method, port=port, token=token)
+    return Detected(method, port, mac, device)
+
+
+def _from_ports(ports, finished):
+    """
+    Picks the method from the state of the ports.
+
+    :param ports: port -> ``_OPEN``, ``_CLOSED`` or `None` if unknown
+    :param finished: `True` if nothing more is going to be learned
+    """
+    websocket = ports[8001] == _OPEN or ports[8002] == _OPEN
+    no_websocket = ports[8001] == _CLOSED and ports[8002] == _CLOSED
+
+    # the 2014+ TV's have 55000 open too so it only means legacy
+    # once the websocket ports are known to be closed
+    if ports[55000] == _OPEN and no_websocket and ports[8080] == _CLOSED:
+        return Detected('legacy', 55000)
+
+    if not finished:
+        return None
+
+    if ports[8080] == _OPEN and not websocket:
+        return Detected('encrypted', 8080)
+    if websocket:
+        if ports[8002] == _OPEN and ports[8001] != _OPEN:
+            return Detected('websocket', 8002)
+        return Detected('websocket', 8001)
+    if ports[55000] == _OPEN:
+        return Detected('legacy', 55000)
+
+    return None
+
+
+def _probe(host, timeout):
+    start = time.time()
+    deadline = start + timeout
+
+    api = dict(device=None, done=False)
+    api_event = threading.Event()
+
+    def get_api():
+        try:
+            response = get_session(host).get(
+                API_URL.format(host),
+                timeout=timeout
+            )
+            device = response.json()['device']
+            # make sure the response is one we are able to use before the
+            # probe gets to see it
+            _from_device(device)
+            api['device'] = device
+        except (
+            requests.RequestException,
+            ValueError,
+            KeyError,
+            IndexError,
+            TypeError
+        ):
+            api['device'] = None
+        finally:
+            api['done'] = True
+            api_event.set()
+
+    t = threading.Thread(target=get_api)
+    t.daemon = True
+    t.start()
+
+    ports = dict((port, None) for port in PORTS)
+    pending = {}
+    # select.select can not handle a file descriptor over 1024, which a
+    # process classifying hundreds of TV's at once runs past
+    poller = Poller()
+
+    for port in PORTS:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        err = sock.connect_ex((host, port))
+
+        if err == 0:
+            ports[port] = _OPEN
+            sock.close()
+        elif err in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            pending[sock] = port
+            poller.register(sock, write=True)
+        else:
+            ports[port] = _CLOSED
+            sock.close()
+
+    detected = None
+
+    try:
+        while True:
+            if api['device'] is not None:
+                detected = _from_device(api['device'])
+                break
+
+            finished = not pending and api['done']
+            detected = _from_ports(ports, finished)
+
+            if detected is not None or finished:
+                break
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                detected = _from_ports(ports, True)
+                break
+
+            if pending:
+                for sock in poller.poll(min(remaining, 0.05)):
+                    port = pending.pop(sock)
+                    poller.unregister(sock)
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    ports[port] = _OPEN if err == 0 else _CLOSED
+                    sock.close()
+            else:
+                api_event.wait(min(remaining, 0.05))
+    finally:
+        poller.close()
+
+        for sock in pending:
+            sock.close()
+
+    if detected is not None:
+        detected.duration = time.time() - start
+
+    return detected
+
+
+@LogItWithReturn
+def detect(host, mac=None, timeout=1.0, use_cache=True):
+    """
+    Finds out what connection method a TV uses.
+
+    :param host: IP address of the TV
+    :type host: `str`
+    :param mac: optional, MAC address of the TV. A TV that has changed IP
+        addresses is found in the cache by its MAC address
+    :type mac: `str`
+    :param timeout: seconds to wait for the TV
+    :type timeout: `float`
+    :param use_cache: set to `False` to probe the TV again
+    :type use_cache: `bool`
+    :return: `None` if the TV did not answer
+    :rtype: `Detected`
+    """
+    if mac is not None:
+        mac = mac.upper()
+
+    if use_cache:
+        with _cache_lock:
+            detected = _cache.get(host)
+            if detected is None and mac is not None:
+                detected = _cache.get(mac)
+
+        if detected is not None:
+            return detected
+
+    detected = _probe(host, timeout)
+
+    if detected is None:
+        return None
+
+    logger.debug(
+        host + ': detected {0} on port {1} in {2:.3f} seconds'.format(
+            detected.method,
+            detected.port,
+            detected.duration
+        )
+    )
+
+    with _cache_lock:
+        _cache[host] = detected
+        for key in (mac, detected.mac):
+            if key is not None:
+                _cache[key] = detected
+
+    return detected
+
+
+def clear_cache():
+    """Forgets every TV that has been detected."""
+    with _cache_lock:
+        _cache.clear()
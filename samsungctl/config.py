@@ -4,8 +4,12 @@ import os
 import socket
 import json
 import logging
-import requests
+import threading
+import weakref
+import atexit
 from . import wake_on_lan
+from . import autodetect
+from . import fleet
 from . import exceptions
 
 
@@ -27,6 +31,26 @@ DEFAULT_CONFIG = dict(
     mac=None
 )
 
+# seconds changes are held back by `Config.save_deferred` so they get
+# written together
+SAVE_DELAY = 2.0
+
+# configs that have a deferred save waiting, id -> weak reference
+_pending_saves = {}
+
+
+@atexit.register
+def _flush_pending_saves():
+    for ref in list(_pending_saves.values()):
+        config = ref()
+        if config is None:
+            continue
+
+        try:
+            config.flush()
+        except exceptions.ConfigError:
+            pass
+
 
 class Config(object):
     LOG_OFF = logging.NOTSET
@@ -52,44 +76,32 @@ class Config(object):
         mac=None,
         **_
     ):
+        # names of the fields that have changed since the config was
+        # loaded or saved
+        self._dirty = set()
+        self._save_lock = threading.RLock()
+        self._save_timer = None
 
         if host is None:
             raise exceptions.ConfigHostError
 
         if method is None and port is None:
-            try:
-                response = requests.get(
-                    'http://{0}:8001/api/v2/'.format(host),
-                    timeout=3
-                )
-                response = response.json()['device']
-                model = response['modelName']
-                if model[5] in ('H', 'J'):
-                    method = 'encrypted'
-                    port = 8080
+            detected = autodetect.detect(host, mac)
+
+            if detected is None:
+                method = None
+                app_id = ''
+                port = None
+            else:
+                method = detected.method
+                port = detected.port
+
+                if method == 'encrypted':
                     app_id = '654321'
                     id = "654321"
                     device_id = "7e509404-9d7c-46b4-8f6a-e2a9668ad184"
-
-                else:
-                    app_id = ''
-                    method = 'websocket'
-
-            except (
-                ValueError,
-                KeyError,
-                requests.HTTPError,
-                requests.exceptions.ConnectTimeout
-            ):
-                tmp_mac = wake_on_lan.get_mac_address(host)
-                if tmp_mac is not None:
-                    method = 'legacy'
-                    app_id = ''
-                    port = 55000
                 else:
-                    method = None
                     app_id = ''
-                    port = None
 
         elif method is None:
             if port == 55000:
@@ -132,25 +144,14 @@ class Config(object):
             raise exceptions.ConfigUnknownMethod(method)
 
         if mac is None:
-            if port in (8001, 8002, 8080) and mac is None:
-                try:
-                    response = requests.get(
-                        'http://{0}:8001/api/v2/'.format(host),
-                        timeout=3
-                    )
-                    response = response.json()['device']
-                    if response['networkType'] == 'wired':
-                        mac = wake_on_lan.get_mac_address(host)
-                    else:
-                        mac = response['wifiMac'].upper()
-                except (
-                    ValueError,
-                    KeyError,
-                    requests.HTTPError,
-                    requests.exceptions.ConnectTimeout,
-                    requests.exceptions.ConnectionError
-                ):
-                    pass
+            if port in (8001, 8002, 8080):
+                # uses what was learned when the method was detected
+                detected = autodetect.detect(host)
+
+                if detected is not None and detected.mac is not None:
+                    mac = detected.mac
+                elif detected is not None and detected.device is not None:
+                    mac = wake_on_lan.get_mac_address(host)
             else:
                 mac = wake_on_lan.get_mac_address(host)
 
@@ -179,6 +180,23 @@ class Config(object):
         self.paired = paired
         self.mac = mac
 
+    def __setattr__(self, name, value):
+        if name in DEFAULT_CONFIG:
+            dirty = self.__dict__.setdefault('_dirty', set())
+            if name not in self.__dict__ or self.__dict__[name] != value:
+                dirty.add(name)
+
+        object.__setattr__(self, name, value)
+
+    @property
+    def dirty(self):
+        """
+        Fields that have changed since the config was loaded or saved.
+
+        :rtype: `set`
+        """
+        return set(self._dirty)
+
     @property
     def log_level(self):
         return logger.getEffectiveLevel()
@@ -207,13 +225,31 @@ class Config(object):
         return self
 
     @staticmethod
-    def load(path):
+    def load(path, host=None, mac=None, name=None):
+        """
+        Loads a config file.
+
+        If `path` is a fleet file (see `samsungctl.fleet`) the TV is looked
+        up by `host`, `mac` or `name`. When there is only a single TV in the
+        store none of them are needed.
+        """
         if '~' in path:
-            path.replace('~', os.path.expanduser('~'))
+            path = os.path.expanduser(path)
         if '%' in path or '$' in path:
             path = os.path.expandvars(path)
 
-        if os.path.isfile(path):
+        if fleet.is_fleet_file(path):
+            store = fleet.FleetStore.open(path)
+
+            if host is None and mac is None and name is None:
+                if len(store) == 1:
+                    return store.configs()[0]
+            else:
+                self = store.config(host, mac, name)
+                if self is not None:
+                    return self
+
+        elif os.path.isfile(path):
             config = dict(
                 list(item for item in DEFAULT_CONFIG.items())
             )
@@ -269,6 +305,7 @@ class Config(object):
 
             self = Config(**config)
             self.path = path
+            self._dirty.clear()
             return self
 
         else:
@@ -320,7 +357,78 @@ class Config(object):
                 return self
         return wrapper
 
+    def save_deferred(self, delay=None):
+        """
+        Saves the config in the background.
+
+        The save happens `delay` seconds from the first call, every change
+        made until then is written at the same time. Nothing is written if
+        nothing has changed. Use `flush` to write right away.
+
+        :param delay: seconds to wait, defaults to `SAVE_DELAY`
+        :type delay: `float`
+        """
+        if delay is None:
+            delay = SAVE_DELAY
+
+        with self._save_lock:
+            if self._save_timer is not None:
+                return
+
+            self._save_timer = threading.Timer(delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+            _pending_saves[id(self)] = weakref.ref(self)
+
+    def flush(self):
+        """Writes a deferred save now."""
+        with self._save_lock:
+            if self._save_timer is None:
+                return
+
+            self._save_timer.cancel()
+            self._save_timer = None
+            _pending_saves.pop(id(self), None)
+
+        try:
+            self.save()
+        except exceptions.ConfigSavePathNotSpecified:
+            pass
+
     def save(self, path=None):
+        """
+        Saves the config.
+
+        The file is only written if something has changed, if `path` is
+        not the file the config was loaded from or the file does not exist.
+
+        :param path: optional, file or directory to save to
+        :type path: `str`
+        """
+        with self._save_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+                _pending_saves.pop(id(self), None)
+
+            if (
+                not self._dirty and
+                (path is None or path == self.path) and
+                self.path is not None and
+                os.path.exists(self.path)
+            ):
+                return
+
+            dirty = set(self._dirty)
+            self._dirty.clear()
+
+            try:
+                self._save(path)
+            except:
+                self._dirty.update(dirty)
+                raise
+
+    def _save(self, path):
         if path is None:
             if self.path is None:
                 raise exceptions.ConfigSavePathNotSpecified
@@ -340,27 +448,43 @@ class Config(object):
         if os.path.isdir(path):
             path = os.path.join(path, self.name + '.config')
 
+        if path.endswith('.jsonl') or fleet.is_fleet_file(path):
+            store = fleet.FleetStore.open(path)
+            fields = dict(self)
+            del fields['host']
+
+            try:
+                store.update(self.host, **fields)
+            except (IOError, OSError):
+                import traceback
+                traceback.print_exc()
+                raise exceptions.ConfigSaveError
+            return
+
         if os.path.exists(path):
             with open(path, 'r') as f:
                 data = f.read().split('\n')
         else:
             data = []
 
-        new = str(self).split('\n')
+        lines = dict(
+            (line.split('=')[0].lower().strip(), i)
+            for i, line in reversed(list(enumerate(data)))
+            if line.strip()
+        )
 
-        for new_line in new:
-            key = new_line.split('=')[0]
-            for i, old_line in enumerate(data):
-                if old_line.lower().strip().startswith(key):
+        for new_line in str(self).split('\n'):
+            key = new_line.split('=')[0].strip()
+            if not key:
+                continue
 
-                    data[i] = new_line
-                    break
+            if key in lines:
+                data[lines[key]] = new_line
             else:
                 data += [new_line]
 
         try:
-            with open(path, 'w') as f:
-                f.write('\n'.join(data))
+            fleet.atomic_write(path, '\n'.join(data))
 
         except (IOError, OSError):
             import traceback
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration store for a whole fleet of TV's.
+
+All of the TV's are kept in a single file, one JSON object per line. The
+first line is a header so the file can be told apart from a single TV's
+config file. The records are indexed by host, MAC address and name.
+
+Every write goes to a temporary file which then replaces the store so the
+store is never left half written.
+
+>>> store = FleetStore.open('path/to/tvs.jsonl')
+>>> store.update('192.168.1.100', token='1234567')
+>>> config = store.config(name='Living Room')
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# seconds to wait for a file lock on windows before giving up, it has to
+# cover a pairing that is waiting for the PIN to be entered
+LOCK_TIMEOUT = 300.0
+
+try:
+    import fcntl
+
+    def _lock_file(f, exclusive):
+        fcntl.flock(
+            f.fileno(),
+            fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        )
+
+    def _unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+except ImportError:
+    import msvcrt
+
+    def _lock_file(f, _):
+        # windows has no shared locks
+        f.seek(0)
+        deadline = time.time() + LOCK_TIMEOUT
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except (IOError, OSError):
+                if time.time() >= deadline:
+                    raise
+                time.sleep(0.05)
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+logger = logging.getLogger('samsungctl')
+
+HEADER = dict(samsungctl_fleet=1)
+
+
+def atomic_write(path, data):
+    """
+    Writes a file so it is either the old or the new data, never a mix.
+
+    :param path: file to write
+    :type path: `str`
+    :param data: what to write
+    :type data: `str`
+    """
+    dirs = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(
+        dirs,
+        '.' + os.path.basename(path) + '.' + str(os.getpid()) + '.tmp'
+    )
+
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    try:
+        replace = os.replace
+    except AttributeError:
+        # Python 2
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        replace = os.rename
+
+    replace(tmp_path, path)
+
+
+@contextmanager
+def file_lock(lock_path, exclusive):
+    """
+    Locks a file so only one process at a time gets past it.
+
+    :param lock_path: file used as the lock, it gets created if needed
+    :type lock_path: `str`
+    :param exclusive: `False` lets any number of readers in at the same
+        time, on windows every lock is exclusive
+    :type exclusive: `bool`
+    :raises: `IOError` on windows when the lock is not free after
+        `LOCK_TIMEOUT` seconds
+    """
+    with open(lock_path, 'a+') as f:
+        _lock_file(f, exclusive)
+        try:
+            yield
+        finally:
+            _unlock_file(f)
+
+
+def is_fleet_file(path):
+    """
+    Checks if a file is a fleet store.
+
+    :param path: file to check
+    :type path: `str`
+    :rtype: `bool`
+    """
+    if not os.path.isfile(path):
+        return False
+
+    with open(path, 'r') as f:
+        line = f.readline()
+
+    try:
+        return json.loads(line) == HEADER
+    except ValueError:
+        return False
+
+
+def _normalize_mac(mac):
+    if mac:
+        return mac.upper().replace('-', ':')
+
+
+class FleetStore(object):
+    """
+    The TV's in a fleet file.
+
+    Use `FleetStore.open` so every user of a file shares the same store.
+    Changes are made while holding a lock on ``<path>.lock``, the file is
+    read again and the change is made to what is on disk, so processes
+    that change different TV's at the same time do not lose each others
+    changes.
+
+    :param path: path to the file, it gets created on the first save
+    :type path: `str`
+    """
+
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._records = {}
+        self._by_mac = {}
+        self._by_name = {}
+        self._mtime = None
+        # host -> fields changed using update(save=False), None if removed
+        self._pending = {}
+        self.reload()
+
+    @classmethod
+    def open(cls, path):
+        """
+        Gets the store for a file.
+
+        :param path: path to the file
+        :type path: `str`
+        :rtype: `FleetStore`
+        """
+        path = os.path.abspath(path)
+
+        with cls._stores_lock:
+            if path not in cls._stores:
+                cls._stores[path] = cls(path)
+            return cls._stores[path]
+
+    def _index(self):
+        self._by_mac = {}
+        self._by_name = {}
+
+        for host, record in self._records.items():
+            mac = _normalize_mac(record.get('mac'))
+            if mac:
+                self._by_mac[mac] = host
+
+            name = record.get('name')
+            if name:
+                self._by_name.setdefault(name, []).append(host)
+
+    def _file_mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def reload(self, force=False):
+        """
+        Reads the file again if it was changed by someone else.
+
+        :param force: read it even if the modified time is the same, the
+            time may not change when the file gets written twice in a row
+        :type force: `bool`
+        """
+        with self._lock:
+            mtime = self._file_mtime()
+            if not force and mtime is not None and mtime == self._mtime:
+                return
+
+            records = {}
+
+            if mtime is not None:
+                with open(self.path, 'r') as f:
+                    lines = f.read().split('\n')
+
+                for line in lines[1:]:
+                    line = line.strip()
+                    if not line:
+                        continue
+
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logger.error(
+                            self.path + ': skipping bad record ' + line
+                        )
+                        continue
+
+                    if record.get('host'):
+                        records[record['host']] = record
+
+            for host, fields in self._pending.items():
+                if fields is None:
+                    records.pop(host, None)
+                else:
+                    record = records.setdefault(host, dict(host=host))
+                    record.update(fields)
+
+            self._records = records
+            self._mtime = mtime
+            self._index()
+
+    @contextmanager
+    def _modify(self):
+        # the file is read again under the lock so the change is made to
+        # what is on disk and not to what this process read earlier
+        with self._lock:
+            with file_lock(self.path + '.lock', True):
+                self.reload(force=True)
+                yield
+
+    def save(self):
+        """Writes the store to disk."""
+        with self._modify():
+            self._write()
+
+    def _write(self):
+        with self._lock:
+            lines = [json.dumps(HEADER)]
+            lines += list(
+                json.dumps(self._records[host], sort_keys=True)
+                for host in sorted(self._records.keys())
+            )
+
+            atomic_write(self.path, '\n'.join(lines) + '\n')
+            self._mtime = self._file_mtime()
+            self._pending.clear()
+
+    def get(self, host=None, mac=None, name=None):
+        """
+        Finds a TV.
+
+        :param host: IP address of the TV
+        :type host: `str`
+        :param mac: MAC address of the TV
+        :type mac: `str`
+        :param name: name of the TV, the first TV with the name is returned
+        :type name: `str`
+        :return: a copy of the record or `None`
+        :rtype: `dict`
+        """
+        with self._lock:
+            self.reload()
+
+            if host is None and mac is not None:
+                host = self._by_mac.get(_normalize_mac(mac))
+            if host is None and name is not None:
+                hosts = self._by_name.get(name)
+                if hosts:
+                    host = hosts[0]
+
+            if host in self._records:
+                return dict(self._records[host])
+
+    def update(self, host, save=True, **fields):
+        """
+        Changes some of the fields of a TV, the TV is added if needed.
+
+        :param host: IP address of the TV
+        :type host: `str`
+        :param save: write the store to disk
+        :type save: `bool`
+        :param fields: fields to change
+        :return: `True` if anything changed
+        :rtype: `bool`
+        """
+        if not save:
+            with self._lock:
+                self.reload()
+                changed = self._update(host, fields)
+                if changed:
+                    pending = self._pending.get(host) or {}
+                    pending.update(fields)
+                    self._pending[host] = pending
+                return changed
+
+        with self._modify():
+            if not self._update(host, fields):
+                return False
+
+            self._write()
+            return True
+
+    def _update(self, host, fields):
+        record = self._records.get(host, dict(host=host))
+        new_record = dict(record)
+        new_record.update(fields)
+        new_record['host'] = host
+
+        if new_record == self._records.get(host):
+            return False
+
+        self._records[host] = new_record
+        self._index()
+        return True
+
+    def bulk_update(self, records):
+        """
+        Adds or changes many TV's with a single write.
+
+        :param records: `dict` with at least a ``host`` key or
+            `samsungctl.Config` instances
+        :type records: iterable
+        """
+        with self._modify():
+            for record in records:
+                record = dict(record)
+                host = record['host']
+                new_record = dict(self._records.get(host, {}))
+                new_record.update(record)
+                self._records[host] = new_record
+
+            self._index()
+            self._write()
+
+    def remove(self, host):
+        """
+        Removes a TV.
+
+        :param host: IP address of the TV
+        :type host: `str`
+        """
+        with self._modify():
+            self._pending.pop(host, None)
+
+            if self._records.pop(host, None) is not None:
+                self._index()
+                self._write()
+
+    def config(self, host=None, mac=None, name=None):
+        """
+        Gets the `samsungctl.Config` for a TV.
+
+        :return: `None` if the TV is not in the store
+        :rtype: `samsungctl.Config`
+        """
+        record = self.get(host, mac, name)
+        if record is None:
+            return None
+
+        return self._to_config(record)
+
+    def configs(self):
+        """
+        Gets the `samsungctl.Config` of every TV in the store.
+
+        :rtype: `list`
+        """
+        with self._lock:
+            self.reload()
+            records = list(self._records.values())
+
+        return list(self._to_config(dict(record)) for record in records)
+
+    def _to_config(self, record):
+        from .config import Config, DEFAULT_CONFIG
+
+        data = dict(DEFAULT_CONFIG)
+        data.update(record)
+
+        config = Config(**data)
+        config.path = self.path
+        config._dirty.clear()
+        return config
+
+    def __iter__(self):
+        with self._lock:
+            self.reload()
+            records = list(self._records.values())
+
+        for record in records:
+            yield dict(record)
+
+    def __len__(self):
+        with self._lock:
+            self.reload()
+            return len(self._records)
+
+    def __contains__(self, host):
+        with self._lock:
+            self.reload()
+            return host in self._records
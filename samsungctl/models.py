@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""
+What is known about the different Samsung TV models.
+
+Samsung model numbers carry most of what we need to know about a TV, a
+model like ``UE48JU6400`` is an LED (``U``) European (``E``) 48" TV from
+2015 (``J``) with a UHD (``U``) panel. The year decides how the TV is
+talked to so once the model is known there is no need to probe the TV.
+
+The database is made up of 3 layers, the first one that has an entry that
+matches a model wins.
+
+    * learned: filled in from TV's that have been connected to
+    * overrides: loaded from a JSON file, by default the file in the
+      ``SAMSUNGCTL_MODELS`` environment variable
+    * built in: the entries in `BUILT_IN`
+
+An entry is a `dict` with a ``pattern`` (regular expression matched
+against the start of the model number) and any of these keys
+
+    * ``method``: ``"legacy"``, ``"encrypted"`` or ``"websocket"``
+    * ``port``: port the method is used on
+    * ``token``: `True` if the TV hands out a token (SSL on port 8002)
+    * ``year``: used when the year can not be read from the model number
+    * ``services``: UPnP services the TV has
+    * ``features``: things the TV is able to do, ``"artmode"``,
+      ``"voice"``, ``"apps"``, ``"mouse"``...
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger('samsungctl')
+
+ENVIRONMENT_VARIABLE = 'SAMSUNGCTL_MODELS'
+
+YEARS = dict(
+    A=2008,
+    B=2009,
+    C=2010,
+    D=2011,
+    E=2012,
+    F=2013,
+    H=2014,
+    J=2015,
+    K=2016,
+    M=2017,
+    N=2018,
+    R=2019,
+    T=2020
+)
+
+# the letters started over in 2021
+NEW_YEARS = dict(
+    A=2021,
+    B=2022,
+    C=2023,
+    D=2024
+)
+
+TECHNOLOGIES = dict(
+    Q='QLED',
+    U='LED',
+    P='Plasma',
+    L='LCD',
+    H='DLP',
+    K='OLED',
+)
+
+_LEGACY_SERVICES = [
+    'MainTVAgent2',
+    'RemoteControlReceiver',
+    'RenderingControl',
+    'ConnectionManager',
+    'AVTransport'
+]
+
+_WEBSOCKET_SERVICES = [
+    'RenderingControl',
+    'ConnectionManager',
+    'AVTransport',
+    'dial'
+]
+
+BUILT_IN = [
+    # The Frame
+    dict(
+        pattern=r'[A-Z]{2}\d{2}LS03',
+        method='websocket',
+        port=8002,
+        token=True,
+        services=_WEBSOCKET_SERVICES,
+        features=['apps', 'mouse', 'voice', 'artmode']
+    ),
+    # 2017 QLED, QN65Q7F
+    dict(
+        pattern=r'Q[A-Z]\d{2}Q\d[A-Z](?!N)',
+        year=2017,
+        method='websocket',
+        port=8001,
+        token=False,
+        services=_WEBSOCKET_SERVICES,
+        features=['apps', 'mouse', 'voice']
+    ),
+    # 2018+ QLED
+    dict(
+        pattern=r'Q[A-Z]\d{2}Q',
+        method='websocket',
+        port=8002,
+        token=True,
+        services=_WEBSOCKET_SERVICES,
+        features=['apps', 'mouse', 'voice']
+    ),
+    # 2021+ UHD, UN55AU8000
+    dict(
+        pattern=r'[A-Z]{2}\d{2}[ABCD][A-Z]',
+        method='websocket',
+        port=8002,
+        token=True,
+        services=_WEBSOCKET_SERVICES,
+        features=['apps', 'mouse', 'voice']
+    ),
+    dict(
+        pattern=r'[A-Z]{2}\d{2}[NRT]',
+        method='websocket',
+        port=8002,
+        token=True,
+        services=_WEBSOCKET_SERVICES,
+        features=['apps', 'mouse', 'voice']
+    ),
+    dict(
+        pattern=r'[A-Z]{2}\d{2}[KM]',
+        method='websocket',
+        port=8001,
+        token=False,
+        services=_WEBSOCKET_SERVICES,
+        features=['apps', 'mouse', 'voice']
+    ),
+    dict(
+        pattern=r'[A-Z]{2}\d{2}[HJ]',
+        method='encrypted',
+        port=8080,
+        token=False,
+        services=_LEGACY_SERVICES + ['dial'],
+        features=[]
+    ),
+    dict(
+        pattern=r'[A-Z]{2}\d{2}[ABCDEF]',
+        method='legacy',
+        port=55000,
+        token=False,
+        services=_LEGACY_SERVICES,
+        features=[]
+    ),
+]
+
+_Q_MODEL = re.compile(r'Q[A-Z]\d{2}Q([A-Z]?)(\d{1,2})([A-Z]*)')
+
+
+def parse_model(model):
+    """
+    Reads what it can out of a model number.
+
+    :param model: model number
+    :type model: `str`
+    :return: `dict` with ``technology``, ``size``, ``year`` and
+        ``panel_type``, any of them can be `None`
+    :rtype: `dict`
+    """
+    # a TV that does not report its model name gives None
+    model = (model or '').strip().upper()
+
+    info = dict(
+        model=model,
+        technology=None,
+        size=None,
+        year=None,
+        panel_type=None
+    )
+
+    if len(model) < 6:
+        return info
+
+    info['technology'] = TECHNOLOGIES.get(model[0], 'Unknown')
+
+    try:
+        info['size'] = int(model[2:4])
+    except ValueError:
+        pass
+
+    match = _Q_MODEL.match(model)
+    if match is not None:
+        _, number, letters = match.groups()
+
+        if len(number) == 1:
+            # Q7F is 2017, Q7FN is 2018
+            info['year'] = 2018 if letters[1:2] == 'N' else 2017
+        elif letters:
+            info['year'] = (
+                NEW_YEARS.get(letters[0]) or YEARS.get(letters[0])
+            )
+    else:
+        letter = model[4]
+
+        if letter in NEW_YEARS and model[5].isalpha():
+            info['year'] = NEW_YEARS[letter]
+        else:
+            info['year'] = YEARS.get(letter)
+
+    if model[0] == 'Q' and model[4] == 'Q':
+        info['panel_type'] = 'UHD'
+    elif model[5].isdigit():
+        info['panel_type'] = 'FullHD'
+    else:
+        info['panel_type'] = dict(
+            S='Slim' if info['year'] == 2012 else 'SUHD',
+            U='UHD',
+            P='Plasma',
+            H='Hybrid',
+        ).get(model[5], 'Unknown')
+
+    return info
+
+
+class ModelDatabase(object):
+    """
+    Model number -> capabilities.
+
+    :param path: optional, JSON file with overrides. Models that are learned
+        get saved to this file as well.
+    :type path: `str`
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._learned = {}
+        self._overrides = []
+        self._compiled = []
+        self._cache = {}
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+        else:
+            self._compile()
+
+    def _compile(self):
+        # learned models are not matched by pattern, they only hold what
+        # was seen and get put on top of the entry that does match
+        entries = list(
+            dict(entry, source='override') for entry in self._overrides
+        )
+        entries += list(dict(entry, source='built in') for entry in BUILT_IN)
+
+        self._compiled = list(
+            (re.compile(entry['pattern']), entry) for entry in entries
+        )
+        self._cache.clear()
+
+    def load(self, path):
+        """
+        Loads overrides and learned models from a file.
+
+        :param path: JSON file
+        :type path: `str`
+        """
+        with open(path, 'r') as f:
+            data = json.load(f)
+
+        with self._lock:
+            self._overrides = list(data.get('overrides', []))
+            self._learned = dict(
+                (entry['model'], entry) for entry in data.get('learned', [])
+            )
+            self._compile()
+
+    def save(self, path=None):
+        """
+        Saves the overrides and learned models.
+
+        :param path: optional, JSON file, defaults to the file that was
+            loaded
+        :type path: `str`
+        """
+        if path is None:
+            path = self.path
+        if path is None:
+            return
+
+        with self._lock:
+            data = dict(
+                overrides=self._overrides,
+                learned=list(self._learned.values())
+            )
+
+        # written to a temporary file first so a crash never leaves a
+        # half written file behind
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=4, sort_keys=True)
+
+        if os.path.exists(path) and os.name == 'nt':
+            os.remove(path)
+        os.rename(tmp_path, path)
+
+    def add_override(self, pattern, **capabilities):
+        """
+        Adds an entry that is used before the built in ones.
+
+        :param pattern: regular expression matched against the model number
+        :type pattern: `str`
+        """
+        entry = dict(capabilities)
+        entry['pattern'] = pattern
+
+        with self._lock:
+            self._overrides.insert(0, entry)
+            self._compile()
+
+    def lookup(self, model):
+        """
+        Gets everything that is known about a model.
+
+        :param model: model number
+        :type model: `str`
+        :return: `None` if nothing is known about the model, otherwise the
+            result of `parse_model` along with the capabilities from the
+            matching entry and the ``source`` of that entry.
+        :rtype: `None` or `dict`
+        """
+        if not model:
+            return None
+
+        model = model.strip().upper()
+
+        with self._lock:
+            if model in self._cache:
+                info = self._cache[model]
+                return None if info is None else dict(info)
+
+            info = parse_model(model)
+            entries = []
+
+            for pattern, entry in self._compiled:
+                if pattern.match(model):
+                    entries.append(entry)
+                    break
+
+            if model in self._learned:
+                entries.append(dict(self._learned[model], source='learned'))
+
+            for entry in entries:
+                for key, value in entry.items():
+                    if key in ('pattern', 'model'):
+                        continue
+                    if key == 'year' and info['year'] is not None:
+                        continue
+                    info[key] = value
+
+            if not entries and info['year'] is None:
+                info = None
+
+            self._cache[model] = info
+            return None if info is None else dict(info)
+
+    def learn(self, model, **capabilities):
+        """
+        Records the capabilities of a TV that has been seen.
+
+        Only the keys that are passed are changed. If the database has a
+        path the file gets saved when something has changed.
+
+        :param model: model number
+        :type model: `str`
+        """
+        if not model:
+            return
+
+        model = model.strip().upper()
+        capabilities = dict(
+            (key, value) for key, value in capabilities.items()
+            if value is not None
+        )
+
+        with self._lock:
+            entry = self._learned.get(model, {})
+            new_entry = dict(entry)
+            new_entry.update(capabilities)
+            new_entry['model'] = model
+            new_entry['pattern'] = re.escape(model) + '$'
+
+            if new_entry == entry:
+                return
+
+            self._learned[model] = new_entry
+            self._compile()
+
+        logger.debug('learned model ' + model + ': ' + str(capabilities))
+
+        if self.path is not None:
+            try:
+                self.save()
+            except (IOError, OSError):
+                logger.error('Unable to save model database ' + self.path)
+
+
+_database = None
+_database_lock = threading.Lock()
+
+
+def get_database():
+    """
+    Gets the shared `ModelDatabase`.
+
+    The overrides file is read from the ``SAMSUNGCTL_MODELS`` environment
+    variable.
+
+    :rtype: `ModelDatabase`
+    """
+    global _database
+
+    with _database_lock:
+        if _database is None:
+            _database = ModelDatabase(os.environ.get(ENVIRONMENT_VARIABLE))
+
+        return _database
+
+
+def set_database(database):
+    """
+    Replaces the shared `ModelDatabase`.
+
+    :param database: database to use
+    :type database: `ModelDatabase`
+    """
+    global _database
+
+    with _database_lock:
+        _database = database
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Powering on a TV.
+
+WOL bursts are sent until the TV shows any sign of life. A number of
+checks are run at the same time and the first one that succeeds wins:
+
+    * a TCP connection to one of the TV's ports
+    * an HTTP request to the TV's ``/api/v2/``
+    * an SSDP ``ssdp:alive`` announcement sent by the TV
+
+>>> power_on = PowerOn('8c:71:f8:00:11:22', '192.168.1.100')
+>>> if power_on.run():
+>>>     print(power_on.signal, power_on.time_to_ready)
+"""
+
+import logging
+import socket
+import struct
+import threading
+import time
+import requests
+
+from . import wake_on_lan
+from .utils import LogItWithReturn, get_session
+
+logger = logging.getLogger('samsungctl')
+
+PORTS = (8001, 8002, 8080)
+API_URL = 'http://{0}:8001/api/v2/'
+SSDP_GROUP = '239.255.255.250'
+SSDP_PORT = 1900
+
+SIGNAL_TCP = 'tcp'
+SIGNAL_HTTP = 'http'
+SIGNAL_SSDP = 'ssdp'
+
+
+class PowerOn(object):
+    """
+    Turns a TV on and waits for it to be ready.
+
+    :param mac_address: MAC address of the TV
+    :type mac_address: `str`
+    :param host: IP address of the TV
+    :type host: `str`
+    :param timeout: seconds to wait for the TV
+    :type timeout: `float`
+    :param resend: seconds between WOL bursts
+    :type resend: `float`
+    :param ports: ports that are open once the TV is ready
+    :type ports: iterable of `int`
+    """
+
+    def __init__(
+        self,
+        mac_address,
+        host,
+        timeout=20.0,
+        resend=1.0,
+        ports=PORTS
+    ):
+        self.mac_address = mac_address
+        self.host = host
+        self.timeout = timeout
+        self.resend = resend
+        self.ports = ports
+
+        # which check saw the TV first and how long it took
+        self.signal = None
+        self.time_to_ready = None
+
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._start = None
+        self._deadline = None
+
+    def _set_ready(self, signal):
+        with self._lock:
+            if self.signal is None:
+                self.signal = signal
+                self.time_to_ready = time.time() - self._start
+                self._event.set()
+
+    def _remaining(self):
+        return self._deadline - time.time()
+
+    def _check_tcp(self):
+        def on_up(_):
+            self._set_ready(SIGNAL_TCP)
+
+        while not self._event.is_set() and self._remaining() > 0:
+            round_end = time.time() + min(0.5, self._remaining())
+            wake_on_lan.probe_ports([self.host], self.ports, 0.5, on_up)
+
+            # the TV refused the connections right away
+            if not self._event.is_set() and round_end > time.time():
+                self._event.wait(round_end - time.time())
+
+    def _check_http(self):
+        session = get_session(self.host)
+        url = API_URL.format(self.host)
+
+        while not self._event.is_set() and self._remaining() > 0:
+            round_end = time.time() + min(0.5, self._remaining())
+            try:
+                session.get(url, timeout=min(1.0, self._remaining()))
+                self._set_ready(SIGNAL_HTTP)
+                break
+            except (requests.RequestException, ValueError):
+                pass
+
+            if round_end > time.time():
+                self._event.wait(round_end - time.time())
+
+    def _check_ssdp(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('', SSDP_PORT))
+            sock.setsockopt(
+                socket.IPPROTO_IP,
+                socket.IP_ADD_MEMBERSHIP,
+                struct.pack(
+                    '4sl',
+                    socket.inet_aton(SSDP_GROUP),
+                    socket.INADDR_ANY
+                )
+            )
+        except socket.error:
+            # somebody else owns the port or there is no multicast route
+            sock.close()
+            return
+
+        try:
+            while not self._event.is_set() and self._remaining() > 0:
+                sock.settimeout(min(0.5, self._remaining()))
+                try:
+                    data, addr = sock.recvfrom(1024)
+                except socket.timeout:
+                    continue
+
+                if addr[0] == self.host and b'ssdp:alive' in data:
+                    self._set_ready(SIGNAL_SSDP)
+        except socket.error:
+            pass
+        finally:
+            sock.close()
+
+    @LogItWithReturn
+    def run(self):
+        """
+        Sends WOL bursts until the TV is ready or the timeout has passed.
+
+        :return: `True` if the TV is ready
+        :rtype: `bool`
+        """
+        self._start = time.time()
+        self._deadline = self._start + self.timeout
+
+        threads = []
+        for target in (self._check_tcp, self._check_http, self._check_ssdp):
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+            threads += [t]
+
+        while not self._event.is_set() and self._remaining() > 0:
+            wake_on_lan.send_wol(self.mac_address)
+            self._event.wait(min(self.resend, max(self._remaining(), 0)))
+
+        # wakes up the checks that are still waiting
+        self._event.set()
+
+        for t in threads:
+            t.join(1.0)
+
+        if self.signal is None:
+            return False
+
+        logger.debug(
+            self.host +
+            ' ready after {0:.3f} seconds ({1})'.format(
+                self.time_to_ready,
+                self.signal
+            )
+        )
+        return True
@@ -61,7 +61,7 @@ class RemoteMeta(type):
                     )
 
                 if config.path:
-                    config.save()
+                    config.save_deferred()
 
             def __enter__(self):
                 self.open()
@@ -10,16 +10,12 @@ https://github.com/eclair4151/SmartCrypto
 
 
 from __future__ import print_function
-import requests
 import time
+import socket
 import websocket
 import threading
-import json
-from lxml import etree
-import binascii
 import logging
 import traceback
-from .. import wake_on_lan
 
 
 try:
@@ -27,107 +23,59 @@ try:
 except NameError:
     pass
 
-from . import crypto # NOQA
 from .command_encryption import AESCipher # NOQA
+from .url import URL # NOQA
+from .socket_io import HandshakeCache # NOQA
+from .pairing import ( # NOQA
+    Pairing,
+    PinProvider,
+    ConsolePinProvider,
+    CallbackPinProvider,
+    QueuePinProvider,
+    AsyncPinProvider,
+    pair_many
+)
 from .. import websocket_base # NOQA
-from ..upnp.UPNP_Device.xmlns import strip_xmlns # NOQA
 from ..utils import LogIt, LogItWithReturn # NOQA
 
 logger = logging.getLogger('samsungctl')
 
 
-class URL(object):
+class RemoteEncrypted(websocket_base.WebSocketBase):
+    # `PinProvider` used when pairing, set this on the class or the instance
+    # to replace the console prompt. `get_pin` is used when this is `None`
+    pin_provider = None
+
+    # pairing and the socket.io server
+    power_on_ports = (8000, 8080)
 
+    @LogIt
     def __init__(self, config):
+        self.url = URL(config)
         self.config = config
+        self.ctx = None
+        self.current_session_id = None
+        self._parse_token()
 
-    @property
-    def base_url(self):
-        return 'http://{0}'.format(self.config.host)
-
-    @property
-    def full_url(self):
-        return "{0}:{1}".format(self.base_url, self.config.port)
-
-    @property
-    @LogItWithReturn
-    def request(self):
-        return "{0}/ws/pairing?step={{0}}&app_id={1}&device_id={2}".format(
-            self.full_url,
-            self.config.app_id,
-            self.config.device_id
-        )
-
-    @property
-    @LogItWithReturn
-    def step1(self):
-        return self.request.format(0) + "&type=1"
-
-    @property
-    @LogItWithReturn
-    def step2(self):
-        return self.request.format(1)
-
-    @property
-    @LogItWithReturn
-    def step3(self):
-        return self.request.format(2)
-
-    @property
-    @LogItWithReturn
-    def step4(self):
-        millis = int(round(time.time() * 1000))
-        return '{0}:8000/socket.io/1/?t={1}'.format(self.base_url, millis)
-
-    @property
-    @LogItWithReturn
-    def websocket(self):
-        try:
-            websocket_response = requests.get(self.step4, timeout=3)
-        except (requests.HTTPError, requests.exceptions.ConnectTimeout):
-            logger.info(
-                'Unable to open connection.. Is the TV on?!?'
-            )
-            return None
+        self.aes_lib = None
+        self._handshakes = HandshakeCache(self.url)
+        self._connect_event = threading.Event()
+        self._open_started = None
+        self.connect_time = None
+        self.time_to_first_command = None
 
-        logger.debug('step 4: ' + websocket_response.content.decode('utf-8'))
+        websocket_base.WebSocketBase.__init__(self, config)
 
-        websocket_url = (
-            'ws://{0}:8000/socket.io/1/websocket/{1}'.format(
-                self.config.host,
-                websocket_response.text.split(':')[0]
+    def _parse_token(self):
+        if self.config.token:
+            self.ctx, self.current_session_id = (
+                self.config.token.rsplit(':', 1)
             )
-        )
-
-        return websocket_url
-
-    @property
-    @LogItWithReturn
-    def cloud_pin_page(self):
-        return "{0}/ws/apps/CloudPINPage".format(self.full_url)
-
-
-class RemoteEncrypted(websocket_base.WebSocketBase):
-
-    @LogIt
-    def __init__(self, config):
-        self.url = URL(config)
-        if config.token:
-            self.ctx, self.current_session_id = config.token.rsplit(':', 1)
 
             try:
                 self.current_session_id = int(self.current_session_id)
             except ValueError:
                 pass
-        else:
-            self.ctx = None
-            self.current_session_id = None
-
-        self.sk_prime = False
-        self.last_request_id = 0
-        self.aes_lib = None
-
-        websocket_base.WebSocketBase.__init__(self, config)
 
     def get_pin(self):
         tv_pin = input("Please enter pin from tv: ")
@@ -139,65 +87,52 @@ class RemoteEncrypted(websocket_base.WebSocketBase):
             return True
 
         self._starting = True
+        self._open_started = time.time()
 
         power = self.power
-        paired = self.config.paired
-
-        if self.ctx is None:
-            if not power:
-                self.power = True
 
-            if not self.power:
-                raise RuntimeError('Unable to pair with TV.')
+        if self.ctx is None and self._token_from_vault():
+            self._parse_token()
 
-            self.last_request_id = 0
-
-            if self.check_pin_page():
-                logger.debug("Pin NOT on TV")
-                self.show_pin_page()
-            else:
-                logger.debug("Pin ON TV")
-
-            while self.ctx is None:
-                tv_pin = self.get_pin()
-
-                logger.info("Got pin: '{0}'".format(tv_pin))
+        paired = self.config.paired
 
-                self.first_step_of_pairing()
-                output = self.hello_exchange(tv_pin)
-                if output:
-                    self.ctx = crypto.bytes2str(
-                        binascii.hexlify(output['ctx'])
-                    )
-                    self.sk_prime = output['SKPrime']
-                    logger.debug("ctx: " + self.ctx)
-                    logger.info("Pin accepted")
-                else:
-                    logger.info("Pin incorrect. Please try again...")
-
-            self.current_session_id = self.acknowledge_exchange()
-            self.config.token = (
-                str(self.ctx) + ':' + str(self.current_session_id)
-            )
+        if self.ctx is None:
+            with self._pairing():
+                # another process may have paired while we waited
+                self._parse_token()
 
-            self.close_pin_page()
-            logger.info("Authorization successful.")
-            self.config.paired = True
+                if self.ctx is None:
+                    self._pair(power)
 
-        websocket_url = self.url.websocket
-        if websocket_url is None:
+        handshake = self._handshakes.get()
+        if handshake is None:
             return False
 
-        logger.debug(websocket_url)
-
         self.aes_lib = AESCipher(self.ctx.upper(), self.current_session_id)
-        self.sock = websocket.create_connection(websocket_url)
-        time.sleep(0.35)
+        self._connect_event.clear()
+
+        try:
+            self.sock = self._create_connection(handshake)
+        except (websocket.WebSocketException, socket.error):
+            # the TV has dropped the session we had cached
+            self._handshakes.invalidate(handshake)
+            handshake = self._handshakes.get()
+            if handshake is None:
+                return False
+
+            self.sock = self._create_connection(handshake)
 
         if not self._running:
             self._thread = threading.Thread(target=self.loop)
             self._thread.start()
 
+        # the TV sends the socket.io connect packet once it is ready
+        self._connect_event.wait(0.35)
+        self.connect_time = time.time() - self._open_started
+        logger.debug('connect time: {0:.3f}s'.format(self.connect_time))
+
+        self._handshakes.prefetch()
+
         if not paired and not power:
             self.power = False
             self.close()
@@ -206,109 +141,42 @@ class RemoteEncrypted(websocket_base.WebSocketBase):
         self._starting = False
         return True
 
-    @LogIt
-    def show_pin_page(self):
-        requests.post(self.url.cloud_pin_page, "pin4")
-
-    @LogItWithReturn
-    def check_pin_page(self):
-        response = requests.get(self.url.cloud_pin_page, timeout=3)
+    def _pair(self, power):
+        if not power:
+            self.power = True
 
-        try:
-            root = etree.fromstring(response.content)
-        except etree.LxmlSyntaxError:
-            return False
+        if not self.power:
+            raise RuntimeError('Unable to pair with TV.')
 
-        root = strip_xmlns(root)
+        pin_provider = self.pin_provider
+        if pin_provider is None:
+            pin_provider = ConsolePinProvider(self.get_pin)
 
-        state = root.find('state')
-        if state is not None:
-            logger.debug("Current state: " + state.text)
-            if state.text == 'stopped':
-                return True
+        pairing = Pairing(self.config, pin_provider)
 
-        return False
+        if not pairing.run():
+            raise RuntimeError('Unable to pair with TV.')
 
-    @LogIt
-    def first_step_of_pairing(self):
-        response = requests.get(self.url.step1)
-        logger.debug('step 1: ' + response.content.decode('utf-8'))
+        self.ctx = pairing.ctx
+        self.current_session_id = pairing.session_id
+        self._token_to_vault()
 
-    @LogItWithReturn
-    def hello_exchange(self, pin):
-        hello_output = crypto.generateServerHello(self.config.id, pin)
-
-        if not hello_output:
-            return {}
-
-        content = dict(
-            auth_Data=dict(
-                auth_type='SPC',
-                GeneratorServerHello=crypto.bytes2str(
-                    binascii.hexlify(hello_output['serverHello'])
-                ).upper()
-            )
-        )
-
-        response = requests.post(self.url.step2, json=content)
-        logger.debug('step 2: ' + response.content.decode('utf-8'))
-
-        try:
-            auth_data = json.loads(response.json()['auth_data'])
-            client_hello = auth_data['GeneratorClientHello']
-            request_id = auth_data['request_id']
-        except (ValueError, KeyError):
-            return {}
+        if self.config.path:
+            self.config.save_deferred()
 
-        self.last_request_id = int(request_id)
-
-        return crypto.parseClientHello(
-            client_hello,
-            hello_output['hash'],
-            hello_output['AES_key'],
-            self.config.id
-        )
-
-    @LogItWithReturn
-    def acknowledge_exchange(self):
-        server_ack_message = crypto.generateServerAcknowledge(self.sk_prime)
-        content = dict(
-            auth_Data=dict(
-                auth_type='SPC',
-
-                request_id=str(self.last_request_id),
-                ServerAckMsg=server_ack_message
-            )
-        )
-
-        response = requests.post(self.url.step3, json=content)
-        logger.debug("step 3: " + response.content.decode('utf-8'))
-
-        if "secure-mode" in response.content.decode('utf-8'):
-            raise RuntimeError(
-                "TODO: Implement handling of encryption flag!!!!"
-            )
-
-        try:
-            auth_data = json.loads(response.json()['auth_data'])
-            client_ack = auth_data['ClientAckMsg']
-            session_id = auth_data['session_id']
-        except (ValueError, KeyError):
-            raise RuntimeError(
-                "Unable to get session_id and/or ClientAckMsg!!!"
-            )
-
-        logger.debug("session_id: " + session_id)
-
-        if not crypto.parseClientAcknowledge(client_ack, self.sk_prime):
-            raise RuntimeError("Parse client ack message failed.")
+    def _create_connection(self, handshake):
+        websocket_url = self._handshakes.websocket_url(handshake)
+        logger.debug(websocket_url)
+        return websocket.create_connection(websocket_url)
 
-        return session_id
-
-    @LogIt
-    def close_pin_page(self):
-        requests.delete(self.url.cloud_pin_page + '/run')
-        return False
+    def on_message(self, message):
+        if message.startswith('1::'):
+            self._connect_event.set()
+        elif message.startswith('2::'):
+            # heartbeat, echo it back to keep the session alive and use it
+            # as a cue to keep a valid standby session around
+            self.sock.send('2::')
+            self._handshakes.prefetch()
 
     @LogIt
     def power(self, value):
@@ -316,26 +184,7 @@ class RemoteEncrypted(websocket_base.WebSocketBase):
 
         if value and not self.power:
             if self.mac_address:
-                count = 0
-                wake_on_lan.send_wol(self.mac_address)
-                event.wait(1.0)
-
-                while not self.power and count < 20:
-                    if not self._running:
-                        try:
-                            self.open()
-                        except:
-                            pass
-                    wake_on_lan.send_wol(self.mac_address)
-                    event.wait(1.0)
-
-                    count += 1
-
-                if count == 20:
-                    logger.error(
-                        'Unable to power on the TV, '
-                        'check network connectivity'
-                    )
+                self._power_on()
             else:
                 logging.error('Unable to get TV\'s mac address')
 
@@ -390,6 +239,16 @@ class RemoteEncrypted(websocket_base.WebSocketBase):
             time.sleep(0.35)
 
             self.sock.send(self.aes_lib.generate_command(key))
+
+            if self._open_started is not None:
+                self.time_to_first_command = time.time() - self._open_started
+                self._open_started = None
+                logger.debug(
+                    'time to first command: {0:.3f}s'.format(
+                        self.time_to_first_command
+                    )
+                )
+
             time.sleep(0.35)
             return True
         except:
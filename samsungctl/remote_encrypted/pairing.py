@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+"""
+Pairing state machine for the encrypted (H and J model year) TV's.
+
+The pairing process is broken up into steps so it can be driven a step at
+a time, resumed when a PIN becomes available and run for several TV's at
+the same time from a single process.
+
+>>> provider = QueuePinProvider()
+>>> pairing = Pairing(config, provider, timeout=120.0)
+>>> # from another thread (a web form, a GUI, etc..)
+>>> provider.put('1234', config.host)
+>>> pairing.run()
+True
+"""
+
+from __future__ import print_function
+import binascii
+import json
+import logging
+import threading
+import time
+import requests
+from lxml import etree
+
+from . import crypto
+from .url import URL
+from ..upnp.UPNP_Device.xmlns import parse_xml
+from ..utils import LogIt, LogItWithReturn, get_session
+
+try:
+    input = raw_input
+except NameError:
+    pass
+
+
+logger = logging.getLogger('samsungctl')
+
+
+STATE_START = 'start'
+STATE_WAIT_PIN = 'wait_pin'
+STATE_HELLO = 'hello'
+STATE_ACKNOWLEDGE = 'acknowledge'
+STATE_CLOSE_PIN_PAGE = 'close_pin_page'
+STATE_PAIRED = 'paired'
+STATE_FAILED = 'failed'
+
+
+class PinProvider(object):
+    """Base class for objects that supply the PIN displayed on the TV."""
+
+    def get_pin(self, config, timeout):
+        """
+        Get the PIN for a TV.
+
+        :param config: config of the TV that is being paired
+        :type config: `samsungctl.Config`
+        :param timeout: seconds to wait for a PIN, `None` to wait forever
+        :type timeout: `None` or `float`
+        :return: the PIN or `None` if no PIN was available within `timeout`
+        :rtype: `None` or `str`
+        """
+        raise NotImplementedError
+
+    def pin_rejected(self, config):
+        """Called when the TV did not accept the last PIN."""
+        logger.info(
+            '{0}: Pin incorrect. Please try again...'.format(config.host)
+        )
+
+
+class ConsolePinProvider(PinProvider):
+    """Asks for the PIN on the console. This is the default provider."""
+
+    def __init__(self, func=None):
+        self._func = func
+
+    def get_pin(self, config, timeout):
+        if self._func is not None:
+            return self._func()
+
+        return input("Please enter pin from tv: ")
+
+
+class CallbackPinProvider(PinProvider):
+    """
+    Calls ``callback(config)`` to get the PIN.
+
+    The callback is run in the pairing thread and should return the PIN or
+    `None` if it is not available yet.
+    """
+
+    def __init__(self, callback):
+        self._callback = callback
+
+    def get_pin(self, config, timeout):
+        return self._callback(config)
+
+
+class QueuePinProvider(PinProvider):
+    """
+    Takes PINs from queues.
+
+    PINs can be queued for a specific TV (by host) or for whoever asks
+    first, which makes a single provider usable by `pair_many`.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        # host, or None for whoever asks first -> PINs in the order they
+        # were put
+        self._pins = {}
+
+    def put(self, pin, host=None):
+        with self._condition:
+            self._pins.setdefault(host, []).append(pin)
+            self._condition.notify_all()
+
+    def get_pin(self, config, timeout):
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        # both queues are checked every time a PIN is put, up to the one
+        # deadline
+        with self._condition:
+            while True:
+                for host in (config.host, None):
+                    pins = self._pins.get(host)
+                    if pins:
+                        return pins.pop(0)
+
+                if timeout is None:
+                    self._condition.wait()
+                    continue
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+
+                self._condition.wait(remaining)
+
+
+class AsyncPinProvider(PinProvider):
+    """
+    Runs ``coroutine_function(config)`` in an asyncio event loop.
+
+    The loop has to be running in another thread, the pairing thread blocks
+    until the coroutine returns the PIN or the timeout expires.
+    """
+
+    def __init__(self, coroutine_function, loop):
+        self._coroutine_function = coroutine_function
+        self._loop = loop
+
+    def get_pin(self, config, timeout):
+        import asyncio
+        import concurrent.futures
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._coroutine_function(config),
+            self._loop
+        )
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            return None
+
+
+class Pairing(object):
+    """
+    Pairs with a single encrypted TV.
+
+    Call `run` to pair in one go or `step` to advance a single state. When
+    `pin_provider` is `None` the state machine stays in ``STATE_WAIT_PIN``
+    until a PIN is handed to it using `submit_pin`.
+
+    :param config: TV config, the token is stored in it once paired
+    :type config: `samsungctl.Config`
+    :param pin_provider: where the PIN comes from
+    :type pin_provider: `None` or `PinProvider` instance
+    :param timeout: deadline in seconds for the whole process, `None` for
+        no deadline
+    :type timeout: `None` or `float`
+    :param request_timeout: timeout for each HTTP request made to the TV
+    :type request_timeout: `float`
+    """
+
+    def __init__(
+        self,
+        config,
+        pin_provider=None,
+        timeout=None,
+        request_timeout=5.0
+    ):
+        self.config = config
+        self.url = URL(config)
+        self.pin_provider = pin_provider
+        self.request_timeout = request_timeout
+        self.state = STATE_START
+        self.error = None
+        self.ctx = None
+        self.sk_prime = None
+        self.session_id = None
+        self.last_request_id = 0
+        self._pin = None
+        self._session = get_session(config.host)
+
+        if timeout is None:
+            self.deadline = None
+        else:
+            self.deadline = time.time() + timeout
+
+    @property
+    def remaining(self):
+        """Seconds left before the deadline, `None` if there is none."""
+        if self.deadline is None:
+            return None
+
+        return max(0.0, self.deadline - time.time())
+
+    @property
+    def done(self):
+        return self.state in (STATE_PAIRED, STATE_FAILED)
+
+    @property
+    def token(self):
+        if self.session_id is not None:
+            return str(self.ctx) + ':' + str(self.session_id)
+
+    def submit_pin(self, pin):
+        """Hands a PIN to a pairing waiting in ``STATE_WAIT_PIN``."""
+        self._pin = pin
+
+    def _request_timeout(self):
+        remaining = self.remaining
+        if remaining is None:
+            return self.request_timeout
+
+        return max(0.1, min(self.request_timeout, remaining))
+
+    @LogItWithReturn
+    def step(self):
+        """
+        Runs the current state and moves to the next one.
+
+        :return: the new state
+        :rtype: `str`
+        """
+        if self.done:
+            return self.state
+
+        if self.remaining == 0.0:
+            self.error = 'Pairing timed out in state ' + self.state
+            logger.error('{0}: {1}'.format(self.config.host, self.error))
+            self.state = STATE_FAILED
+            return self.state
+
+        handler = getattr(self, '_state_' + self.state)
+
+        try:
+            self.state = handler()
+        except (requests.RequestException, RuntimeError) as err:
+            self.error = str(err)
+            logger.error('{0}: {1}'.format(self.config.host, self.error))
+            self.state = STATE_FAILED
+
+        return self.state
+
+    @LogItWithReturn
+    def run(self):
+        """
+        Runs the state machine until it has paired or failed.
+
+        :return: `True` if paired else `False`
+        :rtype: `bool`
+        """
+        while not self.done:
+            if self.step() == STATE_WAIT_PIN and self._pin is None:
+                time.sleep(0.1)
+
+        return self.state == STATE_PAIRED
+
+    def _state_start(self):
+        self.last_request_id = 0
+
+        if self.check_pin_page():
+            logger.debug("Pin NOT on TV")
+            self.show_pin_page()
+        else:
+            logger.debug("Pin ON TV")
+
+        return STATE_WAIT_PIN
+
+    def _state_wait_pin(self):
+        if self._pin is None and self.pin_provider is not None:
+            self._pin = self.pin_provider.get_pin(self.config, self.remaining)
+
+        if self._pin is None:
+            return STATE_WAIT_PIN
+
+        logger.info("Got pin: '{0}'".format(self._pin))
+        return STATE_HELLO
+
+    def _state_hello(self):
+        pin, self._pin = self._pin, None
+
+        self.first_step_of_pairing()
+        output = self.hello_exchange(pin)
+
+        if not output:
+            if self.pin_provider is not None:
+                self.pin_provider.pin_rejected(self.config)
+            return STATE_WAIT_PIN
+
+        self.ctx = crypto.bytes2str(binascii.hexlify(output['ctx']))
+        self.sk_prime = output['SKPrime']
+        logger.debug("ctx: " + self.ctx)
+        logger.info("Pin accepted")
+        return STATE_ACKNOWLEDGE
+
+    def _state_acknowledge(self):
+        self.session_id = self.acknowledge_exchange()
+        return STATE_CLOSE_PIN_PAGE
+
+    def _state_close_pin_page(self):
+        self.close_pin_page()
+        self.config.token = self.token
+        self.config.paired = True
+        logger.info("Authorization successful.")
+        return STATE_PAIRED
+
+    @LogIt
+    def show_pin_page(self):
+        self._session.post(
+            self.url.cloud_pin_page,
+            "pin4",
+            timeout=self._request_timeout()
+        )
+
+    @LogItWithReturn
+    def check_pin_page(self):
+        response = self._session.get(
+            self.url.cloud_pin_page,
+            timeout=self._request_timeout()
+        )
+
+        try:
+            root = parse_xml(response.content)
+        except etree.LxmlSyntaxError:
+            return False
+
+        state = root.find('state')
+        if state is not None:
+            logger.debug("Current state: " + state.text)
+            if state.text == 'stopped':
+                return True
+
+        return False
+
+    @LogIt
+    def first_step_of_pairing(self):
+        response = self._session.get(
+            self.url.step1,
+            timeout=self._request_timeout()
+        )
+        logger.debug('step 1: ' + response.content.decode('utf-8'))
+
+    @LogItWithReturn
+    def hello_exchange(self, pin):
+        hello_output = crypto.generateServerHello(self.config.id, pin)
+
+        if not hello_output:
+            return {}
+
+        content = dict(
+            auth_Data=dict(
+                auth_type='SPC',
+                GeneratorServerHello=crypto.bytes2str(
+                    binascii.hexlify(hello_output['serverHello'])
+                ).upper()
+            )
+        )
+
+        response = self._session.post(
+            self.url.step2,
+            json=content,
+            timeout=self._request_timeout()
+        )
+        logger.debug('step 2: ' + response.content.decode('utf-8'))
+
+        try:
+            auth_data = json.loads(response.json()['auth_data'])
+            client_hello = auth_data['GeneratorClientHello']
+            request_id = auth_data['request_id']
+        except (ValueError, KeyError):
+            return {}
+
+        self.last_request_id = int(request_id)
+
+        return crypto.parseClientHello(
+            client_hello,
+            hello_output['hash'],
+            hello_output['AES_key'],
+            self.config.id
+        )
+
+    @LogItWithReturn
+    def acknowledge_exchange(self):
+        server_ack_message = crypto.generateServerAcknowledge(self.sk_prime)
+        content = dict(
+            auth_Data=dict(
+                auth_type='SPC',
+                request_id=str(self.last_request_id),
+                ServerAckMsg=server_ack_message
+            )
+        )
+
+        response = self._session.post(
+            self.url.step3,
+            json=content,
+            timeout=self._request_timeout()
+        )
+        logger.debug("step 3: " + response.content.decode('utf-8'))
+
+        if "secure-mode" in response.content.decode('utf-8'):
+            raise RuntimeError(
+                "TODO: Implement handling of encryption flag!!!!"
+            )
+
+        try:
+            auth_data = json.loads(response.json()['auth_data'])
+            client_ack = auth_data['ClientAckMsg']
+            session_id = auth_data['session_id']
+        except (ValueError, KeyError):
+            raise RuntimeError(
+                "Unable to get session_id and/or ClientAckMsg!!!"
+            )
+
+        logger.debug("session_id: " + session_id)
+
+        if not crypto.parseClientAcknowledge(client_ack, self.sk_prime):
+            raise RuntimeError("Parse client ack message failed.")
+
+        return session_id
+
+    @LogIt
+    def close_pin_page(self):
+        self._session.delete(
+            self.url.cloud_pin_page + '/run',
+            timeout=self._request_timeout()
+        )
+        return False
+
+
+def pair_many(configs, pin_provider, timeout=120.0, request_timeout=5.0):
+    """
+    Pairs with several encrypted TV's at the same time.
+
+    Each TV is paired in its own thread. A single `QueuePinProvider` or
+    `CallbackPinProvider` can be shared, the config of the TV that needs a
+    PIN is passed to it.
+
+    :param configs: configs of the TV's to pair with
+    :type configs: iterable of `samsungctl.Config`
+    :param pin_provider: where the PIN's come from
+    :type pin_provider: `PinProvider` instance
+    :param timeout: deadline in seconds for every TV
+    :type timeout: `float`
+    :param request_timeout: timeout for each HTTP request
+    :type request_timeout: `float`
+    :return: the `Pairing` object for every TV keyed by host
+    :rtype: `dict`
+    """
+    pairings = {}
+    threads = []
+
+    for config in configs:
+        pairing = Pairing(config, pin_provider, timeout, request_timeout)
+        pairings[config.host] = pairing
+
+        t = threading.Thread(target=pairing.run)
+        t.daemon = True
+        threads += [t]
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    return pairings
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+socket.io (0.9) handshake handling for the encrypted TV's.
+
+Negotiating a socket.io session is an HTTP round trip to port 8000 that
+has to be done before the websocket can be opened. The negotiated session
+stays valid on the TV until the close timeout it reports expires, so it is
+kept and reused for reconnects. A standby session is negotiated in the
+background after every connect so a reconnect after a drop does not have
+to wait on the TV.
+"""
+
+import threading
+import time
+import logging
+import requests
+from ..utils import LogItWithReturn, get_session
+
+logger = logging.getLogger('samsungctl')
+
+
+class Handshake(object):
+    """A negotiated socket.io session."""
+
+    def __init__(
+        self,
+        session_id,
+        heartbeat_timeout=None,
+        close_timeout=None,
+        transports=()
+    ):
+        self.session_id = session_id
+        self.heartbeat_timeout = heartbeat_timeout
+        self.close_timeout = close_timeout
+        self.transports = transports
+        self.created = time.time()
+
+    @classmethod
+    def parse(cls, data):
+        """
+        Creates a handshake from the TV's response.
+
+        The response is formatted ``session_id:heartbeat:close:transports``
+        """
+        parts = data.strip().split(':')
+
+        def to_int(index):
+            try:
+                return int(parts[index])
+            except (IndexError, ValueError):
+                return None
+
+        if len(parts) > 3:
+            transports = tuple(parts[3].split(','))
+        else:
+            transports = ()
+
+        return cls(parts[0], to_int(1), to_int(2), transports)
+
+    @property
+    def expired(self):
+        # a session that did not give us a close timeout is only used once
+        if not self.close_timeout:
+            return True
+
+        return time.time() - self.created >= self.close_timeout
+
+    def __repr__(self):
+        return '<Handshake {0} heartbeat={1} close={2}>'.format(
+            self.session_id,
+            self.heartbeat_timeout,
+            self.close_timeout
+        )
+
+
+class HandshakeCache(object):
+    """
+    Hands out socket.io sessions for a TV.
+
+    :param url: url builder of the TV
+    :type url: `samsungctl.remote_encrypted.url.URL`
+    :param timeout: timeout for the handshake request
+    :type timeout: `float`
+    """
+
+    def __init__(self, url, timeout=3.0):
+        self.url = url
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._current = None
+        self._standby = None
+        self._standby_thread = None
+
+    @LogItWithReturn
+    def negotiate(self):
+        """
+        Does a socket.io handshake with the TV.
+
+        :rtype: `None` or `Handshake`
+        """
+        try:
+            response = get_session(self.url.config.host).get(
+                self.url.step4,
+                timeout=self.timeout
+            )
+        except (
+            requests.HTTPError,
+            requests.exceptions.ConnectTimeout,
+            requests.exceptions.ConnectionError
+        ):
+            logger.info('Unable to open connection.. Is the TV on?!?')
+            return None
+
+        logger.debug('step 4: ' + response.content.decode('utf-8'))
+        return Handshake.parse(response.text)
+
+    @LogItWithReturn
+    def get(self):
+        """
+        Returns a session that is still valid, negotiating one if needed.
+
+        A standby session is used first, then the session that was used
+        last. The network is only touched when both have expired.
+
+        :rtype: `None` or `Handshake`
+        """
+        standby_thread = self._standby_thread
+        if standby_thread is not None:
+            standby_thread.join(self.timeout)
+
+        with self._lock:
+            for handshake in (self._standby, self._current):
+                if handshake is not None and not handshake.expired:
+                    self._standby = None
+                    self._current = handshake
+                    return handshake
+
+            self._standby = None
+            self._current = None
+
+        handshake = self.negotiate()
+
+        with self._lock:
+            self._current = handshake
+
+        return handshake
+
+    def invalidate(self, handshake):
+        """Drops a session that the TV refused."""
+        with self._lock:
+            if self._current is handshake:
+                self._current = None
+            if self._standby is handshake:
+                self._standby = None
+
+    def prefetch(self):
+        """Negotiates a standby session in the background."""
+        with self._lock:
+            if self._standby is not None and not self._standby.expired:
+                return
+
+            if self._standby_thread is not None:
+                return
+
+            def do():
+                handshake = self.negotiate()
+                with self._lock:
+                    self._standby = handshake
+                    self._standby_thread = None
+
+            self._standby_thread = threading.Thread(target=do)
+            self._standby_thread.daemon = True
+            self._standby_thread.start()
+
+    def websocket_url(self, handshake):
+        return 'ws://{0}:8000/socket.io/1/websocket/{1}'.format(
+            self.url.config.host,
+            handshake.session_id
+        )
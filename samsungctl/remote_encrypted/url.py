@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+import requests
+from ..utils import LogItWithReturn, get_session
+
+logger = logging.getLogger('samsungctl')
+
+
+class URL(object):
+
+    def __init__(self, config):
+        self.config = config
+
+    @property
+    def base_url(self):
+        return 'http://{0}'.format(self.config.host)
+
+    @property
+    def full_url(self):
+        return "{0}:{1}".format(self.base_url, self.config.port)
+
+    @property
+    @LogItWithReturn
+    def request(self):
+        return "{0}/ws/pairing?step={{0}}&app_id={1}&device_id={2}".format(
+            self.full_url,
+            self.config.app_id,
+            self.config.device_id
+        )
+
+    @property
+    @LogItWithReturn
+    def step1(self):
+        return self.request.format(0) + "&type=1"
+
+    @property
+    @LogItWithReturn
+    def step2(self):
+        return self.request.format(1)
+
+    @property
+    @LogItWithReturn
+    def step3(self):
+        return self.request.format(2)
+
+    @property
+    @LogItWithReturn
+    def step4(self):
+        millis = int(round(time.time() * 1000))
+        return '{0}:8000/socket.io/1/?t={1}'.format(self.base_url, millis)
+
+    @property
+    @LogItWithReturn
+    def websocket(self):
+        try:
+            websocket_response = get_session(self.config.host).get(
+                self.step4,
+                timeout=3
+            )
+        except (
+            requests.HTTPError,
+            requests.exceptions.ConnectTimeout,
+            requests.exceptions.ConnectionError
+        ):
+            logger.info(
+                'Unable to open connection.. Is the TV on?!?'
+            )
+            return None
+
+        logger.debug('step 4: ' + websocket_response.content.decode('utf-8'))
+
+        websocket_url = (
+            'ws://{0}:8000/socket.io/1/websocket/{1}'.format(
+                self.config.host,
+                websocket_response.text.split(':')[0]
+            )
+        )
+
+        return websocket_url
+
+    @property
+    @LogItWithReturn
+    def cloud_pin_page(self):
+        return "{0}/ws/apps/CloudPINPage".format(self.full_url)
@@ -13,7 +13,6 @@ import socket
 from . import exceptions
 from . import application
 from . import websocket_base
-from . import wake_on_lan
 from .utils import LogIt, LogItWithReturn
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
@@ -56,6 +55,19 @@ class RemoteWebsocket(websocket_base.WebSocketBase):
         if self.sock is not None:
             return True
 
+        if not self.config.token:
+            self._token_from_vault()
+
+        if self.config.paired:
+            return self._open()
+
+        with self._pairing():
+            return self._open()
+
+    def _open(self):
+        if self.sock is not None:
+            return True
+
         self._starting = True
         with self.receive_lock:
             power = self.power
@@ -153,8 +165,10 @@ class RemoteWebsocket(websocket_base.WebSocketBase):
                     self.power = False
 
                 self.config.paired = True
+                self._token_to_vault()
+
                 if self.config.path:
-                    self.config.save()
+                    self.config.save_deferred()
 
                 auth_event.set()
 
@@ -219,26 +233,7 @@ class RemoteWebsocket(websocket_base.WebSocketBase):
 
         if value and not self.power:
             if self.mac_address:
-                count = 0
-                wake_on_lan.send_wol(self.mac_address)
-                event.wait(1.0)
-
-                while not self.power and count < 20:
-                    if not self._running:
-                        try:
-                            self.open()
-                        except:
-                            pass
-                    wake_on_lan.send_wol(self.mac_address)
-                    event.wait(1.0)
-
-                    count += 1
-
-                if count == 20:
-                    logger.error(
-                        'Unable to power on the TV, '
-                        'check network connectivity'
-                    )
+                self._power_on()
             else:
                 logging.error('Unable to get TV\'s mac address')
 
@@ -10,14 +10,30 @@ logger.addHandler(NullHandler())
 logging.basicConfig(format="%(message)s", level=None)
 
 
-from .discover import discover as _discover # NOQA
+from .discover import discover as _discover, SETTLE_TIME # NOQA
 from .listen import listen # NOQA
+from .registry import DeviceRegistry # NOQA
 from .upnp_class import UPNPObject # NOQA
-
-
-def discover(timeout=5, log_level=None, ips=[], dump=''):
-    for addr, locations in _discover(timeout, log_level, ips, dump):
-        yield UPNPObject(addr, locations, dump)
+from .dump import DumpReader, DumpWriter, open_writer # NOQA
+
+
+def discover(timeout=5, log_level=None, ips=[], dump='', stop_after=None):
+    # the SSDP packets and every device go into the same dump
+    writer, owned_writer = open_writer(dump)
+
+    try:
+        for addr, locations in _discover(
+            timeout,
+            log_level,
+            ips,
+            writer,
+            stop_after=stop_after,
+            settle=SETTLE_TIME
+        ):
+            yield UPNPObject(addr, locations, writer)
+    finally:
+        if owned_writer:
+            writer.close()
 
 
 __title__ = "UPNP_Device"
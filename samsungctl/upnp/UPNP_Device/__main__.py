@@ -43,7 +43,7 @@ def main():
         "--dump",
         type=str,
         default='',
-        help="dump output path"
+        help="dump output path, a folder or a .zip or .tar.gz file"
     )
     parser.add_argument(
         "--timeout",
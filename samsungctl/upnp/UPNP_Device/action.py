@@ -2,11 +2,10 @@
 
 import requests
 from xml.dom.minidom import Document
-from lxml import etree
 try:
-    from .xmlns import ENVELOPE_XMLNS, strip_xmlns
+    from .xmlns import ENVELOPE_XMLNS, parse_xml
 except ImportError:
-    from xmlns import ENVELOPE_XMLNS, strip_xmlns
+    from xmlns import ENVELOPE_XMLNS, parse_xml
 
 
 class Action(object):
@@ -88,8 +87,7 @@ class Action(object):
             data=pure_xml,
             headers=header
         )
-        envelope = etree.fromstring(response.content)
-        envelope = strip_xmlns(envelope)
+        envelope = parse_xml(response.content)
 
         body = envelope.find('Body')
 
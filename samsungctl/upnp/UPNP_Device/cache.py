@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the devices that have answered an SSDP search or announced
+themselves.
+
+An entry is kept for every USN and holds the LOCATION's, SERVER, BOOTID
+and CONFIGID of the device along with when it expires. The expiry comes
+from the ``max-age`` in the ``CACHE-CONTROL`` header, same as a control
+point is supposed to do. An ``ssdp:alive`` refreshes an entry, an ``ssdp:byebye``
+removes it.
+
+The cache is saved to a file so it carries over between runs, the file
+is set using the ``UPNP_DEVICE_CACHE`` environment variable or by passing
+a path to `DiscoveryCache`.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger('UPNP_Devices')
+
+ENVIRONMENT_VARIABLE = 'UPNP_DEVICE_CACHE'
+
+# used when a device does not send a max-age, the UPNP spec minimum
+DEFAULT_MAX_AGE = 1800
+
+_MAX_AGE = re.compile(r'max-age\s*=\s*(\d+)', re.IGNORECASE)
+
+
+def parse_max_age(cache_control):
+    """Gets the seconds from a ``CACHE-CONTROL`` header."""
+    if cache_control:
+        match = _MAX_AGE.search(cache_control)
+        if match is not None:
+            return int(match.group(1))
+
+    return DEFAULT_MAX_AGE
+
+
+class DiscoveryCache(object):
+    """
+    Devices that have been found, by USN and by IP address.
+
+    :param path: optional, file the cache is saved to
+    :type path: `str`
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        # USN -> entry
+        self._entries = {}
+        # IP address -> set of USN's
+        self._by_ip = {}
+
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def _add(self, entry):
+        usn = entry['usn']
+        self._remove(usn)
+        self._entries[usn] = entry
+        self._by_ip.setdefault(entry['ip'], set()).add(usn)
+
+    def _remove(self, usn):
+        entry = self._entries.pop(usn, None)
+        if entry is None:
+            return None
+
+        usns = self._by_ip.get(entry['ip'])
+        if usns is not None:
+            usns.discard(usn)
+            if not usns:
+                del self._by_ip[entry['ip']]
+
+        return entry
+
+    def load(self):
+        """Reads the cache file, expired entries are dropped."""
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            logger.debug('unable to read discovery cache ' + self.path)
+            return
+
+        with self._lock:
+            self._entries.clear()
+            self._by_ip.clear()
+
+            for entry in entries:
+                self._add(entry)
+
+            self.expire()
+
+    def save(self):
+        """Writes the cache file."""
+        if self.path is None:
+            return
+
+        with self._lock:
+            self.expire()
+            data = json.dumps(list(self._entries.values()), indent=4)
+
+        # written to a temporary file first so a crash never leaves a
+        # half written file behind
+        tmp_path = self.path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+
+            if os.path.exists(self.path) and os.name == 'nt':
+                os.remove(self.path)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            logger.debug('unable to save discovery cache ' + self.path)
+
+    def update(self, ip, headers, now=None):
+        """
+        Adds, refreshes or removes a device using the headers of an SSDP
+        packet.
+
+        :param ip: IP address the packet came from
+        :type ip: `str`
+        :param headers: headers of the packet, the case of the names does
+            not matter
+        :type headers: `dict`
+        :param now: optional, time the packet was received
+        :type now: `float`
+        :return: `True` if the cache changed
+        :rtype: `bool`
+        """
+        headers = dict(
+            (key.upper(), value.strip() if value else value)
+            for key, value in headers.items()
+        )
+
+        usn = headers.get('USN')
+        if not usn:
+            return False
+
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            if headers.get('NTS') == 'ssdp:byebye':
+                return self._remove(usn) is not None
+
+            location = headers.get('LOCATION')
+            if not location:
+                return False
+
+            old = self._entries.get(usn)
+            bootid = headers.get('BOOTID.UPNP.ORG')
+            locations = [location]
+
+            # some devices send the same USN for all of their locations,
+            # they are only thrown out when the device has rebooted
+            if (
+                old is not None and
+                old['ip'] == ip and
+                old['bootid'] == bootid
+            ):
+                locations = old['locations'][:]
+                if location not in locations:
+                    locations.append(location)
+
+            entry = dict(
+                usn=usn,
+                ip=ip,
+                locations=locations,
+                server=headers.get('SERVER'),
+                bootid=bootid,
+                configid=headers.get('CONFIGID.UPNP.ORG'),
+                expires=now + parse_max_age(headers.get('CACHE-CONTROL'))
+            )
+            self._add(entry)
+
+            if old is None:
+                return True
+
+            # the expiry alone changing is not a change
+            return any(
+                old.get(key) != entry[key]
+                for key in ('ip', 'locations', 'server', 'bootid', 'configid')
+            )
+
+    def remove(self, usn=None, ip=None):
+        """
+        Removes a device.
+
+        :param usn: USN of the device
+        :type usn: `str`
+        :param ip: removes everything at this IP address
+        :type ip: `str`
+        """
+        with self._lock:
+            if usn is not None:
+                self._remove(usn)
+            if ip is not None:
+                for usn in list(self._by_ip.get(ip, ())):
+                    self._remove(usn)
+
+    def expire(self, now=None):
+        """
+        Removes the devices whose max-age has run out.
+
+        :return: USN's that were removed
+        :rtype: `list`
+        """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            expired = list(
+                usn for usn, entry in self._entries.items()
+                if entry['expires'] <= now
+            )
+            for usn in expired:
+                self._remove(usn)
+
+        return expired
+
+    def get(self, usn):
+        """
+        Gets a device that has not expired.
+
+        :return: `None` or a copy of the entry
+        :rtype: `dict`
+        """
+        with self._lock:
+            entry = self._entries.get(usn)
+            if entry is None or entry['expires'] <= time.time():
+                return None
+            return dict(entry)
+
+    def find(self, location):
+        """
+        Gets the device a location belongs to.
+
+        :param location: the location
+        :type location: `str`
+        :return: `None` or a copy of the entry
+        :rtype: `dict`
+        """
+        now = time.time()
+
+        with self._lock:
+            for entry in self._entries.values():
+                if entry['expires'] > now and location in entry['locations']:
+                    return dict(entry)
+
+        return None
+
+    def locations(self, ip):
+        """
+        Gets the locations of the devices at an IP address.
+
+        :param ip: IP address
+        :type ip: `str`
+        :return: empty if nothing that has not expired is known
+        :rtype: `list`
+        """
+        now = time.time()
+        locations = []
+
+        with self._lock:
+            for usn in sorted(self._by_ip.get(ip, ())):
+                entry = self._entries[usn]
+                if entry['expires'] <= now:
+                    continue
+
+                for location in entry['locations']:
+                    if location not in locations:
+                        locations.append(location)
+
+        return locations
+
+    def devices(self):
+        """
+        Gets every device that has not expired.
+
+        :return: IP address -> locations
+        :rtype: `dict`
+        """
+        with self._lock:
+            self.expire()
+            return dict((ip, self.locations(ip)) for ip in self._by_ip)
+
+    def __contains__(self, ip):
+        return bool(self.locations(ip))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Gets the shared `DiscoveryCache`.
+
+    The cache file is read from the ``UPNP_DEVICE_CACHE`` environment
+    variable, without it the cache only lasts as long as the process.
+
+    :rtype: `DiscoveryCache`
+    """
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiscoveryCache(os.environ.get(ENVIRONMENT_VARIABLE))
+
+        return _cache
+
+
+def set_cache(cache):
+    """
+    Replaces the shared `DiscoveryCache`.
+
+    :param cache: cache to use
+    :type cache: `DiscoveryCache`
+    """
+    global _cache
+
+    with _cache_lock:
+        _cache = cache
@@ -1,25 +1,53 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function
+import errno
+import select
 import socket
-import threading
+import time
 import ifaddr
 import ipaddress
 import sys
-import os
 
 import logging
-import json
+
+try:
+    import selectors
+except ImportError:
+    # Python 2
+    selectors = None
+
+from .cache import get_cache
+from .dump import open_writer
+from . import ssdp
 
 logger = logging.getLogger('UPNP_Devices')
 
 if sys.platform.startswith('win'):
     IPPROTO_IPV6 = 41
+    IPV6_MULTICAST_IF = getattr(socket, 'IPV6_MULTICAST_IF', 9)
 else:
     IPPROTO_IPV6 = getattr(socket, 'IPPROTO_IPV6')
+    IPV6_MULTICAST_IF = getattr(socket, 'IPV6_MULTICAST_IF')
+
+SSDP_PORT = 1900
+
+# how long a device has to be quiet before all of its locations are
+# considered to have arrived
+SETTLE_TIME = 0.3
+
+# number of times a search is sent, UDP packets do get lost
+MULTICAST_REPEAT = 5
+UNICAST_REPEAT = 2
+
+# the answers of a few hundred devices arrive all at once, anything that
+# does not fit in the receive buffer of the socket is dropped
+RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
 
 IPV4_MCAST_GRP = "239.255.255.250"
-IPV6_MCAST_GRP = "[ff02::c]"
+# link-local and site-local SSDP groups
+IPV6_MCAST_GRP = "ff02::c"
+IPV6_SITE_MCAST_GRP = "ff05::c"
 
 IPV4_SSDP = '''\
 M-SEARCH * HTTP/1.1\r
@@ -41,212 +69,566 @@ Content-Length: 0\r
 \r
 '''
 
+IPV6_SITE_SSDP = '''\
+M-SEARCH * HTTP/1.1\r
+ST: upnp:rootdevice\r
+MAN: "ssdp:discover"\r
+HOST: [ff05::c]:1900\r
+MX: 1\r
+Content-Length: 0\r
+\r
+'''
 
-def discover(timeout=5, log_level=None, search_ips=(), dump=''):
-    if dump and not os.path.exists(dump):
-        os.makedirs(dump)
 
-    if log_level is not None:
-        logging.basicConfig(format="%(message)s", level=log_level)
-        if log_level is not None:
-            logger.setLevel(log_level)
+class Poller(object):
+    """
+    Waits on a number of sockets at the same time.
 
-    found = {}
-    found_event = threading.Event()
-    threads = []
+    Uses `selectors` (epoll/kqueue) when it is available and falls back
+    to `select.select` on Python 2.
+    """
+
+    def __init__(self):
+        if selectors is None:
+            self._selector = None
+            self._socks = set()
+            self._write_socks = set()
+        else:
+            self._selector = selectors.DefaultSelector()
+
+    def register(self, sock, write=False):
+        """
+        :param write: wait for the socket to be writable (a non blocking
+            connect finishing) instead of readable
+        """
+        if self._selector is None:
+            if write:
+                self._write_socks.add(sock)
+            else:
+                self._socks.add(sock)
+        elif write:
+            self._selector.register(sock, selectors.EVENT_WRITE)
+        else:
+            self._selector.register(sock, selectors.EVENT_READ)
+
+    def unregister(self, sock):
+        if self._selector is None:
+            self._socks.discard(sock)
+            self._write_socks.discard(sock)
+        else:
+            self._selector.unregister(sock)
+
+    def poll(self, timeout):
+        if self._selector is None:
+            if not self._socks and not self._write_socks:
+                time.sleep(timeout)
+                return []
+
+            readable, writable, errored = select.select(
+                list(self._socks),
+                list(self._write_socks),
+                list(self._write_socks),
+                timeout
+            )
+            return list(set(readable + writable + errored))
+
+        return list(key.fileobj for key, _ in self._selector.select(timeout))
+
+    def close(self):
+        if self._selector is not None:
+            self._selector.close()
+
+
+def _get_adapter_ips(ipv6=False):
+    """
+    :param ipv6: get the IPv6 addresses instead, each one as a tuple of
+        (address, flowinfo, scope id, interface index)
+    :rtype: `list`
+    """
     adapter_ips = []
 
     for adapter in ifaddr.get_adapters():
         for adapter_ip in adapter.ips:
-            if (
-                isinstance(adapter_ip.ip, tuple) or
-                adapter_ip.nice_name == 'lo0'
-            ):
-                # adapter_ips += [adapter_ip.ip[0]]
+            if adapter_ip.nice_name == 'lo0':
                 continue
-            else:
-                adapter_ips += [adapter_ip.ip]
-
-    def convert_ssdp_response(packet, addr):
-        packet_type, packet = packet.decode('utf-8').split('\n', 1)
-        if '200 OK' in packet_type:
-            packet_type = 'response'
-        elif 'MSEARCH' in packet_type:
-            packet_type = 'search'
-        elif 'NOTIFY' in packet_type:
-            packet_type = 'notify'
-        else:
-            packet_type = 'unknown'
 
-        packet = dict(
-            (
-                line.split(':', 1)[0].strip().upper(),
-                line.split(':', 1)[1].strip()
-            ) for line in packet.split('\n') if line.strip()
+            if not isinstance(adapter_ip.ip, tuple):
+                if not ipv6:
+                    adapter_ips += [adapter_ip.ip]
+                continue
+
+            if not ipv6:
+                continue
+
+            ip, flowinfo, scope_id = adapter_ip.ip
+
+            # the loopback adapter does not do multicast
+            if ip == '::1':
+                continue
+
+            index = getattr(adapter, 'index', None) or scope_id
+            adapter_ips += [(ip, flowinfo, scope_id, index)]
+
+    return adapter_ips
+
+
+def _strip_scope(address):
+    # "fe80::1%eth0" -> "fe80::1", the address a packet comes from does not
+    # have the scope attached to it
+    return address.split('%', 1)[0]
+
+
+def _is_ipv6(address):
+    address = _strip_scope(address)
+    try:
+        network = ipaddress.ip_network(address.decode('utf-8'))
+    except:
+        network = ipaddress.ip_network(address)
+
+    return isinstance(network, ipaddress.IPv6Network)
+
+
+def _unicast_address(address, ipv6):
+    if not ipv6:
+        return address, SSDP_PORT
+
+    # resolves the scope of a link-local address, "fe80::1%eth0"
+    return socket.getaddrinfo(
+        address,
+        SSDP_PORT,
+        socket.AF_INET6,
+        socket.SOCK_DGRAM
+    )[0][4]
+
+
+def _create_socket(ipv6):
+    if ipv6:
+        sock = socket.socket(
+            family=socket.AF_INET6,
+            type=socket.SOCK_DGRAM,
+            proto=socket.IPPROTO_IP
+        )
+        sock.setsockopt(IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, 1)
+    else:
+        sock = socket.socket(
+            family=socket.AF_INET,
+            type=socket.SOCK_DGRAM,
+            proto=socket.IPPROTO_UDP
+        )
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    try:
+        # the OS caps this at its own limit
+        sock.setsockopt(
+            socket.SOL_SOCKET,
+            socket.SO_RCVBUF,
+            RECEIVE_BUFFER_SIZE
         )
+        size = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    except socket.error:
+        size = None
+
+    # Linux reports twice what it has been asked for
+    if size is not None and size < RECEIVE_BUFFER_SIZE:
+        logger.debug(
+            'SSDP: the receive buffer is ' + str(size) + ' bytes, '
+            'answers get dropped when a lot of devices answer at once. '
+            'Raise net.core.rmem_max to make it bigger.'
+        )
+
+    sock.setblocking(0)
+    return sock
 
-        packet['TYPE'] = packet_type
 
-        if dump:
-            with open(os.path.join(dump, 'SSDP.log'), 'a') as f:
-                f.write(json.dumps(packet, indent=4) + '\n')
+def _create_ipv6_socket(adapter_ip):
+    # the interface has to be set for a link-local group, otherwise the
+    # search goes out of whatever adapter the routing table picks
+    ip, flowinfo, scope_id, index = adapter_ip
 
-        logger.debug('SSDP: inbound packet for IP ' + addr)
-        logger.debug(json.dumps(packet, indent=4))
+    sock = _create_socket(True)
+    try:
+        sock.setsockopt(IPPROTO_IPV6, IPV6_MULTICAST_IF, index)
+        sock.bind((ip, 0, flowinfo, scope_id))
+    except socket.error:
+        sock.close()
+        raise
 
-        return packet
+    return sock
 
-    def send_to(destination, t_out=5):
+
+def _send_search(sock, address, ssdp_packet, count=MULTICAST_REPEAT):
+    logger.debug('SSDP: %s\n%s', address[0], ssdp_packet)
+
+    for _ in range(count):
         try:
-            network = ipaddress.ip_network(destination.decode('utf-8'))
-        except:
-            network = ipaddress.ip_network(destination)
-
-        if isinstance(network, ipaddress.IPv6Network):
-            mcast = IPV6_MCAST_GRP
-            ssdp_packet = IPV6_SSDP
-            sock = socket.socket(
-                family=socket.AF_INET6,
-                type=socket.SOCK_DGRAM,
-                proto=socket.IPPROTO_IP
+            sock.sendto(ssdp_packet.encode('utf-8'), address)
+        except socket.error as err:
+            if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                continue
+            logger.debug(
+                'SSDP: unable to send to ' + str(address[0]) + ': ' + str(err)
             )
-            sock.setsockopt(IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, 1)
+            return False
+
+    return True
+
+
+def discover(
+    timeout=5,
+    log_level=None,
+    search_ips=(),
+    dump='',
+    stop_after=None,
+    settle=0.0,
+    cache=None
+):
+    """
+    Searches for UPNP devices.
+
+    Everything runs in the calling thread, a single `selectors` loop waits
+    on the socket of every adapter plus one unicast socket per address
+    family. Each device that answers the multicast search is sent a unicast
+    search so all of its locations are found. The search ends exactly
+    `timeout` seconds after it was started.
+
+    IPv6 adapters search the link-local (``ff02::c``) and the site-local
+    (``ff05::c``) groups. A device that answers on more then one address,
+    IPv4 and IPv6 on a dual stack network, is recognized by the uuid in
+    its USN and is only yielded once, under the address it answered from
+    first.
+
+    A device is yielded as soon as its first location comes in. The list
+    of locations that gets yielded is added to as more locations come in
+    for as long as the generator keeps getting iterated. Set `settle` to
+    have a device held back until it has not sent a new location for that
+    many seconds, so the list is complete when the device is yielded.
+
+    Devices in the `DiscoveryCache` that have not expired are yielded
+    right away and are not asked again. When every one of the
+    `search_ips` is in the cache no packets are sent at all.
+
+    :param timeout: seconds to search for
+    :type timeout: `float`
+    :param log_level: optional, logging level
+    :param search_ips: optional, only look for these IP addresses, a
+        link-local IPv6 address needs its scope, ``"fe80::1%eth0"``
+    :type search_ips: iterable of `str`
+    :param dump: optional, archive or folder the SSDP packets get logged
+        to, see `UPNP_Device.dump`
+    :type dump: `str` or `UPNP_Device.dump.DumpWriter`
+    :param stop_after: optional, stop once this many devices are found
+    :type stop_after: `int`
+    :param settle: seconds a device has to be quiet before it is yielded
+    :type settle: `float`
+    :param cache: optional, defaults to the shared cache, `False` to not
+        use a cache
+    :type cache: `DiscoveryCache`
+    :return: yields (IP address, [locations]). When `search_ips` is given
+        the search stops as soon as all of them have been yielded.
+    """
+    if log_level is not None:
+        logging.basicConfig(format="%(message)s", level=log_level)
+        if log_level is not None:
+            logger.setLevel(log_level)
 
+    deadline = time.time() + timeout
+    targets = list(search_ips)
+    search_ips = list(_strip_scope(ip) for ip in targets)
+    # IP address -> locations
+    found = {}
+    searched = set()
+    yielded = set()
+    # uuid of the USN -> IP address the device is yielded under
+    usn_ips = {}
+    # IP address -> IP address of the same device that answered first
+    aliases = {}
+
+    if cache is None:
+        cache = get_cache()
+    elif cache is False:
+        cache = None
+
+    if cache is not None:
+        if search_ips:
+            cached = list((ip, cache.locations(ip)) for ip in search_ips)
         else:
-            mcast = IPV4_MCAST_GRP
-            ssdp_packet = IPV4_SSDP
-            sock = socket.socket(
-                family=socket.AF_INET,
-                type=socket.SOCK_DGRAM,
-                proto=socket.IPPROTO_UDP
-            )
-            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            cached = list(cache.devices().items())
 
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        for ip_addr, locations in cached:
+            if not locations:
+                continue
 
-        if destination in adapter_ips:
-            sock.bind((destination, 0))
-            destination = mcast
+            found[ip_addr] = locations
+            searched.add(ip_addr)
+            yielded.add(ip_addr)
+            yield ip_addr, locations
 
-        sock.settimeout(t_out)
+            if stop_after is not None and len(yielded) >= stop_after:
+                return
 
-        logger.debug('SSDP: %s\n%s', destination, ssdp_packet)
-        for _ in range(5):
-            sock.sendto(ssdp_packet.encode('utf-8'), (destination, 1900))
-        return sock
+        if search_ips and yielded.issuperset(search_ips):
+            return
 
-    def do(local_address, target_ips):
-        try:
-            sock = send_to(local_address)
-        except:
-            threads.remove(threading.current_thread())
+    cache_updated = []
+
+    poller = Poller()
+    # socket -> `True` for the multicast (adapter) sockets
+    multicast = {}
+    # address family -> unicast socket, shared by every device
+    unicast = {}
+
+    def search_device(ip_addr, address=None):
+        searched.add(_strip_scope(ip_addr))
+        ipv6 = _is_ipv6(ip_addr)
+
+        if ipv6 not in unicast:
+            try:
+                sock = _create_socket(ipv6)
+            except socket.error:
+                return
+            unicast[ipv6] = sock
+            multicast[sock] = False
+            poller.register(sock)
+
+        if address is None:
+            try:
+                address = _unicast_address(ip_addr, ipv6)
+            except socket.error:
+                logger.debug('SSDP: unable to resolve ' + ip_addr)
+                return
+        elif ipv6:
+            # answers to the search, the scope comes along with them
+            address = (address[0], SSDP_PORT) + tuple(address[2:])
+        else:
+            address = (address[0], SSDP_PORT)
 
-            if not threads:
-                found_event.set()
+        _send_search(
+            unicast[ipv6],
+            address,
+            IPV6_SSDP if ipv6 else IPV4_SSDP,
+            UNICAST_REPEAT
+        )
 
-            return
+    # the devices being searched for get asked directly, there is no need
+    # to ask the whole network
+    for adapter_ip in [] if search_ips else _get_adapter_ips():
+        try:
+            sock = _create_socket(False)
+            sock.bind((adapter_ip, 0))
+        except socket.error:
+            continue
+
+        if _send_search(sock, (IPV4_MCAST_GRP, SSDP_PORT), IPV4_SSDP):
+            multicast[sock] = True
+            poller.register(sock)
+        else:
+            sock.close()
 
-        for target_ip in target_ips:
-            found[target_ip] = set()
-            trd = threading.Thread(target=found_thread, args=(target_ip,))
-            trd.daemon = True
-            threads.append(trd)
-            trd.start()
+    for adapter_ip in [] if search_ips else _get_adapter_ips(ipv6=True):
         try:
-            while True:
-                data, addr = sock.recvfrom(1024)
+            sock = _create_ipv6_socket(adapter_ip)
+        except socket.error:
+            logger.debug('SSDP: unable to bind to ' + adapter_ip[0])
+            continue
 
-                if target_ips and addr[0] not in target_ips:
-                    continue
+        scope_id = adapter_ip[2]
+        sent = False
 
-                packet = convert_ssdp_response(data, addr[0])
+        for group, ssdp_packet in (
+            (IPV6_MCAST_GRP, IPV6_SSDP),
+            (IPV6_SITE_MCAST_GRP, IPV6_SITE_SSDP)
+        ):
+            address = (group, SSDP_PORT, 0, scope_id)
+            if _send_search(sock, address, ssdp_packet):
+                sent = True
 
-                if packet['TYPE'] != 'response' or 'LOCATION' not in packet:
-                    continue
+        if sent:
+            multicast[sock] = True
+            poller.register(sock)
+        else:
+            sock.close()
 
-                if addr[0] not in found:
-                    found[addr[0]] = set()
-                    trd = threading.Thread(
-                        target=found_thread,
-                        args=(addr[0],)
-                    )
-                    trd.daemon = True
-                    threads.append(trd)
-                    trd.start()
+    for target_ip in targets:
+        if _strip_scope(target_ip) not in searched:
+            search_device(target_ip)
 
-                found[addr[0]].add(packet['LOCATION'])
+    buf = ssdp.create_buffer()
 
-        except socket.timeout:
-            pass
+    def merge(ip_addr, usn):
+        # gets the address the device is known by
+        ip_addr = aliases.get(ip_addr, ip_addr)
 
-        except socket.error:
-            import traceback
+        if not usn:
+            return ip_addr
 
-            logger.debug(traceback.format_exc())
+        uuid = usn.split('::', 1)[0]
+        first_ip = usn_ips.setdefault(uuid, ip_addr)
 
-        try:
-            sock.close()
-        except socket.error:
-            pass
+        if first_ip != ip_addr and ip_addr not in found:
+            aliases[ip_addr] = first_ip
+            return first_ip
 
-        threads.remove(threading.current_thread())
+        return ip_addr
 
-        if not threads:
-            found_event.set()
+    def done():
+        return yielded.union(aliases).issuperset(search_ips)
 
-    def found_thread(ip_addr):
-        try:
-            sock = send_to(ip_addr, timeout)
-        except OSError:
-            threads.remove(threading.current_thread())
+    def read(sock):
+        # reads everything that is waiting on the socket
+        locations = []
 
-            if not threads:
-                found_event.set()
-            return
+        for packet, addr in ssdp.receive(sock, buf):
+            ip_addr = _strip_scope(addr[0])
 
-        try:
-            while True:
-                data, addr = sock.recvfrom(1024)
+            if search_ips and ip_addr not in search_ips:
+                continue
 
-                packet = convert_ssdp_response(data, addr[0])
+            if packet.type != ssdp.TYPE_RESPONSE:
+                continue
 
-                if packet['TYPE'] != 'response' or 'LOCATION' not in packet:
-                    continue
+            if writer is not None:
+                writer.add_packet(ip_addr, packet.to_dict())
+
+            location = packet.get('LOCATION')
+            if location is None:
+                continue
+
+            if multicast[sock]:
+                if ip_addr not in searched:
+                    search_device(ip_addr, addr)
+            elif location.count('/') == 2 and location.startswith('http'):
+                continue
+
+            ip_addr = merge(ip_addr, packet.get('USN'))
+
+            if cache is not None:
+                cache.update(ip_addr, packet.headers)
+                cache_updated.append(True)
+
+            locations += [(ip_addr, location)]
+
+        return locations
+
+    # IP addresses in the order they answered, until they are yielded
+    pending = []
+    last_seen = {}
 
-                if (
-                    packet['LOCATION'].count('/') == 2 and
-                    packet['LOCATION'].startswith('http')
-                ):
+    writer, owned_writer = open_writer(dump)
 
+    try:
+        while True:
+            now = time.time()
+
+            for ip_addr in pending[:]:
+                if now - last_seen[ip_addr] < settle:
                     continue
 
-                found[addr[0]].add(packet['LOCATION'])
+                pending.remove(ip_addr)
+                yielded.add(ip_addr)
+                yield ip_addr, found[ip_addr]
 
-        except socket.error:
-            pass
+                if stop_after is not None and len(yielded) >= stop_after:
+                    return
 
-        threads.remove(threading.current_thread())
+            if search_ips and done():
+                return
 
-        if not threads:
-            found_event.set()
+            now = time.time()
+            remaining = deadline - now
+            if remaining <= 0:
+                break
 
-    for adapter_ip in adapter_ips:
-        t = threading.Thread(
-            target=do,
-            args=(adapter_ip, search_ips)
-        )
-        t.daemon = True
-        threads += [t]
-        t.start()
+            if pending:
+                remaining = min(
+                    remaining,
+                    min(last_seen[ip_addr] for ip_addr in pending) +
+                    settle - now
+                )
 
-    found_event.wait()
+            for sock in poller.poll(max(remaining, 0)):
+                for ip_addr, location in read(sock):
+                    if ip_addr not in found:
+                        found[ip_addr] = []
 
-    for ip, locations in found.items():
-        locations = list(loc for loc in locations)
-        if not locations:
-            continue
+                    if location in found[ip_addr]:
+                        continue
+
+                    found[ip_addr].append(location)
+                    last_seen[ip_addr] = time.time()
+
+                    if writer is not None:
+                        writer.add_location(ip_addr, location)
+
+                    if ip_addr not in yielded and ip_addr not in pending:
+                        pending.append(ip_addr)
+
+        # the time is up, whatever has not settled yet goes out as is
+        for ip_addr in pending:
+            yield ip_addr, found[ip_addr]
+    finally:
+        poller.close()
+
+        for sock in multicast:
+            try:
+                sock.close()
+            except socket.error:
+                pass
+
+        if cache_updated:
+            cache.save()
+
+        if owned_writer:
+            writer.close()
+
+
+class AsyncDiscover(object):
+    """
+    `discover` as an asynchronous iterator (Python 3 only).
+
+    The search runs in the event loop's default executor, a device is
+    handed out as soon as `discover` yields it.
+
+    >>> async for ip, locations in AsyncDiscover(5, stop_after=1):
+    >>>     print(ip, locations)
+
+    Takes the same parameters as `discover`.
+    """
+    _done = object()
+
+    def __init__(self, *args, **kwargs):
+        self._generator = discover(*args, **kwargs)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def on_done(f):
+            if future.cancelled():
+                return
+            if f.cancelled():
+                future.cancel()
+            elif f.exception() is not None:
+                future.set_exception(f.exception())
+            elif f.result() is self._done:
+                future.set_exception(StopAsyncIteration())
+            else:
+                future.set_result(f.result())
+
+        loop.run_in_executor(
+            None,
+            next,
+            self._generator,
+            self._done
+        ).add_done_callback(on_done)
 
-        yield ip, locations
+        return future
 
 
 if __name__ == '__main__':
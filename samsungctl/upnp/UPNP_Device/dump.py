@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+"""
+Dumps of what discovery saw, for debugging a device without having it.
+
+Everything goes through a `DumpWriter`. The SSDP packets and the XML
+files get handed to a queue and a single thread writes them out, so the
+search never waits on the disk. The queue has a limit, when the disk
+falls that far behind whatever is adding to it waits, which keeps the
+memory that is used bounded no matter how big the network is.
+
+The dump is a single compressed archive when the path ends with
+``.zip``, ``.tar.gz`` or ``.tgz`` and a folder otherwise. Either way it
+holds
+
+* ``index.json``: IP address -> USN, SERVER, locations and the files
+  of the device
+* ``ssdp.jsonl``: every SSDP packet, one JSON object per line
+* ``<IP address>/<path>.xml``: the description and SCPD files
+
+`DumpReader` reads any of them back.
+
+>>> with DumpWriter('network.zip') as writer:
+>>>     for device in discover(dump=writer):
+>>>         pass
+>>>
+>>> for ip, locations in DumpReader('network.zip').replay():
+>>>     print(ip, locations)
+"""
+
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+logger = logging.getLogger('UPNP_Devices')
+
+INDEX_FILE = 'index.json'
+SSDP_FILE = 'ssdp.jsonl'
+
+# most items waiting to be written
+MAX_QUEUE = 256
+
+# SSDP packets are held in memory up to this size, after that they go to
+# a temporary file until the archive is closed
+SPOOL_SIZE = 1024 * 1024
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar.gz', '.tgz')
+
+_CLOSE = object()
+
+
+def is_archive(path):
+    """
+    :return: `True` if the path is a zip or tar.gz file
+    :rtype: `bool`
+    """
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def file_name(url):
+    """
+    Gets the name a file is saved under in a dump.
+
+    :param url: url the file came from
+    :type url: `str`
+    :return: ``"<IP address>/<path>.xml"``
+    :rtype: `str`
+    """
+    parsed_url = urlparse(url)
+    host = parsed_url.hostname or ''
+    path = parsed_url.path.strip('/') or 'index'
+
+    if not path.endswith('.xml'):
+        path += '.xml'
+
+    # a ":" in an IPv6 address is not allowed in a windows file name
+    return host.replace(':', '_') + '/' + path
+
+
+class _Folder(object):
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self._ssdp = open(os.path.join(path, SSDP_FILE), 'a')
+
+    def add_packet(self, line):
+        self._ssdp.write(line)
+
+    def add_file(self, name, data):
+        path = os.path.join(self.path, *name.split('/'))
+        folder = os.path.dirname(path)
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def close(self, index):
+        self._ssdp.close()
+
+        path = os.path.join(self.path, INDEX_FILE)
+
+        # the folder can be dumped to more then once
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                try:
+                    old_index = json.load(f)
+                except ValueError:
+                    old_index = {}
+
+            old_index.update(index)
+            index = old_index
+
+        with open(path, 'w') as f:
+            json.dump(index, f, indent=4)
+
+
+class _Archive(object):
+
+    def __init__(self, path):
+        self.path = path
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._ssdp = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+
+        if path.lower().endswith('.zip'):
+            self._zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+            self._tar = None
+        else:
+            self._zip = None
+            self._tar = tarfile.open(path, 'w:gz')
+
+    def add_packet(self, line):
+        self._ssdp.write(line.encode('utf-8'))
+
+    def add_file(self, name, data, fileobj=None):
+        if self._zip is not None:
+            if fileobj is None:
+                self._zip.writestr(name, data)
+            elif sys.version_info >= (3, 6):
+                # copied over in pieces so the SSDP packets are never in
+                # memory all at once
+                info = zipfile.ZipInfo(name, time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                fileobj.seek(0, os.SEEK_END)
+                info.file_size = fileobj.tell()
+                fileobj.seek(0)
+
+                with self._zip.open(info, 'w') as f:
+                    shutil.copyfileobj(fileobj, f)
+            else:
+                # python 2 can not write to a file in a zip
+                self._zip.writestr(name, fileobj.read())
+            return
+
+        info = tarfile.TarInfo(name)
+        info.mtime = time.time()
+
+        if fileobj is None:
+            info.size = len(data)
+            fileobj = io.BytesIO(data)
+        else:
+            fileobj.seek(0, os.SEEK_END)
+            info.size = fileobj.tell()
+            fileobj.seek(0)
+
+        self._tar.addfile(info, fileobj)
+
+    def close(self, index):
+        self._ssdp.seek(0)
+        self.add_file(SSDP_FILE, None, self._ssdp)
+        self._ssdp.close()
+
+        self.add_file(
+            INDEX_FILE,
+            json.dumps(index, indent=4).encode('utf-8')
+        )
+
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
+
+
+class DumpWriter(object):
+    """
+    Writes a dump from a thread of its own.
+
+    :param path: archive file (``.zip``, ``.tar.gz`` or ``.tgz``) or
+        folder to write to. An archive gets overwritten.
+    :type path: `str`
+    :param max_queue: most items waiting to be written before adding
+        another one waits
+    :type max_queue: `int`
+    """
+
+    def __init__(self, path, max_queue=MAX_QUEUE):
+        self.path = path
+
+        if is_archive(path):
+            self._backend = _Archive(path)
+        else:
+            self._backend = _Folder(path)
+
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        # IP address -> index entry
+        self._index = {}
+        self._files = set()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _CLOSE:
+                break
+
+            method, args = item
+            try:
+                method(*args)
+            except Exception:
+                logger.exception('DUMP: unable to write to ' + self.path)
+
+    def _device(self, ip):
+        device = self._index.get(ip)
+
+        if device is None:
+            device = self._index[ip] = dict(
+                usn=None,
+                server=None,
+                locations=[],
+                files={}
+            )
+
+        return device
+
+    def _put(self, method, *args):
+        if self._closed:
+            logger.debug('DUMP: ' + self.path + ' is closed')
+            return
+
+        self._queue.put((method, args))
+
+    def add_packet(self, ip, packet):
+        """
+        Adds an SSDP packet.
+
+        :param ip: IP address the packet came from
+        :type ip: `str`
+        :param packet: headers of the packet
+        :type packet: `dict`
+        """
+        with self._lock:
+            device = self._device(ip)
+            usn = packet.get('USN')
+            if usn and device['usn'] is None:
+                device['usn'] = usn.split('::', 1)[0]
+
+            if packet.get('SERVER'):
+                device['server'] = packet['SERVER']
+
+        line = json.dumps(
+            dict(ip=ip, time=time.time(), packet=packet),
+            sort_keys=True
+        ) + '\n'
+
+        self._put(self._backend.add_packet, line)
+
+    def add_location(self, ip, location):
+        """
+        Adds a location of a device to the index.
+
+        :param ip: IP address of the device
+        :type ip: `str`
+        :param location: the location
+        :type location: `str`
+        """
+        with self._lock:
+            locations = self._device(ip)['locations']
+            if location not in locations:
+                locations.append(location)
+
+    def add_file(self, url, content, ip=None):
+        """
+        Adds a description or SCPD file.
+
+        :param url: url the file came from
+        :type url: `str`
+        :param content: contents of the file
+        :type content: `str` or `bytes`
+        :param ip: optional, IP address of the device, taken from the url
+            when not given
+        :type ip: `str`
+        """
+        name = file_name(url)
+
+        if ip is None:
+            ip = urlparse(url).hostname
+
+        with self._lock:
+            self._device(ip)['files'][url] = name
+
+            # a file that is shared by a number of services only gets
+            # written once
+            if name in self._files:
+                return
+            self._files.add(name)
+
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+
+        self._put(self._backend.add_file, name, content)
+
+    def close(self):
+        """Writes out everything that is waiting and closes the dump."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+        with self._lock:
+            index = dict(self._index)
+
+        self._backend.close(index)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def open_writer(dump):
+    """
+    Gets the writer for the dump parameter that discovery takes.
+
+    :param dump: `DumpWriter`, path to an archive or folder, or empty
+    :return: (`DumpWriter` or `None`, `True` if the caller has to close it)
+    :rtype: `tuple`
+    """
+    if not dump:
+        return None, False
+
+    if isinstance(dump, DumpWriter):
+        return dump, False
+
+    return DumpWriter(dump), True
+
+
+class DumpReader(object):
+    """
+    Reads a dump made by `DumpWriter`.
+
+    :param path: archive file or folder
+    :type path: `str`
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = None
+        self._tar = None
+
+        if not is_archive(path):
+            pass
+        elif path.lower().endswith('.zip'):
+            self._zip = zipfile.ZipFile(path, 'r')
+        else:
+            self._tar = tarfile.open(path, 'r:gz')
+
+        data = self._read(INDEX_FILE)
+        self.index = json.loads(data.decode('utf-8')) if data else {}
+
+    def _read(self, name):
+        try:
+            if self._zip is not None:
+                return self._zip.read(name)
+
+            if self._tar is not None:
+                f = self._tar.extractfile(name)
+                return None if f is None else f.read()
+
+            with open(os.path.join(self.path, *name.split('/')), 'rb') as f:
+                return f.read()
+
+        except (KeyError, IOError, OSError):
+            return None
+
+    def devices(self):
+        """
+        :return: IP addresses of the devices in the dump
+        :rtype: `list`
+        """
+        return list(self.index.keys())
+
+    def packets(self):
+        """
+        Reads the SSDP packets in the order they came in.
+
+        :return: yields (IP address, packet headers)
+        """
+        data = self._read(SSDP_FILE)
+        if not data:
+            return
+
+        for line in data.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+
+            item = json.loads(line)
+            yield item['ip'], item['packet']
+
+    def read(self, url):
+        """
+        Gets a file by the url it came from.
+
+        :return: `None` if the file is not in the dump
+        :rtype: `bytes`
+        """
+        for device in self.index.values():
+            name = device['files'].get(url)
+            if name is not None:
+                return self._read(name)
+
+        return self._read(file_name(url))
+
+    def replay(self):
+        """
+        Replays the discovery that made the dump.
+
+        :return: yields (IP address, [locations]) the same as
+            `UPNP_Device.discover.discover` did
+        """
+        for ip, device in self.index.items():
+            if device['locations']:
+                yield ip, device['locations'][:]
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
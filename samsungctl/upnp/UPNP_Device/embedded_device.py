@@ -1,15 +1,50 @@
 # -*- coding: utf-8 -*-
 try:
     from .icon import Icon
-    from .service import Service
+    from .service import Service, scpd_url
 except ImportError:
     from icon import Icon
-    from service import Service
+    from service import Service, scpd_url
+
+
+def scpd_urls(url, node):
+    """
+    Gets the SCPD urls of the services of a device and of all of the
+    devices inside of it.
+
+    :param url: scheme and address of the device
+    :type url: `str`
+    :param node: ``device`` element of the description
+    :rtype: `list`
+    """
+    urls = []
+
+    services = node.find('serviceList')
+    if services is not None:
+        for service in services:
+            urls.append(
+                scpd_url(url, service.find('SCPDURL').text.replace(url, ''))
+            )
+
+    devices = node.find('deviceList')
+    if devices is not None:
+        for device in devices:
+            urls.extend(scpd_urls(url, device))
+
+    return urls
 
 
 class EmbeddedDevice(object):
 
-    def __init__(self, url, node=None, parent=None, dump=''):
+    def __init__(self, url, node=None, parent=None, dump='', scpds=None):
+        """
+        :param scpds: optional, SCPD url -> SCPD file or parsed SCPD file
+            for the files that have already been fetched
+        :type scpds: `dict`
+        """
+        if scpds is None:
+            scpds = {}
+
         self.__parent = parent
         self.__services = {}
         self.__devices = {}
@@ -43,7 +78,8 @@ class EmbeddedDevice(object):
                 scpdurl,
                 service_type,
                 control_url,
-                dump=dump
+                dump=dump,
+                content=scpds.get(scpd_url(url, scpdurl))
             )
 
             name = service_id.split(':')[-1]
@@ -55,7 +91,8 @@ class EmbeddedDevice(object):
                 url,
                 node=device,
                 parent=self,
-                dump=dump
+                dump=dump,
+                scpds=scpds
             )
 
             self.__devices[device.__name__] = device
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Fetching of the description and SCPD files of a device.
+
+A TV has 6 to 10 services spread over a number of locations. They are
+all fetched at the same time over a keep-alive session that is kept for
+each host, so building the device costs about as long as the slowest
+single file instead of the sum of all of them. Inside of samsungctl that
+is the same session everything else that talks to the TV uses.
+"""
+
+import logging
+import threading
+import traceback
+
+import requests
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+try:
+    from ...utils import get_session
+except (ImportError, ValueError):
+    # used on its own, outside of samsungctl
+    get_session = None
+
+logger = logging.getLogger('UPNP_Devices')
+
+# most files fetched at once from a single device
+MAX_WORKERS = 8
+HTTP_TIMEOUT = 5.0
+
+
+def fetch(url, timeout=HTTP_TIMEOUT):
+    """
+    Gets a file.
+
+    :param url: url of the file
+    :type url: `str`
+    :param timeout: seconds to wait for the device
+    :type timeout: `float`
+    :rtype: `bytes`
+    """
+    if get_session is None:
+        return requests.get(url, timeout=timeout).content
+
+    session = get_session(urlparse(url).hostname, MAX_WORKERS)
+    return session.get(url, timeout=timeout).content
+
+
+def fetch_all(urls, max_workers=None, timeout=HTTP_TIMEOUT):
+    """
+    Gets a number of files at the same time.
+
+    If any of the files can not be fetched the error is raised once all of
+    them are done, the same error a single `requests.get` would raise.
+
+    :param urls: urls of the files
+    :type urls: iterable of `str`
+    :param max_workers: optional, most files fetched at once, defaults to
+        `MAX_WORKERS`
+    :type max_workers: `int`
+    :param timeout: seconds to wait for each file
+    :type timeout: `float`
+    :return: url -> contents of the file
+    :rtype: `dict`
+    """
+    unique = []
+    for url in urls:
+        if url not in unique:
+            unique.append(url)
+    urls = unique
+
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+
+    results = {}
+    errors = {}
+
+    if len(urls) < 2 or max_workers < 2:
+        for url in urls:
+            results[url] = fetch(url, timeout)
+        return results
+
+    tasks = queue.Queue()
+    for url in urls:
+        tasks.put(url)
+
+    def work():
+        while True:
+            try:
+                url = tasks.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                results[url] = fetch(url, timeout)
+            except Exception as err:
+                logger.debug(traceback.format_exc())
+                errors[url] = err
+
+    workers = []
+    for _ in range(min(max_workers, len(urls))):
+        t = threading.Thread(target=work)
+        t.daemon = True
+        t.start()
+        workers.append(t)
+
+    for t in workers:
+        t.join()
+
+    for url in urls:
+        if url in errors:
+            raise errors[url]
+
+    return results
@@ -3,142 +3,176 @@
 import socket
 import logging
 from errno import ENOPROTOOPT
+import sys
 import time
-import threading
-from .upnp_class import UPNPObject
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .cache import get_cache
+from . import ssdp
+from .discover import Poller, _get_adapter_ips
+from .registry import DeviceRegistry, EVENT_ADD
 
 SSDP_PORT = 1900
 SSDP_ADDR = '239.255.255.250'
 
+logger = logging.getLogger('UPNP_Devices')
 
-def listen(timeout, log_level=None):
-    logger = logging.getLogger('UPNP_Devices')
-    logger.setLevel(logging.NOTSET)
-    if log_level is not None:
-        logger.setLevel(log_level)
 
-    threads = []
-    event = threading.Event()
-    found = []
-    found_event = threading.Event()
+def get_local_addresses():
+    """
+    Gets the IPv4 addresses of the network adapters.
 
-    def do(lcl_address):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        if hasattr(socket, "SO_REUSEPORT"):
-            try:
-                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-            except socket.error as err:
-                # RHEL6 defines SO_REUSEPORT but it doesn't work
-                if err.errno == ENOPROTOOPT:
-                    pass
-                else:
-                    raise err
-
-        addr = socket.inet_aton(SSDP_ADDR)
-        interface = socket.inet_aton(lcl_address)
-        cmd = socket.IP_ADD_MEMBERSHIP
-        sock.setsockopt(socket.IPPROTO_IP, cmd, addr + interface)
-        sock.bind((lcl_address, SSDP_PORT))
-        sock.settimeout(1)
-
-        logger.debug('SSDP bound on address ' + lcl_address)
-
-        start = time.time()
-
-        while time.time() - start < timeout:
-            try:
-                data, addr = sock.recvfrom(1024)
-                if data:
-                    host, port = addr
-                    logger.debug('SSDP data: %s --> %s', host, data)
-
-                    try:
-                        header, payload = data.decode().split('\r\n\r\n')[:2]
-                    except ValueError as err:
-                        logger.error(err)
-                        continue
+    :rtype: `list`
+    """
+    return _get_adapter_ips()
 
-                    lines = header.split('\r\n')
-                    cmd = lines[0].split(' ')
-                    lines = map(lambda x: x.replace(': ', ':', 1), lines[1:])
-                    lines = filter(lambda x: len(x) > 0, lines)
 
-                    headers = [x.split(':', 1) for x in lines]
-                    headers = dict(map(lambda x: (x[0].lower(), x[1]), headers))
+def _create_socket(bind_address):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        except socket.error as err:
+            # RHEL6 defines SO_REUSEPORT but it doesn't work
+            if err.errno == ENOPROTOOPT:
+                pass
+            else:
+                raise err
+
+    sock.bind((bind_address, SSDP_PORT))
+    sock.setblocking(0)
+    return sock
+
+
+def _join(sock, lcl_address):
+    addr = socket.inet_aton(SSDP_ADDR)
+    interface = socket.inet_aton(lcl_address)
+    try:
+        sock.setsockopt(
+            socket.IPPROTO_IP,
+            socket.IP_ADD_MEMBERSHIP,
+            addr + interface
+        )
+    except socket.error:
+        logger.debug('SSDP unable to join the group on ' + lcl_address)
+        return False
+
+    logger.debug('SSDP bound on address ' + lcl_address)
+    return True
+
+
+def run_listener(registry, stop_event, addresses=None):
+    """
+    Feeds the SSDP announcements to a registry until `stop_event` is set.
+
+    All of the adapters are listened to from the calling thread.
+
+    :param registry: registry to feed
+    :type registry: `UPNP_Device.registry.DeviceRegistry`
+    :param stop_event: set to stop listening
+    :type stop_event: `threading.Event`
+    :param addresses: optional, IP addresses of the adapters to listen on
+    :type addresses: iterable of `str`
+    """
+    if addresses is None:
+        addresses = get_local_addresses()
+
+    poller = Poller()
+    socks = []
+
+    try:
+        if sys.platform.startswith('win'):
+            # windows only hands multicast packets to a socket that is
+            # bound to the adapter
+            for lcl_address in addresses:
+                sock = _create_socket(lcl_address)
+                socks += [sock]
+                _join(sock, lcl_address)
+        else:
+            sock = _create_socket('')
+            socks += [sock]
+            for lcl_address in addresses:
+                _join(sock, lcl_address)
+    except socket.error:
+        logger.error('SSDP unable to bind to port ' + str(SSDP_PORT))
+
+        for sock in socks:
+            sock.close()
+        return
 
-                    logger.debug('SSDP command %s %s - from %s:%d', cmd[0], cmd[1], host, port)
-                    logger.debug('with headers: %s.', headers)
+    for sock in socks:
+        poller.register(sock)
 
-                    if cmd[0] == 'M-SEARCH' and cmd[1] == '*':
-                        logger.debug('M-SEARCH *')
-                    elif cmd[0] == 'NOTIFY' and cmd[1] == '*':
+    cache = get_cache()
+    buf = ssdp.create_buffer()
 
-                        addr = addr[0]
+    try:
+        while not stop_event.is_set():
+            for sock in poller.poll(0.5):
+                for packet, addr in ssdp.receive(sock, buf):
+                    if packet.type != ssdp.TYPE_NOTIFY:
+                        continue
 
-                        start = data.lower().find(b'nt:')
+                    # ssdp:alive refreshes the cache, ssdp:byebye
+                    # removes the device from it
+                    cache.update(addr[0], packet.headers)
+                    registry.handle(addr[0], packet.headers)
 
-                        if start > -1:
-                            start += 3
-                            nt = data[start:]
-                            nt = nt[:nt.find(b'\n')].strip()
-                        else:
-                            continue
+            registry.expire()
+    finally:
+        poller.close()
 
-                        logger.debug('SSDP: %s found nt: %s', addr, nt)
+        for sock in socks:
+            try:
+                sock.close()
+            except socket.error:
+                pass
 
-                        if nt != b'upnp:rootdevice':
-                            continue
+        cache.save()
 
-                        start = data.lower().find(b'st:')
 
-                        if start > -1:
-                            start += 3
-                            st = data[start:]
-                            st = st[:st.find(b'\n')].strip()
-                        else:
-                            continue
+def listen(timeout, log_level=None, addresses=None):
+    """
+    Listens for devices that announce themselves.
 
-                        start = data.lower().find(b'location:')
+    Each device is only yielded once no matter how many times it
+    announces itself. Use `UPNP_Device.registry.DeviceRegistry` to follow
+    the devices for a longer time.
 
-                        if start > -1:
-                            start += 9
-                            location = data[start:]
-                            location = location[:location.find(b'\n')].strip()
-                        else:
-                            continue
+    :param timeout: seconds to listen for
+    :type timeout: `float`
+    :param log_level: optional, logging level
+    :param addresses: optional, IP addresses of the adapters to listen on
+    :type addresses: iterable of `str`
+    :return: yields `UPNP_Device.upnp_class.UPNPObject` instances
+    """
+    logger.setLevel(logging.NOTSET)
+    if log_level is not None:
+        logger.setLevel(log_level)
 
+    added = queue.Queue()
+    registry = DeviceRegistry()
+    registry.subscribe(lambda _, device: added.put(device), (EVENT_ADD,))
+    registry.start(addresses)
 
-                        logger.debug('SSDP: %s found st: %s', addr, st)
-                        logger.debug('SSDP: %s found location: %s', addr, location)
-                        found.append(UPNPObject(addr, {st: location}))
-                        found_event.set()
+    deadline = time.time() + timeout
 
-                    else:
-                        logger.debug('Unknown SSDP command %s %s', cmd[0], cmd[1])
+    try:
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
 
-            except socket.timeout:
-                continue
-        try:
-            sock.close()
-        except socket.error:
-            pass
-
-        found_event.set()
-
-        threads.remove(threading.current_thread())
-        if not threads:
-            event.set()
-            found_event.set()
-
-    for local_address in get_local_addresses():
-        t = threading.Thread(target=do, args=(local_address,))
-        t.daemon = True
-        threads += [t]
-        t.start()
-
-    while not event.isSet():
-        found_event.wait()
-        found_event.clear()
-        while found:
-            yield found.pop(0)
+            try:
+                device = added.get(timeout=remaining)
+            except queue.Empty:
+                break
+
+            yield device.device
+    finally:
+        registry.stop()
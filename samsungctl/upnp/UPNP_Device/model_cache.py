@@ -0,0 +1,674 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the description and SCPD files of the devices that have been
+built.
+
+Building a device means fetching and parsing 4 descriptions and 6 SCPD
+files, every time a connection is made. This keeps all of them so a
+device that has been seen before is built without touching the network.
+
+The description files are kept for every device by UDN, the SCPD files
+are kept for every model by model name and model number. TV's of the
+same model have the same services, so once one of them has been built
+another one only needs its descriptions fetched. The SCPD files of a
+model are parsed once for each process and the parsed XML is shared by
+every device of that model.
+
+A TV running another firmware can have SCPD files that are not the same
+as the ones of its model. The first time a TV is built from the files of
+another TV its own files are fetched in a background thread, if they are
+not the same the TV gets a copy of its own under
+``"<model name>/<model number>#<UDN>"``.
+
+A device is fetched again in a background thread when the BOOTID or
+CONFIGID it announces in SSDP is not the one it had when it was cached.
+The device gets built from the files in the cache until the new ones are
+in.
+
+The cache is saved as zlib compressed JSON, the file is set using the
+``UPNP_DEVICE_MODELS`` environment variable or by passing a path to
+`ModelCache`.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import traceback
+import zlib
+
+from lxml import etree
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+try:
+    from .xmlns import parse_xml
+    from .embedded_device import scpd_urls
+    from .fetch import fetch, fetch_all
+    from .cache import get_cache
+except ImportError:
+    from xmlns import parse_xml
+    from embedded_device import scpd_urls
+    from fetch import fetch, fetch_all
+    from cache import get_cache
+
+logger = logging.getLogger('UPNP_Devices')
+
+ENVIRONMENT_VARIABLE = 'UPNP_DEVICE_MODELS'
+
+# changed when the layout of the file changes, an older file is ignored
+FILE_VERSION = 2
+
+# seconds `ModelCache.save_later` waits before the cache file is written
+SAVE_DELAY = 2.0
+
+
+def _parse(content):
+    try:
+        return parse_xml(content)
+    except etree.XMLSyntaxError:
+        return None
+
+
+def _base_url(location):
+    parsed_url = urlparse(location)
+    return parsed_url.scheme + '://' + parsed_url.netloc
+
+
+def _text(node, tag):
+    value = node.find(tag)
+    if value is None or not value.text:
+        return None
+    return value.text.strip()
+
+
+def model_key(node):
+    """
+    Gets the key the SCPD files of a device are cached under.
+
+    The descriptions of a TV do not have the firmware version, the model
+    number is what changes when the services do.
+
+    :param node: ``device`` element of the description
+    :return: ``"<model name>/<model number>"``, `None` if the device does
+        not have a model name
+    :rtype: `str`
+    """
+    model_name = _text(node, 'modelName')
+    if model_name is None:
+        return None
+
+    return model_name + '/' + (_text(node, 'modelNumber') or '')
+
+
+class ModelCache(object):
+    """
+    Description and SCPD files by UDN and by model.
+
+    :param path: optional, file the cache is saved to
+    :type path: `str`
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        # model -> SCPD path -> contents of the file
+        self._models = {}
+        # model -> UDN's of the devices that have been seen to have the
+        # same SCPD files as the ones of the model
+        self._checked = {}
+        # UDN -> device entry
+        self._devices = {}
+        # location -> UDN
+        self._locations = {}
+        # (model, SCPD path) -> parsed XML
+        self._parsed = {}
+        # locations being fetched again
+        self._refreshing = set()
+        self._save_timer = None
+
+        if path is not None:
+            # changes that are waiting to be saved get written on exit
+            atexit.register(self.flush)
+
+            if os.path.exists(path):
+                self.load()
+
+    def load(self):
+        """Reads the cache file."""
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+        except (IOError, OSError, ValueError, zlib.error):
+            logger.debug('unable to read model cache ' + self.path)
+            return
+
+        if data.get('version') != FILE_VERSION:
+            return
+
+        with self._lock:
+            self._models = data['models']
+            self._checked = data['checked']
+            self._devices = data['devices']
+            self._locations = data['locations']
+            self._parsed.clear()
+
+    def save(self):
+        """Writes the cache file."""
+        if self.path is None:
+            return
+
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+
+            data = json.dumps(
+                dict(
+                    version=FILE_VERSION,
+                    models=self._models,
+                    checked=self._checked,
+                    devices=self._devices,
+                    locations=self._locations
+                ),
+                sort_keys=True
+            )
+
+        data = zlib.compress(data.encode('utf-8'), 9)
+
+        # written to a temporary file first so a crash never leaves a
+        # half written file behind
+        tmp_path = self.path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+
+            if os.path.exists(self.path) and os.name == 'nt':
+                os.remove(self.path)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            logger.debug('unable to save model cache ' + self.path)
+
+    def save_later(self):
+        """
+        Writes the cache file `SAVE_DELAY` seconds from now.
+
+        Every change made until then goes out with the same write.
+        """
+        if self.path is None:
+            return
+
+        with self._lock:
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(SAVE_DELAY, self.save)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def flush(self):
+        """Writes the cache file now if a save is waiting."""
+        with self._lock:
+            waiting = self._save_timer is not None
+
+        if waiting:
+            self.save()
+
+    def device(self, location):
+        """
+        Gets the cached device a location belongs to.
+
+        :param location: the location
+        :type location: `str`
+        :return: `None` or a copy of the entry, ``udn``, ``location``,
+            ``model``, ``description``, ``bootid`` and ``configid``
+        :rtype: `dict`
+        """
+        with self._lock:
+            udn = self._locations.get(location)
+            if udn is None or udn not in self._devices:
+                return None
+
+            return dict(self._devices[udn])
+
+    def scpd(self, model, path):
+        """
+        Gets the parsed SCPD file of a model.
+
+        :param model: key of the model, see `model_key`
+        :type model: `str`
+        :param path: path of the file on the device
+        :type path: `str`
+        :return: `None` if the file is not cached or is not valid XML
+        """
+        with self._lock:
+            key = (model, path)
+            if key not in self._parsed:
+                files = self._models.get(model, {})
+                if path not in files:
+                    return None
+
+                self._parsed[key] = _parse(files[path])
+
+            return self._parsed[key]
+
+    def _add_files(self, model, files):
+        with self._lock:
+            cached = self._models.setdefault(model, {})
+
+            for path, content in files.items():
+                if cached.get(path) != content:
+                    cached[path] = content
+                    self._parsed.pop((model, path), None)
+
+    def _model(self, udn, model):
+        # key the SCPD files of a device are under, a device that has
+        # SCPD files that are not the ones of its model has its own
+        with self._lock:
+            old = self._devices.get(udn)
+            if old is not None and old['model'] in (model, model + '#' + udn):
+                return old['model']
+            return model
+
+    def _checked_key(self, udn, model, files):
+        # the key a device gets after its SCPD files have been fetched
+        with self._lock:
+            cached = self._models.get(model, {})
+            others = set(self._checked.get(model, [])) - set([udn])
+
+            if others and any(
+                cached.get(path, content) != content
+                for path, content in files.items()
+            ):
+                # another firmware, the devices that have the files of the
+                # model keep them
+                return model + '#' + udn
+
+            return model
+
+    def _mark_checked(self, udn, model):
+        with self._lock:
+            checked = self._checked.setdefault(model, [])
+            if udn not in checked:
+                checked.append(udn)
+
+    def is_checked(self, location):
+        """
+        Checks if the SCPD files a device is built from are known to be
+        the ones the device has.
+
+        :param location: the location
+        :type location: `str`
+        :rtype: `bool`
+        """
+        with self._lock:
+            device = self.device(location)
+            return (
+                device is not None and
+                device['udn'] in self._checked.get(device['model'], [])
+            )
+
+    def store(
+        self,
+        location,
+        description,
+        scpds,
+        bootid=None,
+        configid=None,
+        save=True
+    ):
+        """
+        Adds or replaces a device.
+
+        SCPD files that are not the same as the ones of the model, from a
+        device that is running another firmware, are kept for the device
+        alone.
+
+        :param location: location of the description
+        :type location: `str`
+        :param description: the description file
+        :type description: `str`
+        :param scpds: SCPD url -> contents of the file, for the services
+            of the description
+        :type scpds: `dict`
+        :param bootid: BOOTID the device announced
+        :type bootid: `str`
+        :param configid: CONFIGID the device announced
+        :type configid: `str`
+        :param save: write out the cache file
+        :type save: `bool`
+        """
+        root = _parse(description)
+        if root is None or root.find('device') is None:
+            return
+
+        node = root.find('device')
+        udn = _text(node, 'UDN') or location
+        model = model_key(node) or udn
+        url = _base_url(location)
+
+        files = {}
+        for scpd_url, content in scpds.items():
+            if isinstance(content, bytes):
+                content = content.decode('utf-8')
+            files[scpd_url.replace(url, '', 1)] = content
+
+        # SCPD paths of the services of the description
+        paths = set(
+            scpd_url.replace(url, '', 1)
+            for scpd_url in scpd_urls(url, node)
+        )
+
+        with self._lock:
+            if files:
+                key = self._checked_key(udn, model, files)
+            else:
+                key = self._model(udn, model)
+
+            cached = self._models.get(key, {})
+
+            # checked when every file of the device has been compared,
+            # or when the files that are missing get loaded from it
+            if paths <= set(files.keys()) or not paths & set(cached.keys()):
+                self._mark_checked(udn, key)
+
+            self._add_files(key, files)
+
+            old = self._devices.get(udn)
+            if old is not None and old['location'] != location:
+                self._locations.pop(old['location'], None)
+
+            # the device has the files of its model again
+            if (
+                old is not None and
+                old['model'] != key and
+                old['model'] == model + '#' + udn
+            ):
+                self._models.pop(old['model'], None)
+                self._checked.pop(old['model'], None)
+
+            self._devices[udn] = dict(
+                udn=udn,
+                location=location,
+                model=key,
+                description=description,
+                bootid=bootid,
+                configid=configid
+            )
+            self._locations[location] = udn
+
+        if save:
+            self.save()
+
+    def loader(self, model, scpd_url):
+        """
+        Gets a function that loads an SCPD file of a model.
+
+        The file comes from the cache when it is in it, otherwise it is
+        fetched and added to the cache. The cache file is saved with
+        `save_later` so the files of a device that get loaded one after
+        the other go out in one write.
+
+        :param model: key of the model, see `model_key`
+        :type model: `str`
+        :param scpd_url: url of the file
+        :type scpd_url: `str`
+        :return: function that returns the parsed XML, or the contents of
+            the file when it is not valid XML
+        """
+        path = scpd_url.replace(_base_url(scpd_url), '', 1)
+
+        def load():
+            scpd = self.scpd(model, path)
+            if scpd is not None:
+                return scpd
+
+            content = fetch(scpd_url)
+            self._add_files(model, {path: content.decode('utf-8')})
+            self.save_later()
+
+            scpd = self.scpd(model, path)
+            if scpd is None:
+                return content
+            return scpd
+
+        return load
+
+    def fetch(self, locations, scpds=False):
+        """
+        Gets the description and SCPD files of a device.
+
+        Only what is not in the cache gets fetched. A device that gets
+        built from the SCPD files of another device of the same model has
+        its own files checked in a background thread, see `check`.
+
+        :param locations: locations of the device
+        :type locations: `list`
+        :param scpds: load every SCPD file now instead of handing out a
+            `loader` for each of them
+        :type scpds: `bool`
+        :return: ([(location, description, ``device`` element)],
+            SCPD url -> parsed XML, contents of the file or a `loader`).
+            The element is `None` when the description is not valid XML.
+        :rtype: `tuple`
+        """
+        load_scpds = scpds
+        discovery = get_cache()
+        descriptions = {}
+        # location -> (BOOTID, CONFIGID) it announced
+        announced = {}
+        missing = []
+
+        for location in locations:
+            entry = discovery.find(location)
+            if entry is not None:
+                announced[location] = (
+                    entry.get('bootid'),
+                    entry.get('configid')
+                )
+
+            device = self.device(location)
+            if device is None:
+                missing.append(location)
+                continue
+
+            descriptions[location] = device['description']
+
+            if (
+                location in announced and
+                announced[location] != (device['bootid'], device['configid'])
+            ):
+                self.revalidate(location, *announced[location])
+
+        for location, content in fetch_all(missing).items():
+            descriptions[location] = content.decode('utf-8')
+
+        files = []
+        scpds = {}
+        # SCPD url -> (model it gets cached under, location)
+        needed = {}
+
+        for location in locations:
+            root = _parse(descriptions[location])
+            node = None if root is None else root.find('device')
+            files.append((location, descriptions[location], node))
+
+            if node is None:
+                continue
+
+            url = _base_url(location)
+            if location in missing:
+                udn = _text(node, 'UDN') or location
+                model = self._model(udn, model_key(node) or udn)
+            else:
+                model = self.device(location)['model']
+
+            for scpd_url in scpd_urls(url, node):
+                if not load_scpds:
+                    scpds[scpd_url] = self.loader(model, scpd_url)
+                    continue
+
+                scpd = self.scpd(model, scpd_url.replace(url, '', 1))
+
+                if scpd is None:
+                    needed[scpd_url] = (model, location)
+                else:
+                    scpds[scpd_url] = scpd
+
+        fetched = fetch_all(needed)
+        scpds.update(fetched)
+
+        # location -> SCPD url -> contents of the file
+        fetched_files = {}
+        for scpd_url, content in fetched.items():
+            model, location = needed[scpd_url]
+            if location in missing:
+                fetched_files.setdefault(location, {})[scpd_url] = content
+            else:
+                self._add_files(
+                    model,
+                    {
+                        scpd_url.replace(_base_url(scpd_url), '', 1):
+                            content.decode('utf-8')
+                    }
+                )
+
+        for location, description, node in files:
+            if location in missing:
+                bootid, configid = announced.get(location, (None, None))
+                self.store(
+                    location,
+                    description,
+                    fetched_files.get(location, {}),
+                    bootid,
+                    configid,
+                    save=False
+                )
+
+        if missing or fetched:
+            self.save()
+
+        for location, description, node in files:
+            if node is not None and not self.is_checked(location):
+                self.check(location)
+
+        return files, scpds
+
+    def check(self, location):
+        """
+        Fetches the SCPD files of a device in a background thread.
+
+        Another firmware for the same model can have other SCPD files. A
+        device that has been built from the files of another device gets
+        them checked, when they are not the same the device is given its
+        own copy of them.
+
+        :param location: location of the description
+        :type location: `str`
+        :return: the thread, `None` if the location is already being
+            fetched or is not in the cache
+        :rtype: `threading.Thread`
+        """
+        device = self.device(location)
+        if device is None:
+            return None
+
+        logger.debug('MODELS: checking the SCPD files of ' + location)
+        return self._refresh(
+            location,
+            device['bootid'],
+            device['configid'],
+            device['description']
+        )
+
+    def revalidate(self, location, bootid, configid):
+        """
+        Fetches a device again in a background thread.
+
+        :param location: location of the description
+        :type location: `str`
+        :param bootid: BOOTID the device announced
+        :type bootid: `str`
+        :param configid: CONFIGID the device announced
+        :type configid: `str`
+        :return: the thread, `None` if the location is already being
+            fetched
+        :rtype: `threading.Thread`
+        """
+        logger.debug('MODELS: ' + location + ' has changed, fetching it')
+        return self._refresh(location, bootid, configid)
+
+    def _refresh(self, location, bootid, configid, description=None):
+        with self._lock:
+            if location in self._refreshing:
+                return None
+            self._refreshing.add(location)
+
+        def run():
+            try:
+                if description is None:
+                    content = fetch_all([location])[location].decode('utf-8')
+                else:
+                    content = description
+
+                root = _parse(content)
+
+                if root is None or root.find('device') is None:
+                    scpds = {}
+                else:
+                    scpds = fetch_all(
+                        scpd_urls(_base_url(location), root.find('device'))
+                    )
+
+                self.store(location, content, scpds, bootid, configid)
+            except Exception:
+                logger.debug(traceback.format_exc())
+            finally:
+                with self._lock:
+                    self._refreshing.discard(location)
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+        return t
+
+    def __len__(self):
+        with self._lock:
+            return len(self._devices)
+
+
+_model_cache = None
+_model_cache_lock = threading.Lock()
+
+
+def get_model_cache():
+    """
+    Gets the shared `ModelCache`.
+
+    The cache file is read from the ``UPNP_DEVICE_MODELS`` environment
+    variable, without it the cache only lasts as long as the process.
+
+    :rtype: `ModelCache`
+    """
+    global _model_cache
+
+    with _model_cache_lock:
+        if _model_cache is None:
+            _model_cache = ModelCache(os.environ.get(ENVIRONMENT_VARIABLE))
+
+        return _model_cache
+
+
+def set_model_cache(cache):
+    """
+    Replaces the shared `ModelCache`.
+
+    :param cache: cache to use
+    :type cache: `ModelCache`
+    """
+    global _model_cache
+
+    with _model_cache_lock:
+        _model_cache = cache
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+Devices on the network, kept up to date by listening to SSDP
+announcements.
+
+Every device is tracked by the uuid in its USN. A device is added the
+first time it sends an ``ssdp:alive`` and removed when it sends an
+``ssdp:byebye`` or stops announcing itself (its ``max-age`` runs out).
+Repeat announcements only refresh the expiry. Nothing is fetched from a
+device until its ``device`` attribute is used.
+
+>>> registry = DeviceRegistry()
+>>> registry.subscribe(lambda event, device: print(event, device.ip))
+>>> registry.start()
+"""
+
+import logging
+import threading
+import time
+
+from .cache import parse_max_age
+from .dump import open_writer
+
+logger = logging.getLogger('UPNP_Devices')
+
+EVENT_ADD = 'add'
+EVENT_CHANGE = 'change'
+EVENT_REMOVE = 'remove'
+EVENTS = (EVENT_ADD, EVENT_CHANGE, EVENT_REMOVE)
+
+
+class RegisteredDevice(object):
+    """
+    A device that has announced itself.
+
+    :ivar usn: uuid part of the USN of the device
+    :ivar ip: IP address of the device
+    :ivar location: url of the device description
+    :ivar server: SERVER header
+    :ivar bootid: BOOTID.UPNP.ORG header
+    :ivar expires: time the device is removed if it is not heard from
+    :ivar alive: `False` once the device has said goodbye or expired
+    """
+
+    def __init__(self, usn, ip, location, server, bootid, expires, dump=''):
+        self.usn = usn
+        self.ip = ip
+        self.location = location
+        self.server = server
+        self.bootid = bootid
+        self.expires = expires
+        self.alive = True
+        self._dump = dump
+        self._device = None
+        self._lock = threading.Lock()
+
+    @property
+    def device(self):
+        """
+        The device model, fetched the first time it is used.
+
+        :rtype: `UPNP_Device.upnp_class.UPNPObject`
+        """
+        with self._lock:
+            if self._device is None:
+                from .upnp_class import UPNPObject
+
+                self._device = UPNPObject(self.ip, [self.location], self._dump)
+
+            return self._device
+
+    def __repr__(self):
+        return '<RegisteredDevice {0} {1} alive={2}>'.format(
+            self.ip,
+            self.usn,
+            self.alive
+        )
+
+
+class DeviceRegistry(object):
+    """
+    Keeps track of the devices that are announcing themselves.
+
+    :param dump: optional, archive or folder the device descriptions get
+        saved to. An archive is written while the registry is running.
+    :type dump: `str` or `UPNP_Device.dump.DumpWriter`
+    """
+
+    def __init__(self, dump=''):
+        self._dump = dump
+        self._writer = None
+        self._owned_writer = False
+        self._lock = threading.RLock()
+        self._devices = {}
+        self._subscribers = []
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback, events=EVENTS):
+        """
+        Has a function called when a device is added, changed or removed.
+
+        The function gets called from the listening thread with the event
+        (``"add"``, ``"change"`` or ``"remove"``) and the
+        `RegisteredDevice`.
+
+        :param callback: function to call
+        :type callback: callable
+        :param events: optional, events to be called for
+        :type events: iterable of `str`
+        """
+        with self._lock:
+            self._subscribers.append((callback, tuple(events)))
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = list(
+                item for item in self._subscribers if item[0] != callback
+            )
+
+    def _publish(self, event, device):
+        with self._lock:
+            subscribers = self._subscribers[:]
+
+        for callback, events in subscribers:
+            if event not in events:
+                continue
+
+            try:
+                callback(event, device)
+            except Exception:
+                logger.exception('SSDP: subscriber raised an error')
+
+    def handle(self, ip, headers, now=None):
+        """
+        Processes the headers of an SSDP NOTIFY or search response.
+
+        :param ip: IP address the packet came from
+        :type ip: `str`
+        :param headers: headers of the packet, the case of the names does
+            not matter
+        :type headers: `dict`
+        :param now: optional, time the packet was received
+        :type now: `float`
+        :return: the event that got published or `None`
+        :rtype: `str`
+        """
+        headers = dict(
+            (key.upper(), value.strip() if value else value)
+            for key, value in headers.items()
+        )
+
+        usn = headers.get('USN')
+        if not usn:
+            return None
+
+        # a device announces itself once for every one of its types, the
+        # uuid at the start of the USN is the same in all of them
+        usn = usn.split('::', 1)[0]
+
+        if now is None:
+            now = time.time()
+
+        event = None
+
+        with self._lock:
+            device = self._devices.get(usn)
+
+            if headers.get('NTS') == 'ssdp:byebye':
+                if device is not None:
+                    del self._devices[usn]
+                    device.alive = False
+                    event = EVENT_REMOVE
+
+            else:
+                location = headers.get('LOCATION')
+                if not location:
+                    return None
+
+                server = headers.get('SERVER')
+                bootid = headers.get('BOOTID.UPNP.ORG')
+                expires = now + parse_max_age(headers.get('CACHE-CONTROL'))
+
+                if device is None:
+                    device = RegisteredDevice(
+                        usn,
+                        ip,
+                        location,
+                        server,
+                        bootid,
+                        expires,
+                        self._writer or self._dump
+                    )
+                    self._devices[usn] = device
+                    event = EVENT_ADD
+
+                elif (
+                    device.ip != ip or
+                    device.location != location or
+                    device.bootid != bootid
+                ):
+                    # the device rebooted or moved, the model has to be
+                    # fetched again
+                    with device._lock:
+                        device.ip = ip
+                        device.location = location
+                        device.server = server
+                        device.bootid = bootid
+                        device.expires = expires
+                        device._device = None
+                    event = EVENT_CHANGE
+
+                else:
+                    device.expires = expires
+
+        if event is not None:
+            logger.debug('SSDP: ' + event + ' ' + repr(device))
+            self._publish(event, device)
+
+        return event
+
+    def expire(self, now=None):
+        """
+        Removes the devices that have not announced themselves in time.
+
+        :return: the devices that were removed
+        :rtype: `list`
+        """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            expired = list(
+                device for device in self._devices.values()
+                if device.expires <= now
+            )
+            for device in expired:
+                del self._devices[device.usn]
+                device.alive = False
+
+        for device in expired:
+            self._publish(EVENT_REMOVE, device)
+
+        return expired
+
+    def get(self, usn):
+        """
+        :return: `None` if the device is not alive
+        :rtype: `RegisteredDevice`
+        """
+        with self._lock:
+            return self._devices.get(usn.split('::', 1)[0])
+
+    def devices(self, ip=None):
+        """
+        Gets the devices that are alive.
+
+        :param ip: optional, only the devices at this IP address
+        :type ip: `str`
+        :rtype: `list`
+        """
+        with self._lock:
+            return list(
+                device for device in self._devices.values()
+                if ip is None or device.ip == ip
+            )
+
+    def is_alive(self, ip):
+        """
+        Checks if anything at an IP address is announcing itself, for a TV
+        this means it is powered on.
+
+        :param ip: IP address
+        :type ip: `str`
+        :rtype: `bool`
+        """
+        return bool(self.devices(ip))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._devices)
+
+    def __iter__(self):
+        return iter(self.devices())
+
+    def start(self, addresses=None):
+        """
+        Starts listening in a thread of its own.
+
+        :param addresses: optional, IP addresses of the adapters to listen
+            on, defaults to all of them
+        :type addresses: iterable of `str`
+        """
+        from .listen import run_listener
+
+        if self._thread is not None:
+            return
+
+        self._writer, self._owned_writer = open_writer(self._dump)
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=run_listener,
+            args=(self, self._stop_event, addresses)
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops listening."""
+        if self._thread is None:
+            return
+
+        self._stop_event.set()
+        self._thread.join(3.0)
+        self._thread = None
+
+        if self._owned_writer:
+            self._writer.close()
+        self._writer = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
@@ -1,18 +1,42 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
+import logging
+import threading
 import requests
-import os
 from lxml import etree
 try:
     from .data_type import StateVariable
     from .action import Action
     from .icon import Icon
-    from .xmlns import strip_xmlns
+    from .xmlns import parse_xml
+    from .fetch import fetch
 except ImportError:
     from data_type import StateVariable
     from action import Action
     from icon import Icon
-    from xmlns import strip_xmlns
+    from xmlns import parse_xml
+    from fetch import fetch
+
+logger = logging.getLogger('UPNP_Devices')
+
+
+def scpd_url(url, location):
+    """
+    Gets the url of an SCPD file.
+
+    :param url: scheme and address of the device, ``"http://1.2.3.4:7676"``
+    :type url: `str`
+    :param location: the SCPDURL of the service
+    :type location: `str`
+    :rtype: `str`
+    """
+    location = location.replace(url, '')
+    location = location.replace('//', '/')
+
+    if not location.startswith('/'):
+        location = '/' + location
+
+    return url + location
 
 
 class Service(object):
@@ -25,13 +49,31 @@ class Service(object):
         service,
         control_url,
         node=None,
-        dump=''
+        dump='',
+        content=None
     ):
+        """
+        The SCPD file is not fetched until an action or a state variable
+        is first needed, most of the services of a TV never get used.
+
+        :param content: optional, the SCPD file when it has already been
+            fetched, the file already parsed or a function that gets either
+            of them
+        :type content: `bytes`, `lxml.etree.Element` or callable
+        :param dump: optional, when given the SCPD file is loaded right
+            away so it ends up in the dump
+        """
 
         self.__parent = parent
-        self.state_variables = {}
+        self.__state_variables = {}
         self.__actions = {}
         self.__node = node
+        self.__location = scpd_url(url, location)
+        self.__control_url = control_url
+        self.__content = content
+        self.__loaded = False
+        self.__load_lock = threading.Lock()
+        self.load_error = None
         self.url = url
         self.__icons = {}
 
@@ -47,40 +89,58 @@ class Service(object):
 
         self.service = service
 
-        location = location.replace(url, '')
-        location = location.replace('//', '/')
-
-        if not location.startswith('/'):
-            location = '/' + location
-
-        response = requests.get(url + location)
-        content = response.content.decode('utf-8')
         if dump:
-            path = location
-            if path.startswith('/'):
-                path = path[1:]
-            if '/' in path:
-                path, file_name = path.rsplit('/', 1)
-                path = os.path.join(dump, path)
-            else:
-                file_name = path
-                path = dump
-
-            if not os.path.exists(path):
-                os.makedirs(path)
-
-            if not file_name.endswith('.xml'):
-                file_name += '.xml'
-
-            with open(os.path.join(path, file_name), 'w') as f:
-                f.write(content)
-
-        try:
-            root = etree.fromstring(response.content)
-        except etree.XMLSyntaxError:
+            self.__load(dump)
+
+    def __load(self, dump=None):
+        if self.__loaded:
             return
 
-        root = strip_xmlns(root)
+        # concurrent first calls wait on the one that is fetching
+        with self.__load_lock:
+            if self.__loaded:
+                return
+
+            content = self.__content
+            self.__content = None
+
+            # a file that can not be fetched is only tried once, the
+            # service has no actions after that. Reconnecting builds the
+            # service again.
+            try:
+                if content is None:
+                    content = fetch(self.__location)
+                elif callable(content):
+                    content = content()
+
+                self.__parse(content, dump)
+            except requests.RequestException as err:
+                self.load_error = err
+                logger.debug(
+                    'unable to get ' + self.__location + ': ' + str(err)
+                )
+            finally:
+                self.__loaded = True
+
+    def __parse(self, content, dump):
+        location = self.__location
+
+        if etree.iselement(content):
+            # parsed files come from the model cache and have already had
+            # the namespaces stripped
+            root = content
+
+            if dump:
+                dump.add_file(location, etree.tostring(root))
+        else:
+            if dump:
+                dump.add_file(location, content)
+
+            try:
+                root = parse_xml(content)
+            except etree.XMLSyntaxError:
+                return
+
         actions = root.find('actionList')
         if actions is None:
             actions = []
@@ -91,21 +151,40 @@ class Service(object):
 
         for state_variable in state_variables:
             state_variable = StateVariable(state_variable)
-            self.state_variables[state_variable.name] = state_variable
+            self.__state_variables[state_variable.name] = state_variable
 
         for action in actions:
             action = Action(
                 self,
                 action,
-                self.state_variables,
-                service,
-                url + control_url
+                self.__state_variables,
+                self.service,
+                self.url + self.__control_url
             )
 
             self.__actions[action.__name__] = action
 
+    @property
+    def loaded(self):
+        """
+        :return: `True` once the SCPD file has been fetched and parsed
+        :rtype: `bool`
+        """
+        return self.__loaded
+
+    @property
+    def state_variables(self):
+        self.__load()
+        return self.__state_variables
+
+    @state_variables.setter
+    def state_variables(self, value):
+        self.__load()
+        self.__state_variables = value
+
     @property
     def methods(self):
+        self.__load()
         return list(self.__actions.values())[:]
 
     @property
@@ -116,6 +195,11 @@ class Service(object):
         if item in self.__dict__:
             return self.__dict__[item]
 
+        # private names get looked up by copy, pickle and the like, they
+        # are never actions
+        if not item.startswith('_'):
+            self.__load()
+
         if item in self.__actions:
             return self.__actions[item]
 
@@ -150,7 +234,7 @@ class Service(object):
     def __str__(self, indent=''):
         actions = ''
 
-        for action in self.__actions.values():
+        for action in self.methods:
             actions += action.__str__(indent + '    ')
 
         if not actions:
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+SSDP packet parsing shared by the search and the listener.
+
+Packets are received into a buffer that is allocated once and the headers
+are only split out of the raw bytes the first time they are asked for. A
+packet that is thrown away because of who sent it or what kind of packet
+it is never gets decoded.
+"""
+
+import errno
+import logging
+import socket
+
+logger = logging.getLogger('UPNP_Devices')
+
+# the UPNP spec has no upper limit on the size of a packet, anything that
+# fits in a single datagram on an ethernet network fits in here
+BUFFER_SIZE = 8192
+
+TYPE_RESPONSE = 'response'
+TYPE_NOTIFY = 'notify'
+TYPE_SEARCH = 'search'
+TYPE_UNKNOWN = 'unknown'
+
+
+class SSDPPacket(object):
+    """
+    A received SSDP packet.
+
+    The header names are upper case, the values have the white space
+    around them removed.
+
+    :param data: the packet
+    :type data: `bytes`
+    """
+    __slots__ = ('data', '_type', '_headers')
+
+    def __init__(self, data):
+        self.data = data
+        self._type = None
+        self._headers = None
+
+    @property
+    def type(self):
+        """
+        ``"response"``, ``"notify"``, ``"search"`` or ``"unknown"``
+
+        :rtype: `str`
+        """
+        if self._type is None:
+            data = self.data
+
+            if data.startswith(b'HTTP/'):
+                if b' 200' in data[:data.find(b'\n')]:
+                    self._type = TYPE_RESPONSE
+                else:
+                    self._type = TYPE_UNKNOWN
+            elif data.startswith(b'NOTIFY'):
+                self._type = TYPE_NOTIFY
+            elif data.startswith(b'M-SEARCH'):
+                self._type = TYPE_SEARCH
+            else:
+                self._type = TYPE_UNKNOWN
+
+        return self._type
+
+    @property
+    def headers(self):
+        """
+        :return: header name -> value
+        :rtype: `dict`
+        """
+        if self._headers is None:
+            data = self.data
+
+            end = data.find(b'\r\n\r\n')
+            if end == -1:
+                end = len(data)
+
+            headers = {}
+            lines = data[:end].decode('utf-8', 'replace').split('\n')
+
+            for line in lines[1:]:
+                name, colon, value = line.partition(':')
+                if colon:
+                    headers[name.strip().upper()] = value.strip()
+
+            self._headers = headers
+
+        return self._headers
+
+    def get(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def __getitem__(self, name):
+        return self.headers[name]
+
+    def __contains__(self, name):
+        return name in self.headers
+
+    def items(self):
+        return self.headers.items()
+
+    def to_dict(self):
+        """
+        :return: the headers along with the ``TYPE`` of the packet
+        :rtype: `dict`
+        """
+        packet = dict(self.headers)
+        packet['TYPE'] = self.type
+        return packet
+
+    def __repr__(self):
+        return '<SSDPPacket {0} {1}>'.format(self.type, self.headers)
+
+
+def receive(sock, buf=None):
+    """
+    Reads every packet that is waiting on a non blocking socket.
+
+    :param sock: the socket
+    :type sock: `socket.socket`
+    :param buf: optional, buffer to receive into, `create_buffer` makes one
+    :type buf: `bytearray`
+    :return: yields (`SSDPPacket`, address)
+    """
+    if buf is None:
+        buf = create_buffer()
+
+    view = memoryview(buf)
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    while True:
+        try:
+            size, addr = sock.recvfrom_into(buf)
+        except socket.error as err:
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                logger.debug('SSDP: ' + str(err))
+            return
+
+        if not size:
+            continue
+
+        packet = SSDPPacket(view[:size].tobytes())
+
+        if debug:
+            logger.debug('SSDP: inbound packet from %s', addr[0])
+            logger.debug('%r', packet)
+
+        yield packet, addr
+
+
+def create_buffer():
+    """
+    :return: a buffer that any SSDP packet fits in
+    :rtype: `bytearray`
+    """
+    return bytearray(BUFFER_SIZE)
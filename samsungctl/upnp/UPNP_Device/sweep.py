@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Discovery for networks that do not pass multicast.
+
+An M-SEARCH is sent straight to every host in a range of addresses at a
+set rate. All of the searches go out of one socket and every answer comes
+back to it, so a /16 takes the same single socket and single thread as a
+/30. Hits can be confirmed by connecting to one of the ports a TV has
+open, which weeds out the other UPNP devices on the network.
+
+>>> for ip, locations in sweep(['192.168.0.0/16'], rate=5000):
+>>>     print(ip, locations)
+"""
+
+import errno
+import ipaddress
+import logging
+import socket
+import time
+
+from . import ssdp
+from .discover import (
+    IPV4_SSDP,
+    SSDP_PORT,
+    Poller,
+    _create_socket
+)
+
+logger = logging.getLogger('UPNP_Devices')
+
+# packets per second, a /16 takes about 13 seconds
+SWEEP_RATE = 5000
+TV_PORTS = (8001, 55000, 8080)
+
+
+def _network(value):
+    try:
+        network = ipaddress.ip_network(value.decode('utf-8'), strict=False)
+    except (AttributeError, UnicodeEncodeError):
+        network = ipaddress.ip_network(value, strict=False)
+
+    if network.version != 4:
+        raise ValueError('only IPv4 networks can be swept: ' + str(value))
+
+    return network
+
+
+def iter_hosts(networks):
+    """
+    Gets every host address in a number of networks.
+
+    :param networks: networks in CIDR notation, ``"192.168.1.0/24"``, or
+        single addresses
+    :type networks: iterable of `str`
+    :return: yields IP addresses
+    """
+    for network in networks:
+        network = _network(network)
+
+        if network.num_addresses == 1:
+            yield str(network.network_address)
+        else:
+            for host in network.hosts():
+                yield str(host)
+
+
+def sweep(
+    networks,
+    rate=SWEEP_RATE,
+    timeout=2.0,
+    confirm=False,
+    ports=TV_PORTS,
+    settle=0.0,
+    stop_after=None,
+    log_level=None
+):
+    """
+    Sends an M-SEARCH to every host in a number of networks.
+
+    Everything runs in the calling thread. The search ends `timeout`
+    seconds after the last M-SEARCH has been sent.
+
+    :param networks: networks in CIDR notation or single addresses
+    :type networks: iterable of `str`
+    :param rate: M-SEARCH packets sent per second
+    :type rate: `int`
+    :param timeout: seconds to wait for answers after the last packet
+    :type timeout: `float`
+    :param confirm: only yield devices that have one of `ports` open
+    :type confirm: `bool`
+    :param ports: ports checked when `confirm` is set
+    :type ports: iterable of `int`
+    :param settle: seconds a device has to be quiet before it is yielded,
+        see `UPNP_Device.discover.discover`
+    :type settle: `float`
+    :param stop_after: optional, stop once this many devices are found
+    :type stop_after: `int`
+    :param log_level: optional, logging level
+    :return: yields (IP address, [locations])
+    """
+    if log_level is not None:
+        logger.setLevel(log_level)
+
+    hosts = iter_hosts(networks)
+    packet = IPV4_SSDP.encode('utf-8')
+    interval = 1.0 / rate
+
+    sock = _create_socket(False)
+    poller = Poller()
+    poller.register(sock)
+    buf = ssdp.create_buffer()
+
+    # IP address -> locations
+    found = {}
+    # TCP probe socket -> IP address
+    probes = {}
+    # IP address -> number of probes still running
+    probing = {}
+    pending = []
+    last_seen = {}
+    yielded = set()
+
+    next_host = None
+    sent = 0
+    start = time.time()
+    deadline = None
+
+    def ready(ip_addr):
+        if ip_addr not in pending and ip_addr not in yielded:
+            pending.append(ip_addr)
+
+    def probe(ip_addr):
+        probing[ip_addr] = 0
+
+        for port in ports:
+            probe_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            probe_sock.setblocking(0)
+            err = probe_sock.connect_ex((ip_addr, port))
+
+            if err == 0:
+                probe_sock.close()
+                confirmed(ip_addr)
+                return
+
+            if err in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+                probes[probe_sock] = ip_addr
+                probing[ip_addr] += 1
+                poller.register(probe_sock, write=True)
+            else:
+                probe_sock.close()
+
+        if not probing[ip_addr]:
+            del probing[ip_addr]
+            logger.debug('SSDP: ' + ip_addr + ' has none of the ports open')
+
+    def confirmed(ip_addr):
+        probing.pop(ip_addr, None)
+
+        for probe_sock, probe_ip in list(probes.items()):
+            if probe_ip == ip_addr:
+                close_probe(probe_sock)
+
+        ready(ip_addr)
+
+    def close_probe(probe_sock):
+        del probes[probe_sock]
+        poller.unregister(probe_sock)
+        probe_sock.close()
+
+    def read():
+        for response, addr in ssdp.receive(sock, buf):
+            if response.type != ssdp.TYPE_RESPONSE:
+                continue
+
+            location = response.get('LOCATION')
+            if location is None:
+                continue
+
+            ip_addr = addr[0]
+
+            if ip_addr not in found:
+                found[ip_addr] = []
+
+                if confirm:
+                    probe(ip_addr)
+                else:
+                    ready(ip_addr)
+
+            if location not in found[ip_addr]:
+                found[ip_addr].append(location)
+                last_seen[ip_addr] = time.time()
+
+    try:
+        while True:
+            now = time.time()
+
+            # sends every packet that is due
+            while deadline is None and start + sent * interval <= now:
+                if next_host is None:
+                    try:
+                        next_host = next(hosts)
+                    except StopIteration:
+                        deadline = now + timeout
+                        break
+
+                try:
+                    sock.sendto(packet, (next_host, SSDP_PORT))
+                except socket.error as err:
+                    if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        # the send buffer is full, try again later
+                        break
+
+                    logger.debug(
+                        'SSDP: unable to send to ' + next_host + ': ' +
+                        str(err)
+                    )
+
+                next_host = None
+                sent += 1
+
+            for ip_addr in pending[:]:
+                if now - last_seen[ip_addr] < settle:
+                    continue
+
+                pending.remove(ip_addr)
+                yielded.add(ip_addr)
+                yield ip_addr, found[ip_addr]
+
+                if stop_after is not None and len(yielded) >= stop_after:
+                    return
+
+            now = time.time()
+
+            if deadline is None:
+                wait = start + sent * interval - now
+            elif now >= deadline:
+                break
+            else:
+                wait = deadline - now
+
+            if pending:
+                wait = min(
+                    wait,
+                    min(last_seen[ip_addr] for ip_addr in pending) +
+                    settle - now
+                )
+
+            for ready_sock in poller.poll(max(wait, 0)):
+                if ready_sock is sock:
+                    read()
+                    continue
+
+                if ready_sock not in probes:
+                    continue
+
+                ip_addr = probes[ready_sock]
+                err = ready_sock.getsockopt(
+                    socket.SOL_SOCKET,
+                    socket.SO_ERROR
+                )
+
+                if err == 0:
+                    confirmed(ip_addr)
+                    continue
+
+                close_probe(ready_sock)
+                probing[ip_addr] -= 1
+
+                if not probing[ip_addr]:
+                    del probing[ip_addr]
+                    logger.debug(
+                        'SSDP: ' + ip_addr + ' has none of the ports open'
+                    )
+
+        # the time is up, whatever has not settled yet goes out as is
+        for ip_addr in pending:
+            yield ip_addr, found[ip_addr]
+    finally:
+        for probe_sock in list(probes.keys()):
+            close_probe(probe_sock)
+
+        poller.close()
+        sock.close()
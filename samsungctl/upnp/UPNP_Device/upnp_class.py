@@ -1,8 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import requests
-import os
-from lxml import etree
 try:
     from urlparse import urlparse
 except ImportError:
@@ -10,59 +7,67 @@ except ImportError:
 
 
 try:
-    from .xmlns import strip_xmlns
-    from .service import Service
+    from .service import Service, scpd_url
     from .embedded_device import EmbeddedDevice
     from .instance_singleton import InstanceSingleton
+    from .dump import open_writer
+    from .model_cache import ModelCache, get_model_cache
 except ImportError:
-    from xmlns import strip_xmlns
-    from service import Service
+    from service import Service, scpd_url
     from embedded_device import EmbeddedDevice
     from instance_singleton import InstanceSingleton
+    from dump import open_writer
+    from model_cache import ModelCache, get_model_cache
 
 
 class UPNPObject(object):
 
-    def __init__(self, ip, locations, dump=''):
+    def __init__(self, ip, locations, dump='', model_cache=None):
+        """
+        :param model_cache: optional, cache the files of the device are
+            read from and added to, defaults to the shared `ModelCache`.
+            `False` fetches everything.
+        :type model_cache: `ModelCache`
+        """
         self.ip_address = ip
         self._devices = {}
         self._services = {}
-        for location in locations:
-            parsed_url = urlparse(location)
-            url = parsed_url.scheme + '://' + parsed_url.netloc
-            response = requests.get(location)
-
-            content = response.content.decode('utf-8')
-
-            if dump:
-                path = location
-                if path.startswith('/'):
-                    path = path[1:]
-
-                if '/' in path:
-                    path, file_name = path.rsplit('/', 1)
-                    path = os.path.join(dump, path)
-                else:
-                    file_name = path
-                    path = dump
-
-                if not os.path.exists(path):
-                    os.makedirs(path)
 
-                if not file_name.endswith('.xml'):
-                    file_name += '.xml'
+        if model_cache is None:
+            model_cache = get_model_cache()
+        elif model_cache is False:
+            model_cache = ModelCache()
+
+        writer, owned_writer = open_writer(dump)
+        try:
+            self._build(ip, locations, writer, model_cache)
+        finally:
+            if owned_writer:
+                writer.close()
+
+    def _build(self, ip, locations, dump, model_cache):
+        # every description is fetched at once. The SCPD files are only
+        # fetched when a service is first used, unless everything has to go
+        # into a dump, then they are all fetched at once as well. Whatever
+        # is in the model cache does not get fetched at all.
+        descriptions, scpds = model_cache.fetch(
+            locations,
+            scpds=dump is not None
+        )
+        nodes = []
 
-                with open(os.path.join(path, file_name), 'w') as f:
-                    f.write(content)
+        for location, content, node in descriptions:
+            parsed_url = urlparse(location)
+            url = parsed_url.scheme + '://' + parsed_url.netloc
 
-            try:
-                root = etree.fromstring(content)
-            except etree.XMLSyntaxError:
-                continue
+            if dump is not None:
+                dump.add_location(ip, location)
+                dump.add_file(location, content, ip)
 
-            root = strip_xmlns(root)
-            node = root.find('device')
+            if node is not None:
+                nodes.append((url, node))
 
+        for url, node in nodes:
             services = node.find('serviceList')
             if services is None:
                 services = []
@@ -95,7 +100,8 @@ class UPNPObject(object):
                     service_type,
                     control_url,
                     node,
-                    dump=dump
+                    dump=dump,
+                    content=scpds.get(scpd_url(url, scpdurl))
                 )
                 name = service_id.split(':')[-1]
                 service.__name__ = name
@@ -106,7 +112,8 @@ class UPNPObject(object):
                     url,
                     node=device,
                     parent=self,
-                    dump=dump
+                    dump=dump,
+                    scpds=scpds
                 )
                 self._devices[device.__name__] = device
 
@@ -1,26 +1,74 @@
 # -*- coding: utf-8 -*-
+"""
+Namespace handling for the XML that a device sends.
+
+Everything that reads the XML looks the elements up by their plain tag
+name, so the namespaces get removed as soon as a document is parsed.
+`parse_xml` does it for the text of a document, `strip_xmlns` for a tree
+that has already been parsed. Only the tags get renamed, the text of the
+document is never touched, so XML that is sent escaped or in a CDATA
+section inside of a SOAP response (DIDL-Lite, channel lists) comes out
+exactly as the TV sent it. Comments and processing instructions are
+dropped by the parser.
+"""
+
+import threading
+
+from lxml import etree
 
 ENVELOPE_XMLNS = 'http://schemas.xmlsoap.org/soap/envelope/'
 
+# a parser can not be used by more then one thread at a time
+_parsers = threading.local()
+
+
+def _get_parser():
+    parser = getattr(_parsers, 'parser', None)
+
+    if parser is None:
+        parser = _parsers.parser = etree.XMLParser(
+            remove_comments=True,
+            remove_pis=True
+        )
+
+    return parser
+
+
+def parse_xml(content):
+    """
+    Parses a document and removes the namespaces.
+
+    :param content: the document
+    :type content: `bytes` or `str`
+    :return: root element
+    :raises: `lxml.etree.XMLSyntaxError` if the document is not valid XML
+    """
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+
+    return strip_xmlns(etree.fromstring(content, _get_parser()))
+
 
 def strip_xmlns(root):
-    def iter_node(n):
-        nsmap = n.nsmap
-        for child in n:
-            nsmap.update(iter_node(child))
-        return nsmap
-
-    xmlns = list('{' + item + '}' for item in iter_node(root).values())
-
-    def strip_node(n):
-        for item in xmlns:
-            n.tag = n.tag.replace(item, '')
-
-        for child in n[:]:
-            try:
-                strip_node(child)
-            except AttributeError:
-                n.remove(child)
-    strip_node(root)
+    """
+    Removes the namespaces from the tags of a parsed document, along with
+    the comments and processing instructions.
+
+    The tree is changed in place.
+
+    :param root: root element
+    :return: `root`
+    """
+    for node in root.iter(etree.Element):
+        tag = node.tag
+        if tag[0] == '{':
+            node.tag = tag[tag.index('}') + 1:]
+
+    for node in list(
+        root.iter(etree.Comment, etree.ProcessingInstruction, etree.Entity)
+    ):
+        parent = node.getparent()
+        if parent is not None:
+            parent.remove(node)
 
     return root
@@ -6,6 +6,7 @@ from lxml import etree
 from .UPNP_Device.upnp_class import UPNPObject
 from .UPNP_Device.instance_singleton import InstanceSingleton
 from .UPNP_Device.xmlns import strip_xmlns
+from .. import models
 
 import logging
 logger = logging.getLogger('samsungctl')
@@ -16,6 +17,7 @@ class UPNPTV(UPNPObject):
     def __init__(self, ip, locations):
         self._dtv_information = None
         self._tv_options = None
+        self._model_info = None
         self.name = self.__class__.__name__
         self.ip_address = ip
         self._connected = False
@@ -1636,50 +1638,53 @@ class UPNPTV(UPNPObject):
             raise
 
     @property
-    def panel_technology(self):
+    def model_info(self):
+        """
+        What is known about the TV's model, see `samsungctl.models`.
+
+        :rtype: `dict`
+        """
         if not self.connected:
             return
 
-        technology_mapping = dict(
-            Q='QLED',
-            U='LED',
-            P='Plasma',
-            L='LCD',
-            H='DLP',
-            K='OLED',
-        )
+        if self._model_info is None:
+            model = self.model
+            database = models.get_database()
+            info = database.lookup(model)
 
-        try:
-            return technology_mapping[self.model[0]]
-        except KeyError:
-            return 'Unknown'
+            if info is None:
+                info = models.parse_model(model)
+
+            database.learn(
+                model,
+                services=sorted(
+                    service.__name__ for service in self.services
+                )
+            )
+            self._model_info = info
+
+        return self._model_info
 
     @property
-    def panel_type(self):
+    def panel_technology(self):
         if not self.connected:
             return
 
-        model = self.model
-        if model[0] == 'Q' and model[4] == 'Q':
-            return 'UHD'
-        if model[5].isdigit():
-            return 'FullHD'
+        return self.model_info['technology'] or 'Unknown'
 
-        panel_mapping = dict(
-            S='Slim' if self.year == 2012 else 'SUHD',
-            U='UHD',
-            P='Plasma',
-            H='Hybrid',
-        )
+    @property
+    def panel_type(self):
+        if not self.connected:
+            return
 
-        return panel_mapping[model[5]]
+        return self.model_info['panel_type'] or 'Unknown'
 
     @property
     def size(self):
         if not self.connected:
             return
 
-        return int(self.model[2:][:2])
+        return self.model_info['size']
 
     @property
     def model(self):
@@ -1693,11 +1698,18 @@ class UPNPTV(UPNPObject):
         if not self.connected:
             return
 
+        # what the TV says comes first, the model number is only used
+        # when the TV does not say
         try:
             dtv_information = self.dtv_information
             year = dtv_information.find('SupportTVVersion').text
         except AttributeError:
-            year = self.RemoteControlReceiver.ProductCap.split(',')[0]
+            try:
+                year = self.RemoteControlReceiver.ProductCap.split(',')[0]
+            except AttributeError:
+                if self.model_info['year'] is None:
+                    raise
+                return self.model_info['year']
 
         return int(year)
 
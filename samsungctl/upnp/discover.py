@@ -1,13 +1,221 @@
 # -*- coding: utf-8 -*-
 import requests
 import json
+import logging
+import threading
+import traceback
+from six.moves import queue
 from lxml import etree
-from .UPNP_Device.discover import discover as _discover
-from .UPNP_Device.xmlns import strip_xmlns
+from .UPNP_Device.discover import discover as _discover, SETTLE_TIME
+from .UPNP_Device.sweep import sweep, SWEEP_RATE
+from .UPNP_Device.xmlns import parse_xml
 from ..config import Config
+from .. import models
+from ..utils import get_session
+
+logger = logging.getLogger('samsungctl')
+
+
+MAX_WORKERS = 8
+HTTP_TIMEOUT = 3.0
+API_URL = 'http://{0}:8001/api/v2/'
+
+_SSDP_DONE = object()
+
+
+def classify(ip, locations, timeout=HTTP_TIMEOUT):
+    """
+    Works out how to connect to a device that answered the SSDP search.
+
+    :param ip: IP address of the device
+    :type ip: `str`
+    :param locations: UPNP locations of the device
+    :type locations: `list`
+    :param timeout: seconds to wait for each HTTP request
+    :type timeout: `float`
+    :return: `None` if the device is not a Samsung TV
+    :rtype: `samsungctl.Config`
+    """
+    session = get_session(ip)
+
+    try:
+        response = session.get(locations[0], timeout=timeout)
+        root = parse_xml(response.content)
+    except (requests.RequestException, etree.XMLSyntaxError, ValueError):
+        logger.debug(ip + ': unable to get ' + locations[0])
+        return None
+
+    device = root.find('device')
+    if device is None:
+        return None
+
+    mfgr = device.find('manufacturer')
+    if mfgr is None or mfgr.text != 'Samsung Electronics':
+        return None
+
+    model = device.find('modelName')
+    if model is not None:
+        model = model.text
+
+    database = models.get_database()
+    info = database.lookup(model)
+
+    if info is not None and info.get('method') is not None:
+        # a known model, no need to ask the TV
+        method = info['method']
+        port = info['port']
+
+    else:
+        try:
+            response = session.get(API_URL.format(ip), timeout=timeout)
+            is_support = (
+                json.loads(response.content)['device']['isSupport']
+            )
+            token_support = json.loads(is_support)['TokenAuthSupport']
+
+            if str(token_support).lower() == 'true':
+                port = 8002
+                method = 'websocket'
+
+            else:
+                raise ValueError
+
+        except (requests.HTTPError, requests.ConnectionError):
+            port = 55000
+            method = 'legacy'
+
+        except (requests.Timeout, ValueError, KeyError, TypeError):
+            port = 8001
+            method = 'websocket'
+
+        database.learn(
+            model,
+            method=method,
+            port=port,
+            token=port == 8002
+        )
+
+    return Config(
+        host=ip,
+        method=method,
+        port=port,
+        upnp_locations=locations
+    )
+
+
+def classify_devices(
+    devices,
+    max_workers=MAX_WORKERS,
+    timeout=HTTP_TIMEOUT
+):
+    """
+    Classifies devices at the same time.
+
+    The devices are read in a thread of their own and handed off to at
+    most `max_workers` threads, so a slow device does not hold up the
+    others. The TV's are yielded in the order they finish.
+
+    :param devices: (IP address, [locations]) pairs, like the ones
+        `UPNP_Device.discover.discover` yields
+    :type devices: iterable
+    :param max_workers: most devices that are classified at once
+    :type max_workers: `int`
+    :param timeout: seconds to wait for each HTTP request
+    :type timeout: `float`
+    :return: yields `samsungctl.Config` instances
+    """
+    tasks = queue.Queue()
+    results = queue.Queue()
+    workers = []
+
+    def work():
+        while True:
+            device = tasks.get()
+            if device is None:
+                break
+
+            try:
+                config = classify(device[0], device[1], timeout)
+            except Exception:
+                logger.debug(traceback.format_exc())
+                config = None
+
+            results.put(config)
+
+    def feed():
+        count = 0
+
+        try:
+            for device in devices:
+                count += 1
+                tasks.put(device)
+
+                if len(workers) < min(count, max_workers):
+                    t = threading.Thread(target=work)
+                    t.daemon = True
+                    t.start()
+                    workers.append(t)
+        except Exception:
+            logger.debug(traceback.format_exc())
+        finally:
+            for _ in workers:
+                tasks.put(None)
+
+            results.put((_SSDP_DONE, count))
+
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+
+    total = None
+    finished = 0
+
+    while total is None or finished < total:
+        result = results.get()
+
+        if isinstance(result, tuple) and result[0] is _SSDP_DONE:
+            total = result[1]
+            continue
+
+        finished += 1
+
+        if result is not None:
+            yield result
 
 
 def discover(config=None, log_level=None, timeout=5):
+    return list(iter_discover(config, log_level, timeout))
+
+
+def iter_discover(
+    config=None,
+    log_level=None,
+    timeout=5,
+    stop_after=None,
+    networks=None,
+    rate=SWEEP_RATE
+):
+    """
+    Finds Samsung TV's, each one is yielded as soon as it has answered.
+
+    On networks that do not pass multicast give the address ranges the
+    TV's are in as `networks`, every address gets asked directly.
+
+    :param config: optional, only look for the TV in this config
+    :type config: `samsungctl.Config` or `dict`
+    :param log_level: optional, logging level
+    :param timeout: seconds to search for
+    :type timeout: `float`
+    :param stop_after: optional, stop once this many TV's are found
+    :type stop_after: `int`
+    :param networks: optional, networks to sweep in CIDR notation,
+        ``["192.168.1.0/24"]``. `timeout` is the time to wait after the
+        last address has been asked.
+    :type networks: iterable of `str`
+    :param rate: packets per second sent when sweeping `networks`
+    :type rate: `int`
+    :return: yields `samsungctl.Config` instances
+    """
     if isinstance(config, dict):
         config = Config(**config)
 
@@ -23,63 +231,40 @@ def discover(config=None, log_level=None, timeout=5):
 
         search_ips = (config.host,)
 
-    if upnp_locations is None:
-        found = []
-        for ip, locations in _discover(timeout, log_level, search_ips=search_ips):
-            if search_ips:
-                config.upnp_locations = locations
-                found += [config]
-            else:
-                location = locations[0]
-
-                response = requests.get(location)
-                root = etree.fromstring(response.content)
-
-                root = strip_xmlns(root)
-
-                device = root.find('device')
-                mfgr = device.find('manufacturer').text
+    if upnp_locations is not None:
+        yield config
 
-                if mfgr == 'Samsung Electronics':
-                    try:
-                        response = requests.get(
-                            'http://{0}:8001/api/v2/'.format(ip),
-                            timeout=3
-                        )
-                        is_support = (
-                            json.loads(response.content)['device']['isSupport']
-                        )
-                        token_support = json.loads(is_support)['TokenAuthSupport']
+    elif search_ips:
+        for _, locations in _discover(
+            timeout,
+            log_level,
+            search_ips=search_ips,
+            settle=SETTLE_TIME
+        ):
+            config.upnp_locations = locations
+            yield config
 
-                        if token_support:
-                            port = 8002
-                            method = 'websocket'
-
-                        else:
-                            raise ValueError
-
-
-                    except (requests.HTTPError, requests.exceptions.ConnectTimeout):
-                        port = 55000
-                        method = 'legacy'
+    else:
+        if networks:
+            devices = sweep(
+                networks,
+                rate=rate,
+                timeout=timeout,
+                confirm=True,
+                settle=SETTLE_TIME,
+                log_level=log_level
+            )
+        else:
+            devices = _discover(timeout, log_level, settle=SETTLE_TIME)
 
-                    except (ValueError, KeyError):
-                        port = 8001
-                        method = 'websocket'
+        found = 0
 
-                    host = ip
-                    config = Config(
-                        host=host,
-                        method=method,
-                        port=port,
-                        upnp_locations=locations
-                    )
+        for found_config in classify_devices(devices):
+            found += 1
+            yield found_config
 
-                found += [config]
-    else:
-        found = [config]
+            if stop_after is not None and found >= stop_after:
+                break
 
     if search_ips and config.upnp_locations is None:
         config.upnp_locations = []
-
-    return found
@@ -1,11 +1,55 @@
 import logging
 import inspect
 import sys
+import threading
+import requests
 from functools import update_wrapper
 
 PY3 = sys.version_info[0] > 2
 logger = logging.getLogger('samsungctl')
 
+# connections kept open to a single port of a host
+POOL_SIZE = 4
+# ports of a host that get a pool of their own, UPNP, the API and pairing
+POOL_PORTS = 4
+
+# host -> (session, pool size)
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(host, pool_size=POOL_SIZE):
+    """
+    Returns the pooled HTTP session used for all requests made to a host.
+
+    Keep-alive connections are reused between calls, so the TCP handshake
+    is only paid once per host instead of once per request.
+
+    :param host: IP address or hostname of the TV
+    :type host: `str`
+    :param pool_size: optional, connections that are kept open to a single
+        port. The pool only ever grows, a session that already has a bigger
+        pool keeps it.
+    :type pool_size: `int`
+    :rtype: `requests.Session`
+    """
+    with _sessions_lock:
+        session, size = _sessions.get(host, (None, 0))
+
+        if session is None:
+            session = requests.Session()
+
+        if size < pool_size:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=POOL_PORTS,
+                pool_maxsize=pool_size
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[host] = (session, pool_size)
+
+        return session
+
 
 def LogIt(func):
     """
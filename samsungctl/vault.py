@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Token storage that is shared by every process on the machine.
+
+When more then one process controls the same TV each of them would have
+to pair with the TV on its own. The vault keeps the tokens in one file,
+keyed by the TV's MAC address (or IP address when the MAC is not known),
+so the pairing only happens once per TV. A process that is pairing with a
+TV holds a lock for that TV, any other process that wants to pair with it
+waits for the lock and then uses the token that got stored.
+
+The vault is used when the ``SAMSUNGCTL_VAULT`` environment variable holds
+the path to the vault file or when one is set with `set_vault`.
+
+>>> set_vault(TokenVault('/var/lib/samsungctl/tokens.json'))
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from .fleet import atomic_write, file_lock, _lock_file, _unlock_file
+
+logger = logging.getLogger('samsungctl')
+
+ENVIRONMENT_VARIABLE = 'SAMSUNGCTL_VAULT'
+
+
+def identities(config):
+    """
+    Gets the keys a TV is stored under.
+
+    :param config: config of the TV
+    :type config: `samsungctl.Config`
+    :rtype: `list`
+    """
+    keys = []
+    if config.mac:
+        keys += [config.mac.upper().replace('-', ':')]
+    if config.host:
+        keys += [config.host]
+    return keys
+
+
+class TokenVault(object):
+    """
+    Tokens of the TV's that have been paired with.
+
+    :param path: path to the vault file
+    :type path: `str`
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+        dirs = os.path.dirname(self.path)
+        if not os.path.exists(dirs):
+            os.makedirs(dirs)
+
+        self._lock = threading.RLock()
+        self._records = {}
+        self._stat = None
+        self._pairing_locks = {}
+
+    def _file_stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def _read(self, force=False):
+        # only goes to the disk if the file has changed
+        stat = self._file_stat()
+        if not force and stat == self._stat:
+            return self._records
+
+        if stat is None:
+            records = {}
+        else:
+            try:
+                with open(self.path, 'r') as f:
+                    records = json.load(f)
+            except ValueError:
+                logger.error('token vault ' + self.path + ' is corrupt')
+                records = {}
+
+        self._records = records
+        self._stat = stat
+        return records
+
+    def get(self, config):
+        """
+        Gets the stored token of a TV.
+
+        :param config: config of the TV
+        :type config: `samsungctl.Config`
+        :return: `None` or the token
+        :rtype: `str`
+        """
+        with self._lock:
+            if self._file_stat() != self._stat:
+                with file_lock(self.path + '.lock', False):
+                    self._read()
+
+            for key in identities(config):
+                record = self._records.get(key)
+                if record is not None and record.get('token'):
+                    return record['token']
+
+    def put(self, config, token=None):
+        """
+        Stores the token of a TV.
+
+        :param config: config of the TV
+        :type config: `samsungctl.Config`
+        :param token: optional, defaults to the token in `config`
+        :type token: `str`
+        """
+        if token is None:
+            token = config.token
+        if not token:
+            return
+
+        record = dict(
+            token=token,
+            method=config.method,
+            host=config.host,
+            mac=config.mac
+        )
+
+        with self._lock:
+            with file_lock(self.path + '.lock', True):
+                records = dict(self._read(force=True))
+
+                changed = False
+                for key in identities(config):
+                    if records.get(key) != record:
+                        records[key] = record
+                        changed = True
+
+                if not changed:
+                    return
+
+                atomic_write(self.path, json.dumps(records, indent=4))
+                self._records = records
+                self._stat = self._file_stat()
+
+    def remove(self, config):
+        """
+        Removes the token of a TV, for when the TV no longer accepts it.
+
+        :param config: config of the TV
+        :type config: `samsungctl.Config`
+        """
+        with self._lock:
+            with file_lock(self.path + '.lock', True):
+                records = dict(self._read(force=True))
+
+                for key in identities(config):
+                    records.pop(key, None)
+
+                atomic_write(self.path, json.dumps(records, indent=4))
+                self._records = records
+                self._stat = self._file_stat()
+
+    @contextmanager
+    def pairing(self, config):
+        """
+        Holds the pairing lock of a TV.
+
+        Only a single thread in a single process is able to hold the lock
+        of a TV. The lock can be taken again by the thread that holds it.
+
+        There is a lock for every key the TV is stored under and all of them
+        are taken, in sorted order so two processes never wait on each
+        other. A process that only knows the IP address of the TV still
+        waits for one that also knows the MAC address.
+
+        :param config: config of the TV
+        :type config: `samsungctl.Config`
+        """
+        with self._hold(sorted(set(identities(config)))):
+            yield
+
+    @contextmanager
+    def _hold(self, keys):
+        if not keys:
+            yield
+            return
+
+        key = keys[0]
+
+        with self._lock:
+            if key not in self._pairing_locks:
+                self._pairing_locks[key] = [threading.RLock(), None, 0]
+            lock = self._pairing_locks[key]
+
+        lock[0].acquire()
+        try:
+            if lock[2] == 0:
+                lock_path = (
+                    self.path + '.' + re.sub(r'[^\w.]', '_', key) + '.lock'
+                )
+                lock[1] = open(lock_path, 'a+')
+                _lock_file(lock[1], True)
+
+            lock[2] += 1
+
+            try:
+                with self._hold(keys[1:]):
+                    yield
+            finally:
+                lock[2] -= 1
+
+                if lock[2] == 0:
+                    _unlock_file(lock[1])
+                    lock[1].close()
+                    lock[1] = None
+        finally:
+            lock[0].release()
+
+
+_vault = None
+_vault_lock = threading.Lock()
+
+
+def get_vault():
+    """
+    Gets the shared `TokenVault`.
+
+    :return: `None` if no vault has been set up
+    :rtype: `TokenVault`
+    """
+    global _vault
+
+    with _vault_lock:
+        if _vault is None and os.environ.get(ENVIRONMENT_VARIABLE):
+            _vault = TokenVault(os.environ[ENVIRONMENT_VARIABLE])
+
+        return _vault
+
+
+def set_vault(vault):
+    """
+    Sets the shared `TokenVault`.
+
+    :param vault: vault to use or `None` to stop using one
+    :type vault: `TokenVault`
+    """
+    global _vault
+
+    with _vault_lock:
+        _vault = vault
@@ -4,6 +4,8 @@ import ctypes
 import socket
 import struct
 import sys
+import threading
+import time
 import platform
 
 
@@ -23,6 +25,194 @@ else:
     WINDOWS = False
 
 
+# how long a resolved MAC address is trusted before the tables are read again
+ARP_CACHE_TTL = 300.0
+
+# how long to wait for the TV's to answer the ARP requests that the probes
+# trigger
+ARP_PROBE_TIMEOUT = 0.5
+
+ARP_FILE = '/proc/net/arp'
+
+_arp_cache = {}
+_arp_cache_lock = threading.Lock()
+
+
+def _normalize_mac(mac):
+    mac = str(mac)
+    if not PY2:
+        mac = mac.replace("b'", '').replace("'", '')
+        mac = mac.replace('\\n', '').replace('\\r', '')
+
+    mac = mac.strip().lower().replace(' ', '').replace('-', ':')
+
+    # Fix cases where there are no colons
+    if ':' not in mac and len(mac) == 12:
+        mac = ':'.join(mac[i:i + 2] for i in range(0, len(mac), 2))
+
+    # Pad single-character octets with a leading zero
+    # (e.g Darwin's ARP output)
+    elif len(mac) < 17:
+        parts = mac.split(':')
+        new_mac = []
+        for part in parts:
+            if len(part) == 1:
+                new_mac.append('0' + part)
+            else:
+                new_mac.append(part)
+        mac = ':'.join(new_mac)
+
+    # MAC address should ALWAYS be 17 characters before being returned
+    if len(mac) != 17 or mac == '00:00:00:00:00:00':
+        return None
+
+    return mac
+
+
+def read_arp_table(path=ARP_FILE):
+    """
+    Reads the kernel's ARP table.
+
+    The whole table is parsed in a single pass, entries that are not
+    complete (the TV has not answered yet) are left out.
+
+    :param path: path to the ARP table
+    :type path: `str`
+    :return: IP address -> MAC address
+    :rtype: `dict`
+    """
+    table = {}
+
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except (IOError, OSError):
+        return table
+
+    # IP address, HW type, Flags, HW address, Mask, Device
+    for line in lines[1:]:
+        fields = line.split()
+        if len(fields) < 4:
+            continue
+
+        try:
+            flags = int(fields[2], 16)
+        except ValueError:
+            continue
+
+        # ATF_COM, the entry is complete
+        if not flags & 0x2:
+            continue
+
+        mac = _normalize_mac(fields[3])
+        if mac is not None:
+            table[fields[0]] = mac
+
+    return table
+
+
+def _send_probes(ips):
+    # sending a packet to the TV makes the OS do an ARP request for it
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sent = []
+    try:
+        for ip in ips:
+            try:
+                sock.sendto(b'', (ip, 55555))
+                sent.append(ip)
+            except socket.error:
+                continue
+    finally:
+        sock.close()
+
+    return sent
+
+
+def clear_mac_cache():
+    """Forgets all of the MAC addresses that have been resolved."""
+    with _arp_cache_lock:
+        _arp_cache.clear()
+
+
+def get_mac_addresses(ips, ttl=ARP_CACHE_TTL, timeout=ARP_PROBE_TIMEOUT):
+    """
+    Gets the MAC addresses of a number of TV's.
+
+    Addresses that have been resolved in the last `ttl` seconds are returned
+    from the cache. The rest are looked up in the ARP table which is read
+    once for all of them. Anything not in the table gets probed, which makes
+    the OS send an ARP request, and the table is read again until every TV
+    has answered or `timeout` has passed. Only the addresses that are still
+    missing after that are handed to the system tools (``ip``, ``arp``) one
+    at a time.
+
+    :param ips: IP addresses of the TV's
+    :type ips: iterable of `str`
+    :param ttl: number of seconds a cached MAC address is valid for
+    :type ttl: `float`
+    :param timeout: number of seconds to wait for probed TV's to show up
+        in the ARP table
+    :type timeout: `float`
+    :return: IP address -> `None` or MAC address formatted
+        ``"00:00:00:00:00:00"``
+    :rtype: `dict`
+    """
+    result = {}
+    now = time.time()
+
+    with _arp_cache_lock:
+        for ip in ips:
+            if not PY2 and isinstance(ip, bytes):
+                ip = ip.decode('utf-8')
+
+            mac, expires = _arp_cache.get(ip, (None, 0))
+            if expires > now:
+                result[ip] = mac
+            else:
+                result[ip] = None
+
+    missing = list(ip for ip, mac in result.items() if mac is None)
+
+    def update(table):
+        for ip in missing[:]:
+            if ip in table:
+                result[ip] = table[ip]
+                missing.remove(ip)
+
+    if missing and not WINDOWS:
+        update(read_arp_table())
+
+        if missing:
+            _send_probes(missing)
+            deadline = time.time() + timeout
+
+            while True:
+                update(read_arp_table())
+                if not missing or time.time() >= deadline:
+                    break
+                time.sleep(0.05)
+
+    for ip in missing:
+        try:
+            if WINDOWS:
+                mac = _send_arp(ip)
+            else:
+                mac = _lookup(ip)
+        except:
+            mac = None
+
+        if mac:
+            result[ip] = _normalize_mac(mac)
+
+    expires = time.time() + ttl
+    with _arp_cache_lock:
+        for ip, mac in result.items():
+            if mac is not None:
+                _arp_cache[ip] = (mac, expires)
+
+    return result
+
+
 def get_mac_address(ip):
     """
     Gets the MAC address of the TV.
@@ -30,253 +220,593 @@ def get_mac_address(ip):
     This function will use the ARP lookup tables to see if there is an entry
     for the IP address that was supplied. If no entry is found an APR request
     is sent in an attempt to populate the TV to the ARP table.
+    See :func:`get_mac_addresses`.
 
     :param ip: IP address of the TV
     :type ip: `str`
     :return: `None` or MAC address of TV formatted ``"00:00:00:00:00"``
     :rtype: `None`, `str`
     """
+    if not PY2 and isinstance(ip, bytes):
+        ip = ip.decode('utf-8')
+
+    return get_mac_addresses([ip])[ip]
+
+
+def _send_arp(ip):
+    # Windows, asks the IP Helper API to resolve the address
+    if not PY2:
+        ip = ip.encode()
+    try:
+        from ctypes.wintypes import DWORD, ULONG
+        IPAddr = ULONG
+        PULONG = ctypes.POINTER(ULONG)
+        PVOID = ctypes.c_void_p
+        INADDR_ANY = 0x00000000
+
+        SendARP = ctypes.windll.Iphlpapi.SendARP
+        SendARP.argtype = [IPAddr, IPAddr, PVOID, PULONG]
+        SendARP.restype = DWORD
+
+    except AttributeError:
+        return None
+
+    try:
+        dst_addr = ctypes.windll.wsock32.inet_addr(ip)
+        if dst_addr in (0, -1):
+            raise ValueError
+    except:
+        dst_ip = socket.gethostbyname(ip)
+        dst_addr = ctypes.windll.wsock32.inet_addr(dst_ip)
+
+    src_addr = ULONG(INADDR_ANY)
+    buf = (ctypes.c_ubyte * 6)()
+
+    add_len = ctypes.c_ulong(ctypes.sizeof(buf))
+
+    res = SendARP(dst_addr, src_addr, ctypes.byref(buf), ctypes.byref(add_len))
+    if res != 0:
+        return None
+
+    mac_addr = ''
+    for int_val in struct.unpack('BBBBBB', buf):
+        if int_val > 15:
+            replace_str = '0x'
+        else:
+            replace_str = 'x'
+        mac_addr = ''.join(
+            [mac_addr, hex(int_val).replace(replace_str, '')]
+        )
+    mac = ':'.join(
+        mac_addr[i:i + 2] for i in range(0, len(mac_addr), 2)
+    ).upper()
+
+    return mac
+
+
+def _lookup(ip):
+    # last resort, asks the system tools one at a time
+    if not PY2 and isinstance(ip, bytes):
+        ip = ip.decode('utf-8')
+
+    import os
+    import re
+    import shlex
+    from subprocess import check_output
+
+    mac_re_colon = r'([0-9a-fA-F]{2}(?::[0-9a-fA-F]{2}){5})'
+
+    def _popen(command, args):
+        path = os.environ.get('PATH', os.defpath).split(os.pathsep)
+        path.extend(('/sbin', '/usr/sbin'))
+
+        for directory in path:
+            executable = os.path.join(directory, command)
+            if (
+                os.path.exists(executable) and
+                os.access(executable, os.F_OK | os.X_OK) and
+                not os.path.isdir(executable)
+            ):
+                break
+        else:
+            executable = command
+
+        return _call_proc(executable, args)
+
+    def _call_proc(executable, args):
+        cmd = [executable] + shlex.split(args)
+        env = dict(os.environ)
+        env['LC_ALL'] = 'C'  # Ensure ASCII output so we parse correctly
+
+        if PY2:
+            devnull = open(os.devnull, 'wb')
+        else:
+            import subprocess
+            devnull = subprocess.DEVNULL
+
+        output = check_output(cmd, stderr=devnull, env=env)
+
+        if PY2:
+            return str(output)
+        elif isinstance(output, bytes):
+            return str(output, 'utf-8')
+
+    def _uuid_ip():
+        from uuid import _arp_getnode
 
-    if WINDOWS:
-        if not PY2:
-            ip = ip.encode()
+        _gethostbyname = socket.gethostbyname
         try:
-            from ctypes.wintypes import DWORD, ULONG
-            IPAddr = ULONG
-            PULONG = ctypes.POINTER(ULONG)
-            PVOID = ctypes.c_void_p
-            INADDR_ANY = 0x00000000
+            socket.gethostbyname = lambda x: ip
+            mac1 = _arp_getnode()
+            if mac1 is not None:
+                mac1 = ':'.join(
+                    ('%012X' % mac1)[i:i + 2] for i in range(0, 12, 2)
+                )
+                mac2 = _arp_getnode()
+                mac2 = ':'.join(
+                    ('%012X' % mac2)[i:i + 2] for i in range(0, 12, 2)
+                )
+                if mac1 == mac2:
+                    return mac1
+        finally:
+            socket.gethostbyname = _gethostbyname
+
+    def _neighbor_show():
+        res = _popen(
+            'ip',
+            'neighbor show %s' % ip
+        )
+        res = res.partition(ip)[2].partition('lladdr')[2]
+        return res.strip().split()[0]
+
+    def _arpreq():
+        return __import__('arpreq').arpreq(ip)
+
+    esc = r'\(' + re.escape(ip) + r'\)\s+at\s+'
+
+    def _search(pattern, command, arg):
+        def wrapper():
+            match = re.search(esc + pattern, _popen(command, arg))
+            if match:
+                return match.groups()[0]
+
+        return wrapper
+
+    methods = [
+        _neighbor_show,
+        # -a: BSD-style format
+        # -n: shows numerical addresses
+        _search(mac_re_colon, 'arp', ip),
+        _search(mac_re_colon, 'arp', '-an'),
+        _search(mac_re_colon, 'arp', '-an %s' % ip)
+    ]
+    if OSX:
+        # Darwin (OSX) oddness
+        mac_re_darwin = r'([0-9a-fA-F]{1,2}(?::[0-9a-fA-F]{1,2}){5})'
 
-            SendARP = ctypes.windll.Iphlpapi.SendARP
-            SendARP.argtype = [IPAddr, IPAddr, PVOID, PULONG]
-            SendARP.restype = DWORD
+        methods += [
+            _search(mac_re_darwin, 'arp', ip),
+            _search(mac_re_darwin, 'arp', '-a'),
+            _search(mac_re_darwin, 'arp', '-a %s' % ip)
+        ]
 
-        except AttributeError:
-            return None
+    methods += [
+        _uuid_ip,
+        _arpreq,
+    ]
 
+    for m in methods:
         try:
-            dst_addr = ctypes.windll.wsock32.inet_addr(ip)
-            if dst_addr in (0, -1):
-                raise ValueError
+            mac = m()
+            if mac:
+                return mac
         except:
-            dst_ip = socket.gethostbyname(ip)
-            dst_addr = ctypes.windll.wsock32.inet_addr(dst_ip)
+            continue
 
-        src_addr = ULONG(INADDR_ANY)
-        buf = (ctypes.c_ubyte * 6)()
 
-        add_len = ctypes.c_ulong(ctypes.sizeof(buf))
+# WOL is sent to both the echo and the discard port, some TV's only listen
+# on one of them
+WOL_PORTS = (7, 9)
 
-        res = SendARP(dst_addr, src_addr, ctypes.byref(buf), ctypes.byref(add_len))
-        if res != 0:
-            return None
+# number of times every packet is sent each time a TV is woken up
+WOL_BURST = 3
 
-        mac_addr = ''
-        for int_val in struct.unpack('BBBBBB', buf):
-            if int_val > 15:
-                replace_str = '0x'
-            else:
-                replace_str = 'x'
-            mac_addr = ''.join(
-                [mac_addr, hex(int_val).replace(replace_str, '')]
+# ports that are open once a TV is ready to be connected to
+TV_PORTS = (8001, 8002, 8080, 55000)
+
+LIMITED_BROADCAST = '255.255.255.255'
+
+# seconds between checks for networks that have come up or gone away
+INTERFACE_CHECK_INTERVAL = 30.0
+
+_magic_packets = {}
+
+
+def magic_packet(mac_address):
+    """
+    Creates the WOL "magic" packet for a MAC address.
+
+    Packets are only built once for every MAC address.
+
+    :param mac_address: MAC address of the TV
+    :type mac_address: `str`
+    :rtype: `bytes`
+    """
+    try:
+        return _magic_packets[mac_address]
+    except KeyError:
+        pass
+
+    split_mac = mac_address.replace('-', ':').split(':')
+    hex_mac = list(int(h, 16) for h in split_mac)
+    hex_mac = struct.pack('BBBBBB', *hex_mac)
+
+    # create the magic packet from MAC address
+    packet = b'\xff' * 6 + hex_mac * 16
+    _magic_packets[mac_address] = packet
+    return packet
+
+
+def directed_broadcast(ip, prefix):
+    """
+    Gets the broadcast address of the subnet an IPv4 address is in.
+
+    :param ip: IP address
+    :type ip: `str`
+    :param prefix: network prefix length
+    :type prefix: `int`
+    :rtype: `str`
+    """
+    address = struct.unpack('>I', socket.inet_aton(ip))[0]
+    host_mask = (1 << (32 - prefix)) - 1
+    return socket.inet_ntoa(struct.pack('>I', address | host_mask))
+
+
+def get_broadcast_addresses():
+    """
+    Gets the directed broadcast address of every local IPv4 network.
+
+    :return: local IP address -> broadcast address
+    :rtype: `dict`
+    """
+    import ifaddr
+
+    broadcasts = {}
+
+    for adapter in ifaddr.get_adapters():
+        for adapter_ip in adapter.ips:
+            # IPv6, loopback and point to point links are skipped
+            if (
+                isinstance(adapter_ip.ip, tuple) or
+                adapter_ip.ip.startswith('127.') or
+                adapter_ip.network_prefix >= 31
+            ):
+                continue
+
+            broadcasts[adapter_ip.ip] = directed_broadcast(
+                adapter_ip.ip,
+                adapter_ip.network_prefix
             )
-        mac = ':'.join(
-            mac_addr[i:i + 2] for i in range(0, len(mac_addr), 2)
-        ).upper()
-
-    else:
-        if not PY2 and isinstance(ip, bytes):
-            ip = ip.decode('utf-8')
-
-        import os
-        import re
-        import shlex
-        from subprocess import check_output
-
-        mac_re_colon = r'([0-9a-fA-F]{2}(?::[0-9a-fA-F]{2}){5})'
-
-        def _popen(command, args):
-            path = os.environ.get('PATH', os.defpath).split(os.pathsep)
-            path.extend(('/sbin', '/usr/sbin'))
-
-            for directory in path:
-                executable = os.path.join(directory, command)
-                if (
-                    os.path.exists(executable) and
-                    os.access(executable, os.F_OK | os.X_OK) and
-                    not os.path.isdir(executable)
-                ):
-                    break
-            else:
-                executable = command
 
-            return _call_proc(executable, args)
+    return broadcasts
 
-        def _call_proc(executable, args):
-            cmd = [executable] + shlex.split(args)
-            env = dict(os.environ)
-            env['LC_ALL'] = 'C'  # Ensure ASCII output so we parse correctly
 
-            if PY2:
-                devnull = open(os.devnull, 'wb')
+def probe_ports(hosts, ports=TV_PORTS, timeout=1.0, on_up=None):
+    """
+    Checks which hosts accept a TCP connection.
+
+    The connections to all of the hosts and ports are made at the same
+    time.
+
+    :param hosts: IP addresses
+    :type hosts: iterable of `str`
+    :param ports: ports to try
+    :type ports: iterable of `int`
+    :param timeout: number of seconds to wait for the connections
+    :type timeout: `float`
+    :param on_up: optional, called with the host as soon as a connection
+        to it has been made
+    :type on_up: callable
+    :return: hosts that accepted a connection on at least one of the ports
+    :rtype: `set`
+    """
+    import errno
+    import select
+
+    # windows returns WSAEWOULDBLOCK for a connection that is being made
+    in_progress = (
+        errno.EINPROGRESS,
+        errno.EWOULDBLOCK,
+        errno.EALREADY,
+        getattr(errno, 'WSAEWOULDBLOCK', 10035)
+    )
+
+    up = set()
+    pending = {}
+
+    def add(host):
+        if host not in up:
+            up.add(host)
+            if on_up is not None:
+                on_up(host)
+
+    for host in hosts:
+        for port in ports:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(0)
+            err = sock.connect_ex((host, port))
+
+            if err == 0:
+                add(host)
+                sock.close()
+            elif err in in_progress:
+                pending[sock] = host
             else:
-                import subprocess
-                devnull = subprocess.DEVNULL
+                sock.close()
 
-            output = check_output(cmd, stderr=devnull, env=env)
+    deadline = time.time() + timeout
 
-            if PY2:
-                return str(output)
-            elif isinstance(output, bytes):
-                return str(output, 'utf-8')
+    try:
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
 
-        def _uuid_ip():
-            from uuid import _arp_getnode
+            # select cannot handle more than FD_SETSIZE sockets
+            socks = list(
+                sock for sock, host in pending.items() if host not in up
+            )[:500]
+            if not socks:
+                break
 
-            _gethostbyname = socket.gethostbyname
-            try:
-                socket.gethostbyname = lambda x: ip
-                mac1 = _arp_getnode()
-                if mac1 is not None:
-                    mac1 = ':'.join(
-                        ('%012X' % mac1)[i:i + 2] for i in range(0, 12, 2)
-                    )
-                    mac2 = _arp_getnode()
-                    mac2 = ':'.join(
-                        ('%012X' % mac2)[i:i + 2] for i in range(0, 12, 2)
-                    )
-                    if mac1 == mac2:
-                        return mac1
-            finally:
-                socket.gethostbyname = _gethostbyname
-
-        def _read_arp_file():
-            data = _read_file('/proc/net/arp')
-            if data is not None and len(data) > 1:
-                # Need a space, otherwise a search for 192.168.16.2
-                # will match 192.168.16.254 if it comes first!
-                match = re.search(re.escape(ip) + r' .+' + mac_re_colon, data)
-                if match:
-                    return match.groups()[0]
-
-        def _read_file(file_path):
-            try:
-                with open(file_path) as f:
-                    return f.read()
-            except OSError:
-                return None
-
-        def _neighbor_show():
-            res = _popen(
-                'ip',
-                'neighbor show %s' % ip
-            )
-            res = res.partition(ip)[2].partition('lladdr')[2]
-            return res.strip().split()[0]
+            _, writable, errored = select.select([], socks, socks, remaining)
+
+            for sock in set(writable + errored):
+                host = pending.pop(sock)
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    add(host)
+                sock.close()
+    finally:
+        for sock in pending:
+            sock.close()
+
+    return up
+
+
+class WakeOnLan(object):
+    """
+    Sends WOL packets to any number of TV's.
+
+    A broadcast socket is opened for every local network and kept open for
+    as long as this object is around. The networks are checked every
+    `INTERFACE_CHECK_INTERVAL` seconds and the sockets are opened again
+    when one has come up, gone away or changed address. The packets are
+    sent to the directed broadcast address of every network, as well as to
+    ``255.255.255.255``, on all of the ports in `ports`.
+
+    :param burst: number of times every packet is sent
+    :type burst: `int`
+    :param ports: ports the packets are sent to
+    :type ports: iterable of `int`
+    :param interval: seconds between the packets of a burst
+    :type interval: `float`
+    """
+
+    def __init__(self, burst=WOL_BURST, ports=WOL_PORTS, interval=0.01):
+        self.burst = burst
+        self.ports = ports
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._sockets = None
+        self._broadcasts = None
+        self._next_check = 0.0
+
+    def _open(self):
+        now = time.time()
+        if self._sockets is not None and now < self._next_check:
+            return self._sockets
+
+        self._next_check = now + INTERFACE_CHECK_INTERVAL
 
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.sendto(b'', (ip, 55555))
-        except socket.error:
-            return None
-
-        def _arpreq():
-            return __import__('arpreq').arpreq(ip)
-
-        esc = r'\(' + re.escape(ip) + r'\)\s+at\s+'
-
-        def _search(pattern, command, arg):
-            def wrapper():
-                match = re.search(esc + pattern, _popen(command, arg))
-                if match:
-                    return match.groups()[0]
-
-            return wrapper
-
-        methods = [
-            _read_arp_file,
-            _neighbor_show,
-            # -a: BSD-style format
-            # -n: shows numerical addresses
-            _search(mac_re_colon, 'arp', ip),
-            _search(mac_re_colon, 'arp', '-an'),
-            _search(mac_re_colon, 'arp', '-an %s' % ip)
-        ]
-        if OSX:
-            # Darwin (OSX) oddness
-            mac_re_darwin = r'([0-9a-fA-F]{1,2}(?::[0-9a-fA-F]{1,2}){5})'
+            broadcasts = get_broadcast_addresses()
+        except Exception:
+            broadcasts = {}
 
-            methods += [
-                _search(mac_re_darwin, 'arp', ip),
-                _search(mac_re_darwin, 'arp', '-a'),
-                _search(mac_re_darwin, 'arp', '-a %s' % ip)
-            ]
+        if self._sockets is not None:
+            if broadcasts == self._broadcasts:
+                return self._sockets
+            self._close()
 
-        methods += [
-            _uuid_ip,
-            _arpreq,
-        ]
+        sockets = []
 
-        for m in methods:
+        for local_ip, broadcast in broadcasts.items():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
             try:
-                mac = m()
-                if mac:
-                    break
-            except:
+                sock.bind((local_ip, 0))
+            except socket.error:
+                sock.close()
                 continue
-        else:
-            return
-
-        mac = str(mac)
-        if not PY2:
-            mac = mac.replace("b'", '').replace("'", '')
-            mac = mac.replace('\\n', '').replace('\\r', '')
-
-        mac = mac.strip().lower().replace(' ', '').replace('-', ':')
-
-        # Fix cases where there are no colons
-        if ':' not in mac and len(mac) == 12:
-            mac = ':'.join(mac[i:i + 2] for i in range(0, len(mac), 2))
-
-        # Pad single-character octets with a leading zero
-        # (e.g Darwin's ARP output)
-        elif len(mac) < 17:
-            parts = mac.split(':')
-            new_mac = []
-            for part in parts:
-                if len(part) == 1:
-                    new_mac.append('0' + part)
-                else:
-                    new_mac.append(part)
-            mac = ':'.join(new_mac)
-
-        # MAC address should ALWAYS be 17 characters before being returned
-        if len(mac) != 17:
-            mac = None
 
-    return mac
+            sockets.append((sock, broadcast))
+
+        # the limited broadcast is routed by the OS so it only needs
+        # to be sent once
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sockets.append((sock, LIMITED_BROADCAST))
+
+        self._sockets = sockets
+        self._broadcasts = broadcasts
+        return sockets
+
+    def _close(self):
+        if self._sockets is not None:
+            for sock, _ in self._sockets:
+                sock.close()
+            self._sockets = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def send(self, mac_addresses):
+        """
+        Sends a burst of WOL packets to a number of TV's.
+
+        Every packet for every TV goes out before the next round of the
+        burst is sent.
+
+        :param mac_addresses: MAC addresses of the TV's
+        :type mac_addresses: iterable of `str`
+        :return: `None`
+        :rtype: `None`
+        """
+        packets = list(magic_packet(mac) for mac in mac_addresses)
+
+        with self._lock:
+            datagrams = list(
+                (sock, packet, (address, port))
+                for sock, address in self._open()
+                for port in self.ports
+                for packet in packets
+            )
+
+            for i in range(self.burst):
+                if i and self.interval:
+                    time.sleep(self.interval)
+
+                for sock, packet, address in datagrams:
+                    try:
+                        sock.sendto(packet, address)
+                    except socket.error:
+                        # network unreachable, interface went down
+                        continue
+
+    def wake(self, mac_address):
+        """
+        Sends a burst of WOL packets to a TV.
+
+        :param mac_address: MAC address of the TV
+        :type mac_address: `str`
+        :return: `None`
+        :rtype: `None`
+        """
+        self.send([mac_address])
+
+    def wake_many(
+        self,
+        mac_addresses,
+        hosts=None,
+        timeout=20.0,
+        resend=1.0,
+        ports=TV_PORTS
+    ):
+        """
+        Wakes up a number of TV's.
+
+        If the IP addresses of the TV's are known the WOL bursts are
+        repeated every `resend` seconds to the TV's that have not come up
+        yet, until all of them are up or `timeout` has passed.
+
+        :param mac_addresses: MAC addresses of the TV's
+        :type mac_addresses: iterable of `str`
+        :param hosts: optional, MAC address -> IP address
+        :type hosts: `dict`
+        :param timeout: seconds to wait for the TV's to come up
+        :type timeout: `float`
+        :param resend: seconds between bursts
+        :type resend: `float`
+        :param ports: ports that are checked to see if a TV is up
+        :type ports: iterable of `int`
+        :return: MAC address -> seconds it took the TV to come up or `None`
+            if it did not come up or there is no IP address for it.
+        :rtype: `dict`
+        """
+        mac_addresses = list(mac_addresses)
+        results = dict((mac, None) for mac in mac_addresses)
+
+        start = time.time()
+        self.send(mac_addresses)
+
+        if not hosts:
+            return results
+
+        pending = dict(
+            (mac, hosts[mac]) for mac in mac_addresses if mac in hosts
+        )
+        deadline = start + timeout
+        next_send = start + resend
+
+        def on_up(host):
+            for mac, ip in list(pending.items()):
+                if ip == host:
+                    results[mac] = time.time() - start
+                    del pending[mac]
+
+        while pending:
+            now = time.time()
+            if now >= deadline:
+                break
+
+            round_end = min(now + 0.5, deadline)
+            probe_ports(
+                list(pending.values()),
+                ports,
+                round_end - now,
+                on_up
+            )
+
+            now = time.time()
+
+            if not pending:
+                break
+
+            if now >= next_send:
+                self.send(pending.keys())
+                next_send = now + resend
+
+            # TV's that refuse the connection right away
+            if round_end > now:
+                time.sleep(round_end - now)
+
+        return results
+
+
+_wake_on_lan = None
+_wake_on_lan_lock = threading.Lock()
+
+
+def _get_wake_on_lan():
+    global _wake_on_lan
+
+    with _wake_on_lan_lock:
+        if _wake_on_lan is None:
+            _wake_on_lan = WakeOnLan()
+
+        return _wake_on_lan
+
+
+def wake_many(mac_addresses, hosts=None, timeout=20.0):
+    """
+    Wakes up a number of TV's, see :meth:`WakeOnLan.wake_many`.
+    """
+    return _get_wake_on_lan().wake_many(mac_addresses, hosts, timeout)
 
 
 def send_wol(mac_address):
     """
     Send the WOL "magic" packet to power a TV on.
 
+    A burst of packets is sent using the shared :class:`WakeOnLan`
 
     :param mac_address: MAC address of the TV
     :type mac_address: `str`
     :return: `None`
     :rtype: `None`
     """
-    split_mac = mac_address.split(':')
-    hex_mac = list(int(h, 16) for h in split_mac)
-    hex_mac = struct.pack('BBBBBB', *hex_mac)
-
-    # create the magic packet from MAC address
-    packet = b'\xff' * 6 + hex_mac * 16
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    sock.sendto(packet, ('255.255.255.255', 9))
-    sock.close()
+    _get_wake_on_lan().wake(mac_address)
 
 
 if __name__ == '__main__':
@@ -3,8 +3,12 @@
 from __future__ import absolute_import, print_function
 import logging
 import threading
+import time
 import requests
+from contextlib import contextmanager
 from . import wake_on_lan
+from .power import PowerOn
+from .vault import get_vault
 from .utils import LogIt, LogItWithReturn
 
 logger = logging.getLogger('samsungctl')
@@ -28,6 +32,7 @@ class WebSocketBase(object):
         self._starting = False
         self._running = False
         self._thread = None
+        self.time_to_ready = None
 
         try:
             requests.get(
@@ -64,6 +69,99 @@ class WebSocketBase(object):
     def on_message(self, _):
         pass
 
+    def _token_from_vault(self):
+        """
+        Uses the token another process stored for the TV.
+
+        :return: `True` if a token was found
+        :rtype: `bool`
+        """
+        vault = get_vault()
+        if vault is None:
+            return False
+
+        token = vault.get(self.config)
+        if not token:
+            return False
+
+        if token != self.config.token:
+            logger.debug('using token from the vault: ' + token)
+            self.config.token = token
+            self.config.paired = True
+
+        return True
+
+    def _token_to_vault(self):
+        vault = get_vault()
+        if vault is not None and self.config.token:
+            vault.put(self.config)
+
+    @contextmanager
+    def _pairing(self):
+        """
+        Keeps other processes from pairing with the TV at the same time.
+
+        Once the lock is held the vault is checked again in case the
+        process that had the lock stored a token.
+        """
+        vault = get_vault()
+
+        if vault is None:
+            yield
+        else:
+            with vault.pairing(self.config):
+                self._token_from_vault()
+                yield
+
+    # ports that are open once the TV is ready for a connection
+    power_on_ports = (8001, 8002, 8080)
+
+    @LogItWithReturn
+    def _power_on(self, timeout=20.0):
+        """
+        Turns the TV on and opens the connection.
+
+        WOL is sent until the TV responds, see `samsungctl.power.PowerOn`,
+        after that the connection is opened as soon as the TV accepts it.
+
+        :return: `True` if the connection is open
+        :rtype: `bool`
+        """
+        power_on = PowerOn(
+            self.mac_address,
+            self.config.host,
+            timeout=timeout,
+            ports=self.power_on_ports
+        )
+        self.time_to_ready = None
+
+        if not power_on.run():
+            logger.error(
+                'Unable to power on the TV, '
+                'check network connectivity'
+            )
+            return False
+
+        self.time_to_ready = power_on.time_to_ready
+        deadline = time.time() + timeout - power_on.time_to_ready
+
+        # the TV's network comes up before the service we connect to
+        while not self.power and time.time() < deadline:
+            if not self._running:
+                try:
+                    self.open()
+                except:
+                    pass
+
+            if not self.power:
+                self._loop_event.wait(0.25)
+
+        if not self.power:
+            logger.error('TV powered on but did not accept a connection')
+            return False
+
+        return True
+
     @LogIt
     def close(self):
         """Close the connection."""
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+Fake H/J (2014, 2015) TV.
+
+The pairing endpoint is a flask application on port 8080 and the socket.io
+server runs on port 8000 like on the real TV. The TV side of the SPC key
+exchange is done using the known keys in
+`samsungctl.remote_encrypted.keys` so every command that is received can be
+decrypted and checked.
+"""
+
+from __future__ import print_function
+import base64
+import binascii
+import hashlib
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import flask
+from werkzeug.serving import make_server
+from Crypto.Cipher import AES
+
+from samsungctl.remote_encrypted import crypto, keys
+from samsungctl.remote_encrypted.command_encryption import unpad
+
+PAIRING_PORT = 8080
+SOCKET_IO_PORT = 8000
+TV_USER_ID = b'FakeSamsungTV'
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+PIN_PAGE = '''\
+<?xml version="1.0" encoding="UTF-8"?>
+<service xmlns="urn:dial-multiscreen-org:schemas:dial">
+<name>CloudPINPage</name>
+<options allowStop="true"/>
+<state>{state}</state>
+</service>'''
+
+
+def _secret(gx, private_key):
+    # mirrors the conversion done in crypto.parseClientHello
+    secret = hex(pow(gx, private_key, int(keys.prime, 16)))
+    secret = secret.rstrip("L").lstrip("0x")
+    secret = ((len(secret) % 2) * '0') + secret
+    return binascii.unhexlify(secret)
+
+
+def _sha1(data):
+    return hashlib.sha1(data).digest()
+
+
+class FakeEncryptedTV(object):
+
+    def __init__(self, host='127.0.0.1', pin='1234'):
+        self.host = host
+        self.pin = pin
+        self.pin_page_state = 'stopped'
+        self.session_id = 1
+        self.keys = []
+        self.key_event = threading.Event()
+        self.handshakes = 0
+        self.connections = 0
+        self.ctx = None
+        self._sk_prime = None
+        self._request_id = 0
+        self._running = False
+        self._sockets = []
+
+        self.app = app = flask.Flask('Fake Encrypted TV')
+
+        @app.route('/ws/apps/CloudPINPage', methods=['GET', 'POST'])
+        def cloud_pin_page():
+            if flask.request.method == 'POST':
+                self.pin_page_state = 'running'
+            return PIN_PAGE.format(state=self.pin_page_state)
+
+        @app.route('/ws/apps/CloudPINPage/run', methods=['DELETE'])
+        def close_pin_page():
+            self.pin_page_state = 'stopped'
+            return ''
+
+        @app.route('/ws/pairing', methods=['GET', 'POST'])
+        def pairing():
+            step = flask.request.args.get('step')
+
+            if step == '0':
+                return json.dumps(dict(auth_data=''))
+
+            auth_data = flask.request.get_json()['auth_Data']
+
+            if step == '1':
+                return json.dumps(self.server_hello(auth_data))
+            if step == '2':
+                return json.dumps(self.server_acknowledge(auth_data))
+
+            flask.abort(404)
+
+        self._http_server = make_server(host, PAIRING_PORT, app, threaded=True)
+
+    def start(self):
+        self._running = True
+
+        self._listen_sock = sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, SOCKET_IO_PORT))
+        sock.listen(5)
+
+        for target in (self._http_server.serve_forever, self._accept):
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+
+    def stop(self):
+        self._running = False
+        self._http_server.shutdown()
+
+        for sock in [self._listen_sock] + self._sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+
+    def server_hello(self, auth_data):
+        hello = binascii.unhexlify(auth_data['GeneratorServerHello'])
+
+        user_id_len = struct.unpack('>I', hello[11:15])[0]
+        user_id = hello[15:15 + user_id_len]
+        swapped = hello[15 + user_id_len:15 + user_id_len + 128]
+
+        aes_key = _sha1(self.pin.encode('utf-8'))[:16]
+        cipher = AES.new(aes_key, AES.MODE_CBC, b'\x00' * 16)
+        public_key = cipher.decrypt(
+            crypto.DecryptParameterDataWithAES(swapped)
+        )
+
+        self._request_id += 1
+
+        if public_key != binascii.unhexlify(keys.publicKey):
+            # wrong pin
+            return dict(
+                auth_data=json.dumps(
+                    dict(auth_type='SPC', request_id=str(self._request_id))
+                )
+            )
+
+        gx = b'\x01' + os.urandom(127)
+        secret = _secret(
+            int(binascii.hexlify(gx), 16),
+            int(keys.privateKey, 16)
+        )
+
+        cipher = AES.new(aes_key, AES.MODE_CBC, b'\x00' * 16)
+        enc_wb_gx = crypto.EncryptParameterDataWithAES(cipher.encrypt(gx))
+
+        client_hello = (
+            b'\x01\x02' +
+            b'\x00' * 5 +
+            struct.pack('>I', len(TV_USER_ID) + 132) +
+            struct.pack('>I', len(TV_USER_ID)) +
+            TV_USER_ID +
+            enc_wb_gx +
+            _sha1(TV_USER_ID + secret) +
+            b'\x00' +
+            b'\x00' * 4
+        )
+
+        self._sk_prime = _sha1(
+            TV_USER_ID +
+            user_id +
+            gx +
+            binascii.unhexlify(keys.publicKey) +
+            secret
+        )
+        self.ctx = crypto.applySamyGOKeyTransform(
+            _sha1(self._sk_prime + b'\x00')[:16]
+        )
+
+        return dict(
+            auth_data=json.dumps(
+                dict(
+                    auth_type='SPC',
+                    request_id=str(self._request_id),
+                    GeneratorClientHello=crypto.bytes2str(
+                        binascii.hexlify(client_hello)
+                    ).upper()
+                )
+            )
+        )
+
+    def server_acknowledge(self, auth_data):
+        expected = (
+            '0103000000000000000014' +
+            crypto.bytes2str(
+                binascii.hexlify(_sha1(self._sk_prime + b'\x01'))
+            ).upper() +
+            '0000000000'
+        )
+        if auth_data['ServerAckMsg'] != expected:
+            return dict(auth_data='')
+
+        client_ack = (
+            '0104000000000000000014' +
+            crypto.bytes2str(
+                binascii.hexlify(_sha1(self._sk_prime + b'\x02'))
+            ).upper() +
+            '0000000000'
+        )
+
+        return dict(
+            auth_data=json.dumps(
+                dict(
+                    auth_type='SPC',
+                    request_id=auth_data['request_id'],
+                    ClientAckMsg=client_ack,
+                    session_id=str(self.session_id)
+                )
+            )
+        )
+
+    @property
+    def token(self):
+        return (
+            crypto.bytes2str(binascii.hexlify(self.ctx)) +
+            ':' +
+            str(self.session_id)
+        )
+
+    def _accept(self):
+        while self._running:
+            try:
+                conn, _ = self._listen_sock.accept()
+            except socket.error:
+                break
+
+            self._sockets.append(conn)
+            t = threading.Thread(target=self._handle, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def _handle(self, conn):
+        try:
+            request = b''
+            while b'\r\n\r\n' not in request:
+                data = conn.recv(4096)
+                if not data:
+                    return
+                request += data
+
+            lines = request.decode('utf-8').split('\r\n')
+            path = lines[0].split(' ')[1]
+            headers = dict(
+                (
+                    line.split(':', 1)[0].strip().lower(),
+                    line.split(':', 1)[1].strip()
+                ) for line in lines[1:] if ':' in line
+            )
+
+            if path.startswith('/socket.io/1/websocket/'):
+                self._websocket(conn, headers)
+            else:
+                self.handshakes += 1
+                body = '{0}:60:60:websocket'.format(
+                    binascii.hexlify(os.urandom(8)).decode('utf-8')
+                )
+                conn.sendall(
+                    (
+                        'HTTP/1.1 200 OK\r\n'
+                        'Content-Type: text/plain\r\n'
+                        'Content-Length: {0}\r\n'
+                        'Connection: close\r\n'
+                        '\r\n'
+                        '{1}'
+                    ).format(len(body), body).encode('utf-8')
+                )
+        except socket.error:
+            pass
+        finally:
+            if conn in self._sockets:
+                self._sockets.remove(conn)
+            conn.close()
+
+    def _websocket(self, conn, headers):
+        accept = base64.b64encode(
+            _sha1(headers['sec-websocket-key'].encode('utf-8') + WEBSOCKET_GUID)
+        ).decode('utf-8')
+
+        conn.sendall(
+            (
+                'HTTP/1.1 101 Switching Protocols\r\n'
+                'Upgrade: websocket\r\n'
+                'Connection: Upgrade\r\n'
+                'Sec-WebSocket-Accept: {0}\r\n'
+                '\r\n'
+            ).format(accept).encode('utf-8')
+        )
+        self.connections += 1
+        self._send_frame(conn, b'1::')
+
+        while self._running:
+            opcode, payload = self._recv_frame(conn)
+
+            if opcode is None or opcode == 0x8:
+                break
+
+            if opcode == 0x9:
+                self._send_frame(conn, payload, 0xA)
+                continue
+
+            message = payload.decode('utf-8')
+
+            if message.startswith('5::/com.samsung.companion:'):
+                self.on_command(json.loads(message.split(':', 3)[-1]))
+
+    def on_command(self, data):
+        args = data['args'][0]
+        body = bytes(bytearray(args['body']))
+
+        cipher = AES.new(self.ctx, AES.MODE_ECB)
+        command = json.loads(unpad(cipher.decrypt(body)).decode('utf-8'))
+
+        self.keys.append(
+            (time.time(), args['Session_Id'], command['body']['param3'])
+        )
+        self.key_event.set()
+
+    @staticmethod
+    def _recv_exactly(conn, size):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise socket.error('connection closed')
+            data += chunk
+        return data
+
+    def _recv_frame(self, conn):
+        try:
+            header = bytearray(self._recv_exactly(conn, 2))
+            length = header[1] & 0x7F
+
+            if length == 126:
+                length = struct.unpack('>H', self._recv_exactly(conn, 2))[0]
+            elif length == 127:
+                length = struct.unpack('>Q', self._recv_exactly(conn, 8))[0]
+
+            if header[1] & 0x80:
+                mask = bytearray(self._recv_exactly(conn, 4))
+            else:
+                mask = bytearray(4)
+
+            payload = bytearray(self._recv_exactly(conn, length))
+        except socket.error:
+            return None, None
+
+        for i in range(length):
+            payload[i] ^= mask[i % 4]
+
+        return header[0] & 0x0F, bytes(payload)
+
+    @staticmethod
+    def _send_frame(conn, payload, opcode=0x1):
+        length = len(payload)
+
+        if length < 126:
+            header = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+
+        conn.sendall(header + payload)
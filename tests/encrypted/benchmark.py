@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the encrypted (H/J) transport against the fake TV.
+
+Measures pairing time, connect time, reconnect time, keys per second and
+the CPU time spent in the calling thread for every command.
+
+    python -m tests.encrypted.benchmark --keys 20 --runs 3
+"""
+
+from __future__ import print_function
+import argparse
+import logging
+import time
+
+from samsungctl.config import Config
+from samsungctl.remote_encrypted import (
+    RemoteEncrypted,
+    Pairing,
+    QueuePinProvider
+)
+from . import FakeEncryptedTV
+
+try:
+    thread_time = time.thread_time
+except AttributeError:
+    thread_time = getattr(time, 'process_time', time.clock)
+
+
+def run_once(tv, key_count):
+    results = {}
+
+    config = Config(
+        host=tv.host,
+        method='encrypted',
+        mac='00:00:00:00:00:00'
+    )
+    provider = QueuePinProvider()
+    provider.put(tv.pin)
+
+    start = time.time()
+    pairing = Pairing(config, provider, timeout=10.0)
+    if not pairing.run():
+        raise RuntimeError('pairing failed: ' + str(pairing.error))
+    results['pairing'] = time.time() - start
+
+    remote = RemoteEncrypted(config)
+
+    start = time.time()
+    remote.open()
+    results['connect'] = time.time() - start
+
+    del tv.keys[:]
+
+    start = time.time()
+    cpu_start = thread_time()
+    for _ in range(key_count):
+        remote.control('KEY_VOLUP')
+    cpu = thread_time() - cpu_start
+    duration = time.time() - start
+
+    results['first_command'] = remote.time_to_first_command
+    results['keys_per_second'] = key_count / duration
+    results['cpu_per_command'] = cpu / key_count
+
+    if len(tv.keys) != key_count:
+        raise RuntimeError(
+            'TV received {0} of {1} keys'.format(len(tv.keys), key_count)
+        )
+
+    remote.close()
+
+    start = time.time()
+    remote.open()
+    results['reconnect'] = time.time() - start
+    remote.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tests.encrypted.benchmark')
+    parser.add_argument('--keys', type=int, default=10)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    tv = FakeEncryptedTV()
+    tv.start()
+
+    try:
+        runs = list(run_once(tv, args.keys) for _ in range(args.runs))
+    finally:
+        tv.stop()
+
+    print('{0:<20}{1:>12}{2:>12}{3:>12}'.format('metric', 'min', 'mean', 'max'))
+    for key in (
+        'pairing',
+        'connect',
+        'first_command',
+        'reconnect',
+        'keys_per_second',
+        'cpu_per_command'
+    ):
+        values = list(run[key] for run in runs)
+        print(
+            '{0:<20}{1:>12.4f}{2:>12.4f}{3:>12.4f}'.format(
+                key,
+                min(values),
+                sum(values) / len(values),
+                max(values)
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
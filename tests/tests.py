@@ -13,6 +13,7 @@ import time
 import uuid
 import logging
 import socket
+import struct
 import flask
 
 try:
@@ -3256,6 +3257,2125 @@ class LegacyTest(unittest.TestCase):
         self.connection_event.set()
 
 
+class EncryptedTest(unittest.TestCase):
+    tv = None
+    remote = None
+    config = None
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            from encrypted import FakeEncryptedTV
+        except ImportError:
+            from .encrypted import FakeEncryptedTV
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+        EncryptedTest.tv = FakeEncryptedTV(pin='4321')
+        EncryptedTest.tv.start()
+
+        EncryptedTest.config = samsungctl.Config(
+            name="samsungctl",
+            description="PC",
+            method="encrypted",
+            host='127.0.0.1',
+            mac='00:00:00:00:00:00'
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.remote is not None:
+            cls.remote.close()
+        cls.tv.stop()
+
+    def test_001_PAIRING(self):
+        from samsungctl.remote_encrypted import Pairing, QueuePinProvider
+
+        provider = QueuePinProvider()
+        provider.put('1111')
+        provider.put(self.tv.pin, self.config.host)
+
+        pairing = Pairing(self.config, provider, timeout=10.0)
+
+        self.assertTrue(pairing.run(), pairing.error)
+        self.assertEqual(self.tv.token, self.config.token)
+        self.assertTrue(self.config.paired)
+
+    def test_001a_QUEUE_PIN_PROVIDER(self):
+        from samsungctl.remote_encrypted import QueuePinProvider
+
+        provider = QueuePinProvider()
+        self.assertIsNone(provider.get_pin(self.config, 0.1))
+
+        # a PIN for whoever asks first that comes in while waiting
+        timer = threading.Timer(0.2, provider.put, ('1234',))
+        timer.start()
+
+        start = time.time()
+        self.assertEqual('1234', provider.get_pin(self.config, 5.0))
+        self.assertLess(time.time() - start, 2.0)
+        timer.join()
+
+        provider.put('5678', 'other host')
+        provider.put('4321', self.config.host)
+        self.assertEqual('4321', provider.get_pin(self.config, None))
+
+    def test_002_CONNECTION(self):
+        if not self.config.paired:
+            self.skipTest('previous test failed')
+
+        from samsungctl.remote_encrypted import RemoteEncrypted
+
+        EncryptedTest.remote = RemoteEncrypted(self.config)
+        self.assertTrue(self.remote.open())
+        self.assertEqual(1, self.tv.connections)
+
+    def test_003_KEY_MENU(self):
+        if self.remote is None:
+            self.skipTest('NO_CONNECTION')
+
+        self.tv.key_event.clear()
+        self.assertTrue(self.remote.control('KEY_MENU'))
+        self.tv.key_event.wait(2.0)
+
+        _, session_id, key = self.tv.keys[-1]
+        self.assertEqual('KEY_MENU', key)
+        self.assertEqual(self.tv.session_id, session_id)
+
+    def test_004_RECONNECT(self):
+        if self.remote is None:
+            self.skipTest('NO_CONNECTION')
+
+        handshakes = self.tv.handshakes
+        self.remote.close()
+        self.assertTrue(self.remote.open())
+
+        # the reconnect uses the standby session negotiated after connecting
+        self.assertEqual(handshakes, self.tv.handshakes)
+        self.assertEqual(2, self.tv.connections)
+
+    def test_005_POWER_ON(self):
+        if self.remote is None:
+            self.skipTest('NO_CONNECTION')
+
+        self.remote.close()
+        self.assertFalse(self.remote.power)
+
+        self.remote.power = True
+
+        self.assertTrue(self.remote.power)
+        self.assertIsNotNone(self.remote.time_to_ready)
+        self.assertLess(self.remote.time_to_ready, 2.0)
+
+    def test_006_VAULT(self):
+        if not self.config.paired:
+            self.skipTest('previous test failed')
+
+        import tempfile
+        from samsungctl.remote_encrypted import RemoteEncrypted
+
+        path = os.path.join(tempfile.mkdtemp(), 'tokens.json')
+        samsungctl.vault.TokenVault(path).put(self.config)
+        samsungctl.vault.set_vault(samsungctl.vault.TokenVault(path))
+
+        config = samsungctl.Config(
+            method="encrypted",
+            host='127.0.0.1',
+            mac='00:00:00:00:00:00'
+        )
+        remote = RemoteEncrypted(config)
+
+        try:
+            # no pairing, the token comes out of the vault
+            self.assertTrue(remote.open())
+            self.assertEqual(self.tv.token, config.token)
+        finally:
+            remote.close()
+            samsungctl.vault.set_vault(None)
+
+
+ARP_TABLE = """\
+IP address       HW type     Flags       HW address            Mask     Device
+192.168.1.1      0x1         0x2         a0:b1:c2:d3:e4:f5     *        eth0
+192.168.1.10     0x1         0x0         00:00:00:00:00:00     *        eth0
+192.168.1.100    0x1         0x2         8C:71:F8:00:11:22     *        eth0
+192.168.1.200    0x1         0x6         8c:71:f8:00:11:33     *        wlan0
+"""
+
+
+class WakeOnLanTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write(ARP_TABLE)
+
+        samsungctl.wake_on_lan.clear_mac_cache()
+
+    def tearDown(self):
+        samsungctl.wake_on_lan.clear_mac_cache()
+        os.remove(self.path)
+
+    def test_001_READ_ARP_TABLE(self):
+        table = samsungctl.wake_on_lan.read_arp_table(self.path)
+
+        self.assertEqual(
+            {
+                '192.168.1.1': 'a0:b1:c2:d3:e4:f5',
+                '192.168.1.100': '8c:71:f8:00:11:22',
+                '192.168.1.200': '8c:71:f8:00:11:33'
+            },
+            table
+        )
+
+    def test_002_MISSING_ARP_TABLE(self):
+        self.assertEqual({}, samsungctl.wake_on_lan.read_arp_table(self.path + '.x'))
+
+    def test_003_CACHE(self):
+        with samsungctl.wake_on_lan._arp_cache_lock:
+            samsungctl.wake_on_lan._arp_cache['192.168.1.100'] = (
+                '8c:71:f8:00:11:22',
+                time.time() + 60
+            )
+
+        self.assertEqual(
+            {'192.168.1.100': '8c:71:f8:00:11:22'},
+            samsungctl.wake_on_lan.get_mac_addresses(['192.168.1.100'])
+        )
+        self.assertEqual(
+            '8c:71:f8:00:11:22',
+            samsungctl.wake_on_lan.get_mac_address('192.168.1.100')
+        )
+
+    def test_004_MAGIC_PACKET(self):
+        packet = samsungctl.wake_on_lan.magic_packet('8c:71:f8:00:11:22')
+
+        self.assertEqual(102, len(packet))
+        self.assertEqual(b'\xff' * 6, packet[:6])
+        self.assertEqual(b'\x8c\x71\xf8\x00\x11\x22' * 16, packet[6:])
+
+    def test_005_DIRECTED_BROADCAST(self):
+        self.assertEqual(
+            '192.168.1.255',
+            samsungctl.wake_on_lan.directed_broadcast('192.168.1.100', 24)
+        )
+        self.assertEqual(
+            '10.0.63.255',
+            samsungctl.wake_on_lan.directed_broadcast('10.0.12.7', 18)
+        )
+
+    def test_006_WAKE_MANY(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(5)
+
+        try:
+            wol = samsungctl.wake_on_lan.WakeOnLan(burst=1)
+            results = wol.wake_many(
+                ['8c:71:f8:00:11:22', '8c:71:f8:00:11:33'],
+                {'8c:71:f8:00:11:22': '127.0.0.1'},
+                timeout=2.0,
+                ports=[sock.getsockname()[1]]
+            )
+            wol.close()
+        finally:
+            sock.close()
+
+        self.assertIsNotNone(results['8c:71:f8:00:11:22'])
+        self.assertLess(results['8c:71:f8:00:11:22'], 2.0)
+        self.assertIsNone(results['8c:71:f8:00:11:33'])
+
+    def test_007_NETWORK_CHANGE(self):
+        wake_on_lan = samsungctl.wake_on_lan
+        broadcasts = {'127.0.0.1': '127.255.255.255'}
+
+        get_broadcast_addresses = wake_on_lan.get_broadcast_addresses
+        wake_on_lan.get_broadcast_addresses = lambda: dict(broadcasts)
+
+        wol = wake_on_lan.WakeOnLan(burst=1)
+        try:
+            sockets = wol._open()
+            self.assertEqual(2, len(sockets))
+
+            # nothing changed, the same sockets get used
+            wol._next_check = 0.0
+            self.assertIs(sockets, wol._open())
+
+            # an interface came up, it is only seen after the next check
+            broadcasts['127.0.0.2'] = '127.255.255.255'
+            self.assertIs(sockets, wol._open())
+
+            wol._next_check = 0.0
+            sockets = wol._open()
+            self.assertEqual(3, len(sockets))
+        finally:
+            wake_on_lan.get_broadcast_addresses = get_broadcast_addresses
+            wol.close()
+
+
+class AutodetectTest(unittest.TestCase):
+    servers = []
+
+    @staticmethod
+    def serve(host, port, model=None):
+        from six.moves import BaseHTTPServer
+
+        device = dict(
+            modelName=model,
+            networkType='wireless',
+            wifiMac='8c:71:f8:00:11:22',
+            TokenAuthSupport='true'
+        )
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(dict(device=device)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                pass
+
+        if model is None:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.bind((host, port))
+            server.listen(5)
+            AutodetectTest.servers.append(server)
+            return
+
+        server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+        AutodetectTest.servers.append(server)
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            if isinstance(server, socket.socket):
+                server.close()
+            else:
+                server.shutdown()
+                server.server_close()
+
+        samsungctl.autodetect.clear_cache()
+
+    def setUp(self):
+        samsungctl.autodetect.clear_cache()
+
+    def test_001_LEGACY(self):
+        self.serve('127.0.0.5', 55000)
+
+        detected = samsungctl.autodetect.detect('127.0.0.5')
+        self.assertEqual('legacy', detected.method)
+        self.assertEqual(55000, detected.port)
+
+    def test_002_WEBSOCKET(self):
+        self.serve('127.0.0.6', 8001, 'UN55NU8000')
+
+        detected = samsungctl.autodetect.detect('127.0.0.6')
+        self.assertEqual('websocket', detected.method)
+        self.assertEqual(8002, detected.port)
+        self.assertEqual('8C:71:F8:00:11:22', detected.mac)
+
+        # the cache is used for a TV that has a new IP address
+        self.assertIs(
+            detected,
+            samsungctl.autodetect.detect('127.0.0.99', '8c:71:f8:00:11:22')
+        )
+
+    def test_003_ENCRYPTED(self):
+        self.serve('127.0.0.7', 8001, 'UE48JU6400')
+
+        config = samsungctl.Config(host='127.0.0.7')
+        self.assertEqual('encrypted', config.method)
+        self.assertEqual(8080, config.port)
+        self.assertEqual('8C:71:F8:00:11:22', config.mac)
+
+    def test_004_NO_TV(self):
+        start = time.time()
+        self.assertIsNone(samsungctl.autodetect.detect('127.0.0.8'))
+        self.assertRaises(
+            samsungctl.exceptions.ConfigUnknownMethod,
+            samsungctl.Config,
+            host='127.0.0.8'
+        )
+        self.assertLess(time.time() - start, 3.0)
+
+
+class ModelDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+
+        fd, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_001_PARSE_MODEL(self):
+        for model, year, panel_type, size in (
+            ('UE48JU6400', 2015, 'UHD', 48),
+            ('UN40J5200', 2015, 'FullHD', 40),
+            ('UN55NU8000', 2018, 'UHD', 55),
+            ('UE55KS8000', 2016, 'SUHD', 55),
+            ('QN65Q7F', 2017, 'UHD', 65),
+            ('QN65Q70RAFXZA', 2019, 'UHD', 65),
+            ('UN55AU8000', 2021, 'UHD', 55),
+            ('LN40A650', 2008, 'FullHD', 40),
+        ):
+            info = samsungctl.models.parse_model(model)
+            self.assertEqual(year, info['year'], model)
+            self.assertEqual(panel_type, info['panel_type'], model)
+            self.assertEqual(size, info['size'], model)
+
+    def test_002_BUILT_IN(self):
+        database = samsungctl.models.ModelDatabase()
+
+        for model, method, port in (
+            ('UE48JU6400', 'encrypted', 8080),
+            ('UE46C8000', 'legacy', 55000),
+            ('UE55MU6100', 'websocket', 8001),
+            ('QN65Q7FN', 'websocket', 8002),
+        ):
+            info = database.lookup(model)
+            self.assertEqual(method, info['method'], model)
+            self.assertEqual(port, info['port'], model)
+            self.assertEqual('built in', info['source'], model)
+
+        self.assertIsNone(database.lookup('XYZ'))
+
+    def test_003_OVERRIDE_AND_LEARN(self):
+        database = samsungctl.models.ModelDatabase(self.path)
+        database.add_override(r'UE48JU', method='legacy', port=55000)
+        self.assertEqual('legacy', database.lookup('UE48JU6400')['method'])
+
+        database.learn('UE48JU6400', method='encrypted', port=8080)
+        info = database.lookup('ue48ju6400')
+        self.assertEqual('encrypted', info['method'])
+        self.assertEqual('learned', info['source'])
+        self.assertEqual(2015, info['year'])
+
+        database.add_override(r'UE55', features=['artmode'])
+        database.save()
+
+        loaded = samsungctl.models.ModelDatabase(self.path)
+        self.assertEqual('encrypted', loaded.lookup('UE48JU6400')['method'])
+        self.assertEqual(['artmode'], loaded.lookup('UE55KS8000')['features'])
+
+    def test_004_LEARN_KEEPS_BUILT_IN(self):
+        database = samsungctl.models.ModelDatabase()
+        database.learn('UE48JU6400', services=['RenderingControl'])
+
+        info = database.lookup('UE48JU6400')
+        self.assertEqual('encrypted', info['method'])
+        self.assertEqual(8080, info['port'])
+        self.assertEqual(['RenderingControl'], info['services'])
+        self.assertEqual('learned', info['source'])
+
+        # nothing is known about the pattern, the learned entry alone
+        database.learn('XYZ123', method='legacy')
+        self.assertEqual('legacy', database.lookup('XYZ123')['method'])
+
+    def test_005_NO_MODEL(self):
+        info = samsungctl.models.parse_model(None)
+        self.assertIsNone(info['year'])
+        self.assertIsNone(samsungctl.models.ModelDatabase().lookup(None))
+
+
+class FleetStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tvs.jsonl')
+
+    def tearDown(self):
+        import shutil
+
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def record(i):
+        return dict(
+            name='TV {0}'.format(i),
+            host='192.168.1.{0}'.format(i),
+            method='legacy',
+            port=55000,
+            mac='8C:71:F8:00:00:{0:02X}'.format(i)
+        )
+
+    def test_001_BULK_UPDATE(self):
+        store = samsungctl.fleet.FleetStore.open(self.path)
+        store.bulk_update(self.record(i) for i in range(1, 101))
+
+        self.assertEqual(100, len(store))
+        self.assertTrue(samsungctl.fleet.is_fleet_file(self.path))
+        self.assertEqual(
+            '192.168.1.42',
+            store.get(mac='8c:71:f8:00:00:2a')['host']
+        )
+        self.assertEqual('192.168.1.7', store.get(name='TV 7')['host'])
+        self.assertIsNone(store.get(host='192.168.1.200'))
+
+        # nothing but the lock file is left behind by the atomic writes
+        self.assertEqual(
+            ['tvs.jsonl', 'tvs.jsonl.lock'],
+            sorted(os.listdir(self.directory))
+        )
+
+    def test_002_PARTIAL_UPDATE(self):
+        store = samsungctl.fleet.FleetStore.open(self.path)
+        store.bulk_update([self.record(1), self.record(2)])
+
+        self.assertTrue(store.update('192.168.1.1', token='abc'))
+        self.assertFalse(store.update('192.168.1.1', token='abc'))
+
+        # a store that is not shared, like one in another process
+        other = samsungctl.fleet.FleetStore(self.path)
+        record = other.get(host='192.168.1.1')
+        self.assertEqual('abc', record['token'])
+        self.assertEqual('TV 1', record['name'])
+
+        other.update('192.168.1.2', token='def')
+        self.assertEqual('def', store.get(host='192.168.1.2')['token'])
+
+    def test_003_CONFIG(self):
+        store = samsungctl.fleet.FleetStore.open(self.path)
+        store.bulk_update([self.record(1), self.record(2)])
+
+        config = samsungctl.Config.load(self.path, name='TV 2')
+        self.assertEqual('192.168.1.2', config.host)
+        self.assertEqual('legacy', config.method)
+
+        config.description = 'Kitchen'
+        config.save()
+
+        config = samsungctl.Config.load(self.path, host='192.168.1.2')
+        self.assertEqual('Kitchen', config.description)
+        self.assertEqual(2, len(store.configs()))
+
+    def test_004_SINGLE_FILE(self):
+        path = os.path.join(self.directory, 'tv.config')
+
+        config = samsungctl.Config(**self.record(1))
+        config.save(path)
+        config.token = 'abc'
+        config.save(path)
+
+        config = samsungctl.Config.load(path)
+        self.assertEqual('TV 1', config.name)
+        self.assertEqual('abc', config.token)
+
+    def test_005_SEPARATE_STORES(self):
+        import threading
+
+        # stores that are not shared, like the ones in different processes,
+        # changing different TV's at the same time
+        stores = list(
+            samsungctl.fleet.FleetStore(self.path) for _ in range(4)
+        )
+
+        def run(index):
+            for i in range(index * 10 + 1, index * 10 + 11):
+                stores[index].update(
+                    '192.168.1.{0}'.format(i),
+                    name='TV {0}'.format(i)
+                )
+
+        threads = list(
+            threading.Thread(target=run, args=(index,))
+            for index in range(len(stores))
+        )
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        store = samsungctl.fleet.FleetStore(self.path)
+        self.assertEqual(40, len(store))
+        self.assertEqual('TV 33', store.get(host='192.168.1.33')['name'])
+
+        # a change that has not been saved yet survives a change made by
+        # someone else
+        stores[0].update('192.168.1.1', save=False, token='abc')
+        stores[1].update('192.168.1.2', token='def')
+        stores[0].save()
+        self.assertEqual('abc', store.get(host='192.168.1.1')['token'])
+        self.assertEqual('def', store.get(host='192.168.1.2')['token'])
+
+
+class ConfigPersistenceTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+
+        fd, self.path = tempfile.mkstemp(suffix='.config')
+        os.close(fd)
+
+        samsungctl.Config(
+            host='192.168.1.100',
+            method='legacy',
+            port=55000,
+            mac='8C:71:F8:00:11:22'
+        ).save(self.path)
+
+        # makes it easy to tell if the file has been written
+        os.utime(self.path, (0, 0))
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_001_NOT_DIRTY(self):
+        config = samsungctl.Config.load(self.path)
+        self.assertEqual(set(), config.dirty)
+
+        config.token = None
+        config.save()
+        self.assertEqual(0, os.path.getmtime(self.path))
+
+    def test_002_DIRTY(self):
+        config = samsungctl.Config.load(self.path)
+        config.token = 'abc'
+        config.paired = True
+        self.assertEqual({'token', 'paired'}, config.dirty)
+
+        config.save()
+        self.assertNotEqual(0, os.path.getmtime(self.path))
+        self.assertEqual(set(), config.dirty)
+        self.assertEqual('abc', samsungctl.Config.load(self.path).token)
+
+    def test_003_DEFERRED(self):
+        config = samsungctl.Config.load(self.path)
+        config.token = 'abc'
+        config.save_deferred(0.2)
+        config.port = 55001
+        config.save_deferred(0.2)
+
+        self.assertEqual(0, os.path.getmtime(self.path))
+        time.sleep(0.5)
+
+        self.assertEqual(set(), config.dirty)
+        loaded = samsungctl.Config.load(self.path)
+        self.assertEqual('abc', loaded.token)
+        self.assertEqual(55001, loaded.port)
+
+    def test_004_FLUSH(self):
+        config = samsungctl.Config.load(self.path)
+        config.mac = '8C:71:F8:00:11:33'
+        config.save_deferred(60.0)
+        config.flush()
+
+        self.assertEqual(
+            '8C:71:F8:00:11:33',
+            samsungctl.Config.load(self.path).mac
+        )
+
+
+class PowerOnTest(unittest.TestCase):
+
+    def test_001_TCP(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(5)
+
+        try:
+            power_on = samsungctl.power.PowerOn(
+                '8c:71:f8:00:11:22',
+                '127.0.0.1',
+                timeout=2.0,
+                ports=[sock.getsockname()[1]]
+            )
+            self.assertTrue(power_on.run())
+        finally:
+            sock.close()
+
+        self.assertEqual(samsungctl.power.SIGNAL_TCP, power_on.signal)
+        self.assertLess(power_on.time_to_ready, 2.0)
+
+    def test_002_TIMEOUT(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        start = time.time()
+        power_on = samsungctl.power.PowerOn(
+            '8c:71:f8:00:11:22',
+            '127.0.0.2',
+            timeout=1.0,
+            ports=[port]
+        )
+
+        self.assertFalse(power_on.run())
+        self.assertIsNone(power_on.time_to_ready)
+        self.assertLess(time.time() - start, 3.0)
+
+
+class VaultTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+
+        self.path = os.path.join(tempfile.mkdtemp(), 'tokens.json')
+        self.config = samsungctl.Config(
+            host='192.168.1.100',
+            method='websocket',
+            port=8002,
+            mac='8c:71:f8:00:11:22'
+        )
+
+    def test_001_PUT_GET(self):
+        vault = samsungctl.vault.TokenVault(self.path)
+        self.assertIsNone(vault.get(self.config))
+
+        vault.put(self.config, '1234567')
+        self.assertEqual('1234567', vault.get(self.config))
+
+        # found by MAC address after the TV changed IP addresses
+        by_mac = samsungctl.Config(host='192.168.1.101', mac='8C:71:F8:00:11:22')
+        self.assertEqual('1234567', vault.get(by_mac))
+
+        by_host = samsungctl.Config(host='192.168.1.100')
+        self.assertEqual('1234567', vault.get(by_host))
+
+    def test_002_SHARED(self):
+        vault1 = samsungctl.vault.TokenVault(self.path)
+        vault2 = samsungctl.vault.TokenVault(self.path)
+
+        vault1.put(self.config, '1234567')
+        self.assertEqual('1234567', vault2.get(self.config))
+
+        vault2.remove(self.config)
+        self.assertIsNone(vault1.get(self.config))
+
+    def test_003_PAIRING_LOCK(self):
+        vault1 = samsungctl.vault.TokenVault(self.path)
+        vault2 = samsungctl.vault.TokenVault(self.path)
+        order = []
+
+        def pair():
+            with vault2.pairing(self.config):
+                order.append('second')
+                token = vault2.get(self.config)
+            order.append(token)
+
+        t = threading.Thread(target=pair)
+
+        with vault1.pairing(self.config):
+            # the lock is reentrant
+            with vault1.pairing(self.config):
+                t.start()
+                time.sleep(0.3)
+                order.append('first')
+                vault1.put(self.config, '1234567')
+
+        t.join(2.0)
+        self.assertEqual(['first', 'second', '1234567'], order)
+
+    def test_004_PAIRING_LOCK_HOST_ONLY(self):
+        vault1 = samsungctl.vault.TokenVault(self.path)
+        vault2 = samsungctl.vault.TokenVault(self.path)
+        by_host = samsungctl.Config(host='192.168.1.100', method='websocket')
+        order = []
+
+        def pair():
+            # does not know the MAC address of the TV
+            with vault2.pairing(by_host):
+                order.append('second')
+                token = vault2.get(by_host)
+            order.append(token)
+
+        t = threading.Thread(target=pair)
+
+        with vault1.pairing(self.config):
+            t.start()
+            time.sleep(0.3)
+            order.append('first')
+            vault1.put(self.config, '1234567')
+
+        t.join(2.0)
+        self.assertEqual(['first', 'second', '1234567'], order)
+
+
+SSDP_RESPONSE = (
+    'HTTP/1.1 200 OK\r\n'
+    'CACHE-CONTROL: max-age=1800\r\n'
+    'LOCATION: {0}\r\n'
+    'ST: upnp:rootdevice\r\n'
+    'USN: uuid:{1}::upnp:rootdevice\r\n'
+    '\r\n'
+)
+
+
+class FakeSSDPDevice(object):
+    """
+    Answers M-SEARCH requests like a UPNP device would.
+
+    An IPv6 device listens on every IPv6 address and joins the multicast
+    `groups` on the adapter with the interface index `interface`.
+    """
+
+    def __init__(
+        self,
+        host,
+        locations,
+        uuid='00000000-0000-0000-0000-000000000000',
+        groups=(),
+        interface=0
+    ):
+        from samsungctl.upnp.UPNP_Device.discover import SSDP_PORT
+
+        self.locations = locations
+        self.uuid = uuid
+        self.searches = 0
+        self.thread_counts = []
+        self.hosts = []
+
+        if ':' in host:
+            self.sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+            self.sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+            host = '::'
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, SSDP_PORT))
+
+        for group in groups:
+            self.sock.setsockopt(
+                socket.IPPROTO_IPV6,
+                socket.IPV6_JOIN_GROUP,
+                socket.inet_pton(socket.AF_INET6, group) +
+                struct.pack('@I', interface)
+            )
+
+        self.sock.settimeout(0.1)
+        self._event = threading.Event()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._event.set()
+        self._thread.join(1.0)
+        self.sock.close()
+
+    def run(self):
+        while not self._event.is_set():
+            try:
+                data, addr = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+
+            if not data.startswith(b'M-SEARCH'):
+                continue
+
+            self.searches += 1
+            self.thread_counts.append(threading.active_count())
+
+            for line in data.decode('utf-8').split('\r\n'):
+                if line.upper().startswith('HOST:'):
+                    self.hosts.append(line[5:].strip())
+
+            for location in self.locations:
+                self.sock.sendto(
+                    SSDP_RESPONSE.format(location, self.uuid).encode('utf-8'),
+                    addr
+                )
+
+
+class SSDPDiscoverTest(unittest.TestCase):
+
+    def setUp(self):
+        from samsungctl.upnp.UPNP_Device import cache
+
+        cache.set_cache(cache.DiscoveryCache())
+
+        self.device = FakeSSDPDevice(
+            '127.0.0.1',
+            [
+                'http://127.0.0.1:9197/dmr',
+                'http://127.0.0.1:7676/smp_2_',
+                # root only locations are skipped
+                'http://127.0.0.1:7676'
+            ]
+        )
+        self.device.start()
+
+    def tearDown(self):
+        from samsungctl.upnp.UPNP_Device import cache
+
+        self.device.stop()
+        cache.set_cache(None)
+
+    def test_001_SEARCH_IPS(self):
+        from samsungctl.upnp.UPNP_Device.discover import discover
+
+        threads = threading.active_count()
+        start = time.time()
+        # 127.0.0.9 never answers so the search runs until the timeout
+        found = list(
+            discover(1.0, search_ips=['127.0.0.1', '127.0.0.9'], settle=0.2)
+        )
+        duration = time.time() - start
+
+        self.assertEqual(1, len(found))
+        ip, locations = found[0]
+        self.assertEqual('127.0.0.1', ip)
+        self.assertEqual(
+            ['http://127.0.0.1:7676/smp_2_', 'http://127.0.0.1:9197/dmr'],
+            sorted(locations)
+        )
+
+        # the search runs in the calling thread and ends on time
+        self.assertTrue(self.device.searches)
+        self.assertEqual(set([threads]), set(self.device.thread_counts))
+        self.assertGreaterEqual(duration, 1.0)
+        self.assertLess(duration, 1.3)
+
+    def test_002_STREAMING(self):
+        from samsungctl.upnp.UPNP_Device.discover import discover
+
+        start = time.time()
+        found = discover(5.0, search_ips=['127.0.0.1'])
+        ip, locations = next(found)
+
+        # yielded with the first location, not when the timeout is up
+        self.assertEqual('127.0.0.1', ip)
+        self.assertLess(time.time() - start, 0.5)
+        self.assertTrue(locations)
+
+        # the search is done once the targeted IP has answered
+        self.assertEqual([], list(found))
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_003_SETTLE(self):
+        from samsungctl.upnp.UPNP_Device.discover import discover
+
+        start = time.time()
+        found = list(discover(5.0, search_ips=['127.0.0.1'], settle=0.2))
+
+        self.assertEqual(1, len(found))
+        self.assertEqual(2, len(found[0][1]))
+        self.assertLess(time.time() - start, 1.0)
+
+    @unittest.skipIf(sys.version_info[0] < 3, 'Python 3 only')
+    def test_004_ASYNC(self):
+        import asyncio
+        from samsungctl.upnp.UPNP_Device.discover import AsyncDiscover
+
+        found = []
+        iterator = AsyncDiscover(5.0, search_ips=['127.0.0.1'])
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        try:
+            while True:
+                try:
+                    found.append(
+                        loop.run_until_complete(
+                            asyncio.wait_for(iterator.__anext__(), 2.0)
+                        )
+                    )
+                except StopAsyncIteration:
+                    break
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+        self.assertEqual(1, len(found))
+        self.assertEqual('127.0.0.1', found[0][0])
+
+    def test_005_CACHE(self):
+        from samsungctl.upnp.UPNP_Device.discover import discover
+        from samsungctl.upnp.UPNP_Device import cache
+
+        list(discover(5.0, search_ips=['127.0.0.1'], settle=0.2))
+        searches = self.device.searches
+
+        start = time.time()
+        found = list(discover(5.0, search_ips=['127.0.0.1']))
+
+        # answered from the cache without sending anything
+        self.assertLess(time.time() - start, 0.05)
+        self.assertEqual(searches, self.device.searches)
+        self.assertEqual(2, len(found[0][1]))
+
+        # not used when asked not to
+        list(discover(5.0, search_ips=['127.0.0.1'], cache=False))
+        self.assertGreater(self.device.searches, searches)
+
+        cache.get_cache().remove(ip='127.0.0.1')
+        self.assertNotIn('127.0.0.1', cache.get_cache())
+
+
+class IPv6DiscoverTest(unittest.TestCase):
+
+    def setUp(self):
+        from samsungctl.upnp.UPNP_Device.discover import (
+            IPV6_MCAST_GRP,
+            IPV6_SITE_MCAST_GRP,
+            _get_adapter_ips
+        )
+
+        if not socket.has_ipv6:
+            self.skipTest('IPv6 is not available')
+
+        self.uuid = '11111111-2222-3333-4444-555555555555'
+        self.adapter_ip = None
+        self.device = None
+
+        # the multicast packets loop back to a device on one of the
+        # adapters, the loopback adapter does not do multicast
+        for adapter_ip in _get_adapter_ips(ipv6=True):
+            try:
+                self.device = FakeSSDPDevice(
+                    '::',
+                    ['http://[::1]:7676/smp_2_'],
+                    self.uuid,
+                    (IPV6_MCAST_GRP, IPV6_SITE_MCAST_GRP),
+                    adapter_ip[3]
+                )
+            except socket.error:
+                continue
+
+            self.adapter_ip = adapter_ip
+            break
+
+        if self.device is None:
+            try:
+                self.device = FakeSSDPDevice(
+                    '::1',
+                    ['http://[::1]:7676/smp_2_'],
+                    self.uuid
+                )
+            except socket.error:
+                self.skipTest('unable to bind to ::1')
+
+        self.device.start()
+
+    def tearDown(self):
+        if self.device is not None:
+            self.device.stop()
+
+    def test_001_MULTICAST(self):
+        from samsungctl.upnp.UPNP_Device.discover import discover
+
+        if self.adapter_ip is None:
+            self.skipTest('no IPv6 adapter with multicast')
+
+        found = list(
+            item for item in discover(1.0, settle=0.2, cache=False)
+            if item[1] == ['http://[::1]:7676/smp_2_']
+        )
+
+        # the device answers from every one of its addresses, it only
+        # shows up once
+        self.assertEqual(1, len(found))
+        self.assertIn('[ff02::c]:1900', self.device.hosts)
+        self.assertIn('[ff05::c]:1900', self.device.hosts)
+
+    def test_002_LINK_LOCAL(self):
+        from samsungctl.upnp.UPNP_Device.discover import (
+            discover,
+            _get_adapter_ips
+        )
+
+        if self.adapter_ip is None:
+            self.skipTest('no IPv6 adapter with multicast')
+
+        link_local = list(
+            adapter_ip for adapter_ip in _get_adapter_ips(ipv6=True)
+            if adapter_ip[2] != 0
+        )
+        if not link_local:
+            self.skipTest('no link-local IPv6 adapter')
+
+        ip, _, scope_id, _ = link_local[0]
+        found = list(
+            discover(1.0, search_ips=[ip + '%' + str(scope_id)], cache=False)
+        )
+
+        self.assertEqual(1, len(found))
+        self.assertEqual(ip, found[0][0])
+
+    def test_003_MERGE_IPV4(self):
+        from samsungctl.upnp.UPNP_Device.discover import discover
+
+        device = FakeSSDPDevice(
+            '127.0.0.1',
+            ['http://127.0.0.1:9197/dmr'],
+            self.uuid
+        )
+        device.start()
+
+        try:
+            start = time.time()
+            found = list(
+                discover(
+                    2.0,
+                    search_ips=['127.0.0.1', '::1'],
+                    settle=0.2,
+                    cache=False
+                )
+            )
+            duration = time.time() - start
+        finally:
+            device.stop()
+
+        self.assertEqual(1, len(found))
+        self.assertIn(found[0][0], ('127.0.0.1', '::1'))
+        self.assertEqual(
+            sorted(['http://[::1]:7676/smp_2_', 'http://127.0.0.1:9197/dmr']),
+            sorted(found[0][1])
+        )
+        # both addresses are accounted for once the device is found
+        self.assertLess(duration, 1.5)
+
+
+class DiscoveryLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        if not sys.platform.startswith('linux'):
+            self.skipTest('loopback aliases only work on Linux')
+
+    def test_001_SEARCH_AND_SWEEP(self):
+        from tests.upnp.load_harness import raise_file_limit, run
+
+        count = 250
+        raise_file_limit(count)
+
+        measurements, complete = run(count, stages=('search', 'sweep'))
+
+        for measurement in measurements:
+            self.assertEqual(count, measurement.found, measurement.name)
+            # both run in the calling thread
+            self.assertEqual(0, measurement.peak_threads, measurement.name)
+
+        self.assertEqual(count, complete)
+
+
+class ClassifyTest(unittest.TestCase):
+    servers = []
+
+    @classmethod
+    def setUpClass(cls):
+        from six.moves import BaseHTTPServer
+
+        path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'upnp',
+            'encrypted',
+            'upnp',
+            'smp_2_.xml'
+        )
+        with open(path, 'rb') as f:
+            body = f.read()
+
+        def serve(host, delay):
+            class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    time.sleep(delay)
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *_):
+                    pass
+
+            server = BaseHTTPServer.HTTPServer((host, 7676), Handler)
+            t = threading.Thread(target=server.serve_forever)
+            t.daemon = True
+            t.start()
+            cls.servers.append(server)
+
+        serve('127.0.0.21', 0.6)
+        serve('127.0.0.22', 0.1)
+        serve('127.0.0.23', 0.1)
+        serve('127.0.0.24', 0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+
+    def test_001_CLASSIFY(self):
+        from samsungctl.upnp.discover import classify
+
+        config = classify('127.0.0.22', ['http://127.0.0.22:7676/smp_2_'])
+        self.assertEqual('encrypted', config.method)
+        self.assertEqual(8080, config.port)
+        self.assertEqual(['http://127.0.0.22:7676/smp_2_'], config.upnp_locations)
+
+    def test_002_NOT_A_TV(self):
+        from samsungctl.upnp.discover import classify
+
+        # nothing is listening on this port
+        self.assertIsNone(
+            classify('127.0.0.22', ['http://127.0.0.22:7677/smp_2_'], 1.0)
+        )
+
+    def test_003_COMPLETION_ORDER(self):
+        from samsungctl.upnp.discover import classify_devices
+
+        devices = list(
+            (host, ['http://' + host + ':7676/smp_2_'])
+            for host in ('127.0.0.21', '127.0.0.22', '127.0.0.23', '127.0.0.24')
+        )
+
+        start = time.time()
+        configs = list(classify_devices(devices))
+        duration = time.time() - start
+
+        self.assertEqual(4, len(configs))
+        # the slow TV is found last and does not hold up the others
+        self.assertEqual('127.0.0.21', configs[-1].host)
+        self.assertLess(duration, 0.85)
+
+
+class DiscoveryCacheTest(unittest.TestCase):
+    USN = 'uuid:068e7781-006e-1000-bbbf-f877b8a47bf1::upnp:rootdevice'
+
+    def setUp(self):
+        import tempfile
+        from samsungctl.upnp.UPNP_Device.cache import DiscoveryCache
+
+        self.path = os.path.join(tempfile.mkdtemp(), 'ssdp.json')
+        self.cache = DiscoveryCache(self.path)
+
+    def alive(self, location, max_age=1800, bootid='1', now=None):
+        return self.cache.update(
+            '192.168.1.100',
+            {
+                'usn': self.USN,
+                'Location': location,
+                'Cache-Control': 'max-age={0}'.format(max_age),
+                'Server': 'SHP, UPnP/1.0, Samsung UPnP SDK/1.0',
+                'BOOTID.UPNP.ORG': bootid,
+                'NTS': 'ssdp:alive'
+            },
+            now
+        )
+
+    def test_001_ALIVE(self):
+        self.assertTrue(self.alive('http://192.168.1.100:7676/smp_2_'))
+        self.assertTrue(self.alive('http://192.168.1.100:7676/smp_7_'))
+        # only the expiry changed
+        self.assertFalse(self.alive('http://192.168.1.100:7676/smp_7_'))
+
+        self.assertEqual(
+            [
+                'http://192.168.1.100:7676/smp_2_',
+                'http://192.168.1.100:7676/smp_7_'
+            ],
+            self.cache.locations('192.168.1.100')
+        )
+        entry = self.cache.get(self.USN)
+        self.assertEqual('1', entry['bootid'])
+        self.assertEqual('SHP, UPnP/1.0, Samsung UPnP SDK/1.0', entry['server'])
+
+        # the device rebooted, the old locations are gone
+        self.assertTrue(self.alive('http://192.168.1.100:7676/smp_9_', bootid='2'))
+        self.assertEqual(
+            ['http://192.168.1.100:7676/smp_9_'],
+            self.cache.locations('192.168.1.100')
+        )
+
+    def test_002_BYEBYE(self):
+        self.alive('http://192.168.1.100:7676/smp_2_')
+        self.assertTrue(
+            self.cache.update(
+                '192.168.1.100',
+                dict(USN=self.USN, NTS='ssdp:byebye')
+            )
+        )
+        self.assertNotIn('192.168.1.100', self.cache)
+        self.assertEqual(0, len(self.cache))
+
+    def test_003_EXPIRE(self):
+        self.alive('http://192.168.1.100:7676/smp_2_', max_age=10, now=time.time() - 20)
+        self.assertEqual([], self.cache.locations('192.168.1.100'))
+        self.assertEqual([self.USN], self.cache.expire())
+        self.assertEqual({}, self.cache.devices())
+
+    def test_004_PERSIST(self):
+        from samsungctl.upnp.UPNP_Device.cache import DiscoveryCache
+
+        self.alive('http://192.168.1.100:7676/smp_2_')
+        self.cache.save()
+
+        self.assertEqual(
+            {'192.168.1.100': ['http://192.168.1.100:7676/smp_2_']},
+            DiscoveryCache(self.path).devices()
+        )
+
+
+SSDP_NOTIFY = (
+    'NOTIFY * HTTP/1.1\r\n'
+    'HOST: 239.255.255.250:1900\r\n'
+    'CACHE-CONTROL: max-age=1800\r\n'
+    'LOCATION: {location}\r\n'
+    'NT: {nt}\r\n'
+    'NTS: {nts}\r\n'
+    'SERVER: SHP, UPnP/1.0, Samsung UPnP SDK/1.0\r\n'
+    'USN: uuid:068e7781-006e-1000-bbbf-f877b8a47bf1{suffix}\r\n'
+    '\r\n'
+)
+
+
+class DeviceRegistryTest(unittest.TestCase):
+    UUID = 'uuid:068e7781-006e-1000-bbbf-f877b8a47bf1'
+
+    def setUp(self):
+        from samsungctl.upnp.UPNP_Device.registry import DeviceRegistry
+        from samsungctl.upnp.UPNP_Device import cache
+
+        cache.set_cache(cache.DiscoveryCache())
+
+        self.events = []
+        self.event = threading.Event()
+        self.registry = DeviceRegistry()
+
+        def on_event(event, device):
+            self.events.append((event, device.usn, device.location))
+            self.event.set()
+
+        self.registry.subscribe(on_event)
+
+    def tearDown(self):
+        from samsungctl.upnp.UPNP_Device import cache
+
+        self.registry.stop()
+        cache.set_cache(None)
+
+    def headers(self, location='http://192.168.1.100:7676/smp_2_', nts='ssdp:alive', suffix='::upnp:rootdevice'):
+        return dict(
+            USN=self.UUID + suffix,
+            LOCATION=location,
+            NTS=nts,
+            NT='upnp:rootdevice'
+        )
+
+    def test_001_ADD_ONCE(self):
+        self.assertEqual('add', self.registry.handle('192.168.1.100', self.headers()))
+        # repeats and the other types of the same device are not events
+        self.assertIsNone(self.registry.handle('192.168.1.100', self.headers()))
+        self.assertIsNone(
+            self.registry.handle('192.168.1.100', self.headers(suffix=''))
+        )
+
+        self.assertEqual(1, len(self.registry))
+        self.assertTrue(self.registry.is_alive('192.168.1.100'))
+
+        # nothing is fetched until it is asked for
+        device = self.registry.get(self.UUID)
+        self.assertIsNone(device._device)
+
+    def test_002_CHANGE_REMOVE(self):
+        self.registry.handle('192.168.1.100', self.headers())
+        self.registry.handle(
+            '192.168.1.100',
+            self.headers(location='http://192.168.1.100:7677/smp_2_')
+        )
+        self.registry.handle('192.168.1.100', self.headers(nts='ssdp:byebye'))
+
+        self.assertEqual(
+            [
+                ('add', self.UUID, 'http://192.168.1.100:7676/smp_2_'),
+                ('change', self.UUID, 'http://192.168.1.100:7677/smp_2_'),
+                ('remove', self.UUID, 'http://192.168.1.100:7677/smp_2_')
+            ],
+            self.events
+        )
+        self.assertFalse(self.registry.is_alive('192.168.1.100'))
+
+    def test_003_EXPIRE(self):
+        self.registry.handle('192.168.1.100', self.headers(), time.time() - 3600)
+        self.assertEqual(1, len(self.registry.expire()))
+        self.assertEqual('remove', self.events[-1][0])
+        self.assertEqual(0, len(self.registry))
+
+    def test_004_LISTEN(self):
+        self.registry.start(['127.0.0.1'])
+        time.sleep(0.2)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for nts in ('ssdp:alive', 'ssdp:alive', 'ssdp:byebye'):
+                self.event.clear()
+                sock.sendto(
+                    SSDP_NOTIFY.format(
+                        location='http://127.0.0.1:7676/smp_2_',
+                        nt='upnp:rootdevice',
+                        nts=nts,
+                        suffix='::upnp:rootdevice'
+                    ).encode('utf-8'),
+                    ('127.0.0.1', 1900)
+                )
+                self.event.wait(1.0)
+        finally:
+            sock.close()
+
+        self.assertEqual(['add', 'remove'], list(event[0] for event in self.events))
+
+
+class DumpTest(unittest.TestCase):
+    IP = '192.168.1.100'
+    LOCATION = 'http://192.168.1.100:7676/smp_2_'
+
+    def setUp(self):
+        import tempfile
+
+        self.folder = tempfile.mkdtemp()
+
+    def test_001_FORMATS(self):
+        from samsungctl.upnp.UPNP_Device.dump import DumpReader, DumpWriter
+
+        packet = {
+            'USN': 'uuid:068e7781-006e-1000-bbbf-f877b8a47bf1::upnp:'
+                   'rootdevice',
+            'LOCATION': self.LOCATION,
+            'SERVER': 'SHP, UPnP/1.0, Samsung UPnP SDK/1.0',
+            'TYPE': 'response'
+        }
+
+        for name in ('dump.zip', 'dump.tar.gz', 'dump'):
+            path = os.path.join(self.folder, name)
+
+            with DumpWriter(path) as writer:
+                writer.add_packet(self.IP, packet)
+                writer.add_location(self.IP, self.LOCATION)
+                writer.add_file(self.LOCATION, u'<root/>')
+                writer.add_file('http://192.168.1.100:7676/smp_3_', b'<scpd/>')
+
+            with DumpReader(path) as reader:
+                self.assertEqual(
+                    [(self.IP, [self.LOCATION])],
+                    list(reader.replay()),
+                    name
+                )
+                self.assertEqual([(self.IP, packet)], list(reader.packets()))
+                self.assertEqual(b'<root/>', reader.read(self.LOCATION))
+                self.assertEqual(
+                    b'<scpd/>',
+                    reader.read('http://192.168.1.100:7676/smp_3_')
+                )
+                self.assertEqual(
+                    'uuid:068e7781-006e-1000-bbbf-f877b8a47bf1',
+                    reader.index[self.IP]['usn']
+                )
+
+        # a single file
+        self.assertTrue(os.path.isfile(os.path.join(self.folder, 'dump.zip')))
+
+    def test_002_BOUNDED(self):
+        from samsungctl.upnp.UPNP_Device.dump import DumpReader, DumpWriter
+
+        # the zip gets the SSDP packets copied in from the spool file
+        for name in ('dump.tar.gz', 'dump.zip'):
+            path = os.path.join(self.folder, name)
+
+            with DumpWriter(path, max_queue=4) as writer:
+                for i in range(2000):
+                    writer.add_packet(
+                        self.IP,
+                        {'LOCATION': self.LOCATION, 'SEQ': str(i)}
+                    )
+                    self.assertLessEqual(writer._queue.qsize(), 4)
+
+            with DumpReader(path) as reader:
+                packets = list(packet for _, packet in reader.packets())
+
+            self.assertEqual(list(str(i) for i in range(2000)), list(
+                packet['SEQ'] for packet in packets
+            ), name)
+
+    def test_003_DISCOVER(self):
+        from samsungctl.upnp.UPNP_Device.discover import discover
+        from samsungctl.upnp.UPNP_Device.dump import DumpReader
+
+        device = FakeSSDPDevice(
+            '127.0.0.1',
+            ['http://127.0.0.1:9197/dmr', 'http://127.0.0.1:7676']
+        )
+        device.start()
+
+        path = os.path.join(self.folder, 'dump.zip')
+
+        try:
+            found = list(
+                discover(
+                    1.0,
+                    search_ips=['127.0.0.1'],
+                    dump=path,
+                    settle=0.2,
+                    cache=False
+                )
+            )
+        finally:
+            device.stop()
+
+        with DumpReader(path) as reader:
+            self.assertEqual(found, list(reader.replay()))
+            # the packet that is skipped is still in the dump
+            self.assertIn(
+                'http://127.0.0.1:7676',
+                list(packet['LOCATION'] for _, packet in reader.packets())
+            )
+
+    def test_004_UPNP_OBJECT(self):
+        from samsungctl.upnp.UPNP_Device import UPNPObject
+        from samsungctl.upnp.UPNP_Device.dump import DumpReader
+        from tests.upnp.load_harness import VirtualDevices
+
+        if not sys.platform.startswith('linux'):
+            self.skipTest('loopback aliases only work on Linux')
+
+        devices = VirtualDevices(1, u'127.2.0.0/30')
+        devices.start()
+
+        host = devices.hosts[0]
+        locations = devices.locations(host)
+        path = os.path.join(self.folder, 'dump.tar.gz')
+
+        try:
+            UPNPObject(host, locations, path, model_cache=False)
+        finally:
+            devices.stop()
+
+        with DumpReader(path) as reader:
+            self.assertEqual([(host, locations)], list(reader.replay()))
+            # the description and the SCPD of every service
+            self.assertEqual(10, len(reader.index[host]['files']))
+            self.assertIn(b'MainTVServer2', reader.read(locations[0]))
+
+
+class UPNPTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        if not sys.platform.startswith('linux'):
+            self.skipTest('loopback aliases only work on Linux')
+
+    def test_001_CONCURRENT(self):
+        from samsungctl.upnp.UPNP_Device import UPNPObject
+        from tests.upnp.load_harness import VirtualDevices
+
+        latency = 0.3
+        devices = VirtualDevices(1, u'127.3.0.0/30', latency)
+        devices.start()
+
+        host = devices.hosts[0]
+
+        try:
+            start = time.time()
+            device = UPNPObject(
+                host,
+                devices.locations(host),
+                model_cache=False
+            )
+            duration = time.time() - start
+
+            # only the 4 descriptions, one at a time that would take 4
+            # times the latency
+            self.assertEqual(4, devices.requests)
+            self.assertLess(duration, latency * 2)
+
+            self.assertEqual(6, len(device._services))
+            for service in device._services.values():
+                self.assertFalse(service.loaded)
+                self.assertTrue(service.methods, service.__name__)
+        finally:
+            devices.stop()
+
+        self.assertEqual(10, devices.requests)
+
+    def test_002_ERROR(self):
+        import requests
+        from samsungctl.upnp.UPNP_Device.fetch import fetch_all
+        from tests.upnp.load_harness import VirtualDevices
+
+        devices = VirtualDevices(1, u'127.3.0.0/30')
+        devices.start()
+
+        host = devices.hosts[0]
+
+        try:
+            files = fetch_all(devices.locations(host))
+            self.assertEqual(4, len(files))
+
+            # nothing listens on port 1
+            self.assertRaises(
+                requests.ConnectionError,
+                fetch_all,
+                devices.locations(host) + ['http://' + host + ':1/smp_2_']
+            )
+        finally:
+            devices.stop()
+
+    def test_003_LAZY(self):
+        from samsungctl.upnp.UPNP_Device.service import Service
+        from tests.upnp.load_harness import load_fixtures
+
+        content = load_fixtures()['smp_3_'].encode('utf-8')
+        calls = []
+
+        def load():
+            calls.append(None)
+            # gives the other threads time to pile up
+            time.sleep(0.2)
+            return content
+
+        service = Service(
+            None,
+            'http://127.0.0.1:7676',
+            '/smp_3_',
+            'urn:samsung.com:service:MainTVAgent2:1',
+            '/smp_4_',
+            content=load
+        )
+        self.assertFalse(service.loaded)
+        self.assertEqual([], calls)
+
+        results = []
+        threads = list(
+            threading.Thread(
+                target=lambda: results.append(len(service.methods))
+            )
+            for _ in range(10)
+        )
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(1, len(calls))
+        self.assertTrue(service.loaded)
+        self.assertEqual(10, len(results))
+        self.assertTrue(results[0])
+        self.assertEqual(1, len(set(results)))
+        self.assertTrue(service.state_variables)
+
+    def test_004_LOAD_ERROR(self):
+        import requests
+        from samsungctl.upnp.UPNP_Device.service import Service
+
+        calls = []
+
+        def load():
+            calls.append(None)
+            raise requests.ConnectionError('the TV is off')
+
+        service = Service(
+            None,
+            'http://127.0.0.1:7676',
+            '/smp_3_',
+            'urn:samsung.com:service:MainTVAgent2:1',
+            '/smp_4_',
+            content=load
+        )
+
+        self.assertFalse(hasattr(service, 'GetDTVInformation'))
+        self.assertIsNone(getattr(service, 'GetDTVInformation', None))
+        self.assertEqual([], service.methods)
+        self.assertEqual({}, service.state_variables)
+        self.assertIsInstance(service.load_error, requests.ConnectionError)
+        # only tried the once
+        self.assertEqual(1, len(calls))
+
+    def test_005_SHARED_SESSION(self):
+        from samsungctl import utils
+        from samsungctl.upnp.UPNP_Device import fetch
+
+        session = utils.get_session('192.0.2.1')
+        self.assertEqual(
+            utils.POOL_SIZE,
+            session.get_adapter('http://192.0.2.1')._pool_maxsize
+        )
+
+        # the UPNP files get a bigger pool on the same session
+        self.assertIs(
+            session,
+            utils.get_session('192.0.2.1', fetch.MAX_WORKERS)
+        )
+        self.assertEqual(
+            fetch.MAX_WORKERS,
+            session.get_adapter('http://192.0.2.1')._pool_maxsize
+        )
+        self.assertIs(session, utils.get_session('192.0.2.1'))
+        self.assertEqual(
+            fetch.MAX_WORKERS,
+            session.get_adapter('http://192.0.2.1')._pool_maxsize
+        )
+
+
+class ModelCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        if not sys.platform.startswith('linux'):
+            self.skipTest('loopback aliases only work on Linux')
+
+        import tempfile
+        from samsungctl.upnp.UPNP_Device import cache
+
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'models')
+        self.old_cache = cache.get_cache()
+        cache.set_cache(cache.DiscoveryCache())
+
+    def tearDown(self):
+        import shutil
+        from samsungctl.upnp.UPNP_Device import cache
+
+        cache.set_cache(self.old_cache)
+        shutil.rmtree(self.folder)
+
+    @staticmethod
+    def wait(model_cache):
+        # for the files that get fetched in the background
+        for _ in range(50):
+            with model_cache._lock:
+                if not model_cache._refreshing:
+                    return
+            time.sleep(0.1)
+
+    def test_001_OFFLINE(self):
+        from samsungctl.upnp.UPNP_Device import UPNPObject
+        from samsungctl.upnp.UPNP_Device.model_cache import ModelCache
+        from tests.upnp.load_harness import VirtualDevices
+
+        devices = VirtualDevices(2, u'127.4.0.0/29')
+        devices.start()
+
+        try:
+            model_cache = ModelCache(self.path)
+            first = UPNPObject(
+                devices.hosts[0],
+                devices.locations(devices.hosts[0]),
+                model_cache=model_cache
+            )
+            for service in first.services:
+                service.methods
+            self.assertEqual(10, devices.requests)
+
+            # same model, only the descriptions get fetched to build it,
+            # the SCPD files are checked in the background
+            second = UPNPObject(
+                devices.hosts[1],
+                devices.locations(devices.hosts[1]),
+                model_cache=model_cache
+            )
+            for service in second.services:
+                service.methods
+            self.wait(model_cache)
+            self.assertEqual(20, devices.requests)
+
+            # nothing gets checked a second time
+            UPNPObject(
+                devices.hosts[1],
+                devices.locations(devices.hosts[1]),
+                model_cache=model_cache
+            )
+            self.wait(model_cache)
+            self.assertEqual(20, devices.requests)
+        finally:
+            devices.stop()
+
+        # nothing is listening anymore
+        device = UPNPObject(
+            devices.hosts[0],
+            devices.locations(devices.hosts[0]),
+            model_cache=ModelCache(self.path)
+        )
+
+        self.assertEqual(
+            sorted(first._services.keys()),
+            sorted(device._services.keys())
+        )
+        for name, service in device._services.items():
+            self.assertEqual(
+                sorted(m.__name__ for m in first._services[name].methods),
+                sorted(m.__name__ for m in service.methods)
+            )
+
+    def test_002_REVALIDATE(self):
+        from samsungctl.upnp.UPNP_Device import UPNPObject
+        from samsungctl.upnp.UPNP_Device.cache import get_cache
+        from samsungctl.upnp.UPNP_Device.model_cache import ModelCache
+        from tests.upnp.load_harness import VirtualDevices, device_uuid
+
+        devices = VirtualDevices(1, u'127.4.0.0/29')
+        devices.start()
+
+        host = devices.hosts[0]
+        locations = devices.locations(host)
+
+        def announce(bootid):
+            get_cache().update(
+                host,
+                {
+                    'USN': 'uuid:' + device_uuid(0, 0) + '::upnp:rootdevice',
+                    'LOCATION': locations[0],
+                    'BOOTID.UPNP.ORG': bootid,
+                    'CONFIGID.UPNP.ORG': '1'
+                }
+            )
+
+        try:
+            model_cache = ModelCache(self.path)
+            announce('1')
+
+            device = UPNPObject(host, locations, model_cache=model_cache)
+            for service in device.services:
+                service.methods
+            self.assertEqual(10, devices.requests)
+            self.assertEqual('1', model_cache.device(locations[0])['bootid'])
+
+            # nothing has changed
+            UPNPObject(host, locations, model_cache=model_cache)
+            self.assertEqual(10, devices.requests)
+
+            announce('2')
+            UPNPObject(host, locations, model_cache=model_cache)
+
+            # the description and the SCPD file of the first location
+            # get fetched again in the background
+            for _ in range(50):
+                if model_cache.device(locations[0])['bootid'] == '2':
+                    break
+                time.sleep(0.1)
+
+            self.assertEqual('2', model_cache.device(locations[0])['bootid'])
+            self.assertEqual(12, devices.requests)
+        finally:
+            devices.stop()
+
+    def test_003_FIRMWARE(self):
+        from samsungctl.upnp.UPNP_Device import UPNPObject
+        from samsungctl.upnp.UPNP_Device.model_cache import ModelCache
+        from tests.upnp.load_harness import VirtualDevices
+
+        devices = VirtualDevices(2, u'127.4.0.0/29')
+
+        # the second TV is on a firmware that has another action
+        name = 'smp_3_'
+        devices.files[(1, name)] = devices._fixtures[name].replace(
+            '<actionList>',
+            '<actionList><action><name>FirmwareAction</name></action>',
+            1
+        )
+        devices.start()
+
+        def build(host):
+            device = UPNPObject(
+                host,
+                devices.locations(host),
+                model_cache=model_cache
+            )
+            return set(
+                method.__name__
+                for service in device.services
+                for method in service.methods
+            )
+
+        try:
+            model_cache = ModelCache(self.path)
+            first = build(devices.hosts[0])
+            self.assertNotIn('FirmwareAction', first)
+
+            # built from the files of the first TV until they are checked
+            build(devices.hosts[1])
+            self.wait(model_cache)
+
+            second = build(devices.hosts[1])
+            self.assertIn('FirmwareAction', second)
+            self.assertEqual(first, build(devices.hosts[0]))
+
+            location = devices.locations(devices.hosts[1])[0]
+            self.assertTrue(
+                model_cache.device(location)['model'].endswith(
+                    '#' + model_cache.device(location)['udn']
+                )
+            )
+        finally:
+            devices.stop()
+
+    def test_004_SAVE_LATER(self):
+        from samsungctl.upnp.UPNP_Device import UPNPObject
+        from samsungctl.upnp.UPNP_Device.model_cache import ModelCache
+        from tests.upnp.load_harness import VirtualDevices
+
+        devices = VirtualDevices(1, u'127.4.0.0/29')
+        devices.start()
+
+        try:
+            model_cache = ModelCache(self.path)
+            device = UPNPObject(
+                devices.hosts[0],
+                devices.locations(devices.hosts[0]),
+                model_cache=model_cache
+            )
+            mtime = os.path.getmtime(self.path)
+
+            # the files that get loaded one at a time are saved together
+            for service in device.services:
+                service.methods
+            self.assertEqual(mtime, os.path.getmtime(self.path))
+            self.assertIsNotNone(model_cache._save_timer)
+
+            model_cache.flush()
+            self.assertIsNone(model_cache._save_timer)
+        finally:
+            devices.stop()
+
+        device = UPNPObject(
+            devices.hosts[0],
+            devices.locations(devices.hosts[0]),
+            model_cache=ModelCache(self.path)
+        )
+        for service in device.services:
+            self.assertTrue(service.methods)
+
+
+class XMLNSTest(unittest.TestCase):
+
+    def test_001_SOAP(self):
+        from samsungctl.upnp.UPNP_Device.xmlns import parse_xml
+        from tests.upnp.xmlns_benchmark import SOAP_RESPONSE
+
+        root = parse_xml(SOAP_RESPONSE)
+
+        self.assertEqual('Envelope', root.tag)
+        self.assertEqual(
+            '12',
+            root.find('Body/GetVolumeResponse/CurrentVolume').text
+        )
+
+    def test_002_SAME_AS_OLD(self):
+        from lxml import etree
+        from samsungctl.upnp.UPNP_Device.xmlns import parse_xml, strip_xmlns
+        from tests.upnp.xmlns_benchmark import documents, old_strip_xmlns
+
+        def tags(root):
+            return list(
+                (node.tag, node.text, sorted(node.attrib.items()))
+                for node in root.iter()
+            )
+
+        for name, content in documents():
+            expected = tags(old_strip_xmlns(etree.fromstring(content)))
+
+            self.assertEqual(expected, tags(parse_xml(content)), name)
+            self.assertEqual(
+                expected,
+                tags(strip_xmlns(etree.fromstring(content))),
+                name
+            )
+
+    def test_003_COMMENTS(self):
+        from lxml import etree
+        from samsungctl.upnp.UPNP_Device.xmlns import parse_xml, strip_xmlns
+
+        content = (
+            u'<?xml version="1.0"?>'
+            u'<root xmlns="urn:schemas-upnp-org:device-1-0">'
+            u'<!-- a comment -->'
+            u'<device><?pi data?><UDN>uuid:1</UDN></device>'
+            u'</root>'
+        )
+
+        for root in (
+            parse_xml(content),
+            strip_xmlns(etree.fromstring(content.encode('utf-8')))
+        ):
+            self.assertEqual(
+                ['root', 'device', 'UDN'],
+                list(node.tag for node in root.iter())
+            )
+            self.assertEqual('uuid:1', root.find('device/UDN').text)
+
+        self.assertRaises(etree.XMLSyntaxError, parse_xml, b'<root>')
+
+    def test_004_TEXT_IS_KEPT(self):
+        from samsungctl.upnp.UPNP_Device.xmlns import parse_xml
+
+        root = parse_xml(
+            b'<v xmlns="urn:a" foo_xmlns="1">'
+            b'&lt;DIDL-Lite xmlns="urn:b"&gt;&lt;/DIDL-Lite&gt;'
+            b'</v>'
+        )
+        self.assertEqual('v', root.tag)
+        self.assertEqual('1', root.get('foo_xmlns'))
+        self.assertEqual(
+            '<DIDL-Lite xmlns="urn:b"></DIDL-Lite>',
+            root.text
+        )
+
+        root = parse_xml(
+            b'<v xmlns="urn:a"><![CDATA[<x xmlns="urn:b"/>]]></v>'
+        )
+        self.assertEqual('<x xmlns="urn:b"/>', root.text)
+
+
+class SSDPPacketTest(unittest.TestCase):
+
+    def test_001_RESPONSE(self):
+        from samsungctl.upnp.UPNP_Device import ssdp
+
+        packet = ssdp.SSDPPacket(
+            SSDP_RESPONSE.format(
+                'http://192.168.1.100:7676/smp_2_',
+                '068e7781-006e-1000-bbbf-f877b8a47bf1'
+            ).encode('utf-8')
+        )
+
+        self.assertEqual(ssdp.TYPE_RESPONSE, packet.type)
+        # nothing has been parsed yet
+        self.assertIsNone(packet._headers)
+
+        self.assertEqual('http://192.168.1.100:7676/smp_2_', packet['LOCATION'])
+        self.assertEqual('max-age=1800', packet.get('CACHE-CONTROL'))
+        self.assertNotIn('NTS', packet)
+        self.assertEqual(ssdp.TYPE_RESPONSE, packet.to_dict()['TYPE'])
+
+    def test_002_NOTIFY(self):
+        from samsungctl.upnp.UPNP_Device import ssdp
+
+        packet = ssdp.SSDPPacket(
+            b'NOTIFY * HTTP/1.1\r\n'
+            b'host:239.255.255.250:1900\r\n'
+            b'nts:  ssdp:byebye \r\n'
+            b'bad line\r\n'
+            b'USN: uuid:1234::upnp:rootdevice\r\n'
+            b'\r\n'
+        )
+
+        self.assertEqual(ssdp.TYPE_NOTIFY, packet.type)
+        self.assertEqual(
+            {
+                'HOST': '239.255.255.250:1900',
+                'NTS': 'ssdp:byebye',
+                'USN': 'uuid:1234::upnp:rootdevice'
+            },
+            packet.headers
+        )
+
+        self.assertEqual(
+            ssdp.TYPE_SEARCH,
+            ssdp.SSDPPacket(b'M-SEARCH * HTTP/1.1\r\n\r\n').type
+        )
+        self.assertEqual(
+            ssdp.TYPE_UNKNOWN,
+            ssdp.SSDPPacket(b'HTTP/1.1 404 Not Found\r\n\r\n').type
+        )
+
+    def test_003_RECEIVE(self):
+        from samsungctl.upnp.UPNP_Device import ssdp
+
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.setblocking(0)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        # longer then the 1024 bytes that used to be read
+        server = 'Linux/4.1 UPnP/1.0 ' + 'x' * 2000
+        data = (
+            'HTTP/1.1 200 OK\r\n'
+            'LOCATION: http://127.0.0.1:7676/smp_2_\r\n'
+            'SERVER: ' + server + '\r\n'
+            'USN: uuid:1234\r\n'
+            '\r\n'
+        ).encode('utf-8')
+
+        try:
+            sender.sendto(data, receiver.getsockname())
+            sender.sendto(data, receiver.getsockname())
+            time.sleep(0.1)
+
+            buf = ssdp.create_buffer()
+            packets = list(ssdp.receive(receiver, buf))
+        finally:
+            sender.close()
+            receiver.close()
+
+        self.assertEqual(2, len(packets))
+        self.assertEqual(server, packets[0][0]['SERVER'])
+        self.assertEqual('uuid:1234', packets[1][0]['USN'])
+
+
+class SweepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = FakeSSDPDevice(
+            '127.0.0.1',
+            ['http://127.0.0.1:9197/dmr', 'http://127.0.0.1:7676/smp_2_']
+        )
+        self.device.start()
+
+    def tearDown(self):
+        self.device.stop()
+
+    def test_001_HOSTS(self):
+        from samsungctl.upnp.UPNP_Device.sweep import iter_hosts
+
+        self.assertEqual(
+            ['192.168.1.1', '192.168.1.2', '192.168.1.200'],
+            list(iter_hosts(['192.168.1.0/30', '192.168.1.200']))
+        )
+        self.assertEqual(65534, sum(1 for _ in iter_hosts(['10.0.0.0/16'])))
+        self.assertRaises(ValueError, list, iter_hosts(['ff02::/120']))
+
+    def test_002_SWEEP(self):
+        from samsungctl.upnp.UPNP_Device.sweep import sweep
+
+        threads = threading.active_count()
+        start = time.time()
+        found = list(sweep(['127.0.0.0/24'], rate=2000, timeout=0.5, settle=0.2))
+        duration = time.time() - start
+
+        self.assertEqual(1, len(found))
+        self.assertEqual('127.0.0.1', found[0][0])
+        self.assertEqual(2, len(found[0][1]))
+        self.assertEqual(set([threads]), set(self.device.thread_counts))
+
+        # 254 packets at 2000 a second and then the timeout
+        self.assertLess(duration, 1.0)
+
+    def test_003_CONFIRM(self):
+        from samsungctl.upnp.UPNP_Device.sweep import sweep
+
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(5)
+        port = server.getsockname()[1]
+
+        try:
+            found = list(
+                sweep(['127.0.0.1/32'], timeout=0.5, confirm=True, ports=[port])
+            )
+            self.assertEqual(['127.0.0.1'], list(ip for ip, _ in found))
+        finally:
+            server.close()
+
+        # nothing is listening now
+        found = list(
+            sweep(['127.0.0.1/32'], timeout=0.5, confirm=True, ports=[port])
+        )
+        self.assertEqual([], found)
+
+
 if __name__ == '__main__':
     base_path = os.path.dirname(__file__)
 
@@ -3268,6 +5388,12 @@ if __name__ == '__main__':
     sys.path.insert(0, os.path.abspath(os.path.join(base_path, '..')))
 
     import samsungctl
+    import samsungctl.autodetect
+    import samsungctl.exceptions
+    import samsungctl.fleet
+    import samsungctl.models
+    import samsungctl.power
+    import samsungctl.vault
 
     logger = logging.getLogger('samsungctl')
     unittest.main()
@@ -3284,5 +5410,11 @@ if __name__ == '__main__':
     # text_test_runner.run(legacy_test_suite)
 else:
     import samsungctl
+    import samsungctl.autodetect
+    import samsungctl.exceptions
+    import samsungctl.fleet
+    import samsungctl.models
+    import samsungctl.power
+    import samsungctl.vault
 
     logger = logging.getLogger('samsungctl')
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of classifying the devices found by SSDP.
+
+Every fake TV is the flask stand-in that serves the XML files of the
+encrypted TV in ``tests/upnp/encrypted/upnp``, each one on its own
+loopback address with a delay added to every request. The devices are
+classified one at a time and then in parallel.
+
+    python -m tests.upnp.benchmark --devices 16 --latency 0.2
+"""
+
+from __future__ import print_function
+import argparse
+import logging
+import os
+import threading
+import time
+
+import flask
+from werkzeug.serving import make_server
+
+from samsungctl.upnp.discover import classify_devices
+
+BASE_PATH = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)),
+    'encrypted',
+    'upnp'
+)
+UPNP_PORT = 7676
+
+
+def create_app(latency):
+    app = flask.Flask('Encrypted XML Provider')
+
+    @app.route('/<path:path>')
+    def get_file(path):
+        time.sleep(latency)
+
+        path = os.path.join(BASE_PATH, path + '.xml')
+        if not os.path.exists(path):
+            flask.abort(404)
+
+        with open(path, 'r') as f:
+            return f.read()
+
+    return app
+
+
+def start_devices(count, latency):
+    servers = []
+
+    for i in range(count):
+        host = '127.0.1.{0}'.format(i + 1)
+        server = make_server(host, UPNP_PORT, create_app(latency), threaded=True)
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+        servers += [(host, server)]
+
+    return servers
+
+
+def run(devices, max_workers):
+    start = time.time()
+    configs = list(classify_devices(devices, max_workers=max_workers))
+    duration = time.time() - start
+
+    if len(configs) != len(devices):
+        raise RuntimeError(
+            'classified {0} of {1} devices'.format(len(configs), len(devices))
+        )
+
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tests.upnp.benchmark')
+    parser.add_argument('--devices', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    servers = start_devices(args.devices, args.latency)
+    devices = list(
+        (host, ['http://{0}:{1}/smp_2_'.format(host, UPNP_PORT)])
+        for host, _ in servers
+    )
+
+    try:
+        sequential = run(devices, 1)
+        parallel = run(devices, args.workers)
+    finally:
+        for _, server in servers:
+            server.shutdown()
+
+    print('{0:<20}{1:>12}'.format('workers', 'seconds'))
+    print('{0:<20}{1:>12.4f}'.format(1, sequential))
+    print('{0:<20}{1:>12.4f}'.format(args.workers, parallel))
+    print('speedup: {0:.1f}x'.format(sequential / parallel))
+
+
+if __name__ == '__main__':
+    main()
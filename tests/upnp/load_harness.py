@@ -0,0 +1,608 @@
+# -*- coding: utf-8 -*-
+"""
+Load test of discovery with a large number of simulated TV's.
+
+Every virtual device has a loopback address of its own (127.1.0.1,
+127.1.0.2, ...). It answers an M-SEARCH with the four locations the
+encrypted TV in ``tests/upnp/encrypted/upnp`` has and serves the
+description and SCPD XML files captured from that TV, with a UDN of its
+own. All of the devices are run from one thread using a single
+`selectors` loop, so the threads that get counted are the ones discovery
+starts.
+
+For every number of devices the search, the sweep and the classification
+are timed and the share of devices found, the peak number of threads and
+the peak memory are reported. Loopback aliases only work on Linux.
+
+    python -m tests.upnp.load_harness --devices 10 100 1000
+"""
+
+from __future__ import print_function
+import argparse
+import errno
+import heapq
+import ipaddress
+import logging
+import os
+import re
+import select
+import socket
+import sys
+import threading
+import time
+
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+from samsungctl import models
+from samsungctl.upnp.discover import classify_devices
+from samsungctl.upnp.UPNP_Device.discover import (
+    discover,
+    SETTLE_TIME,
+    SSDP_PORT
+)
+from samsungctl.upnp.UPNP_Device.sweep import sweep
+
+BASE_PATH = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)),
+    'encrypted',
+    'upnp'
+)
+NETWORK = u'127.1.0.0/16'
+UPNP_PORT = 7676
+LOCATIONS = ('smp_2_', 'smp_7_', 'smp_15_', 'smp_25_')
+
+SSDP_RESPONSE = (
+    'HTTP/1.1 200 OK\r\n'
+    'CACHE-CONTROL: max-age=1800\r\n'
+    'EXT: \r\n'
+    'LOCATION: http://{ip}:{port}/{location}\r\n'
+    'SERVER: SHP, UPnP/1.0, Samsung UPnP SDK/1.0\r\n'
+    'ST: upnp:rootdevice\r\n'
+    'USN: uuid:{uuid}::upnp:rootdevice\r\n'
+    'Content-Length: 0\r\n'
+    '\r\n'
+)
+
+HTTP_RESPONSE = (
+    'HTTP/1.1 {status}\r\n'
+    'Content-Type: text/xml; charset="utf-8"\r\n'
+    'Content-Length: {length}\r\n'
+    'Connection: close\r\n'
+    '\r\n'
+)
+
+_UDN = re.compile(r'<UDN>uuid:[^<]*</UDN>')
+
+
+def load_fixtures():
+    """
+    :return: file name without the extension -> contents of the XML files
+        of the encrypted TV
+    :rtype: `dict`
+    """
+    fixtures = {}
+
+    for path, _, file_names in os.walk(BASE_PATH):
+        for file_name in file_names:
+            if not file_name.endswith('.xml'):
+                continue
+
+            with open(os.path.join(path, file_name), 'r') as f:
+                fixtures[file_name[:-4]] = f.read()
+
+    return fixtures
+
+
+def device_uuid(index, location):
+    return '{0:08x}-0000-1000-8000-{1:012x}'.format(index, location)
+
+
+class VirtualDevices(object):
+    """
+    A number of simulated TV's.
+
+    :param count: number of devices
+    :type count: `int`
+    :param network: network the loopback addresses are taken from
+    :type network: `str`
+    :param latency: seconds every HTTP request is held for before it is
+        answered
+    :type latency: `float`
+
+    `files` holds (index of the device, file name) -> contents of the
+    file, for a device that serves something other than the fixtures.
+    """
+
+    def __init__(self, count, network=NETWORK, latency=0.0):
+        network = ipaddress.ip_network(network)
+
+        if count > network.num_addresses - 2:
+            raise ValueError('too many devices for ' + str(network))
+
+        self.count = count
+        self.network = network
+        self.latency = latency
+        self.hosts = []
+        self.searches = 0
+        self.requests = 0
+        self._fixtures = load_fixtures()
+        self.files = {}
+        # socket -> (index, host)
+        self._ssdp = {}
+        self._http = {}
+        # connected socket -> (index, received data)
+        self._clients = {}
+        # (time it is due, number, socket, response) of the held answers
+        self._delayed = []
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        hosts = network.hosts()
+        for _ in range(count):
+            self.hosts.append(str(next(hosts)))
+
+    @property
+    def sweep_network(self):
+        """
+        Smallest network that holds all of the devices.
+
+        :rtype: `str`
+        """
+        # the network and broadcast addresses are not hosts
+        prefix = 32 - (self.count + 1).bit_length()
+        prefix = max(prefix, self.network.prefixlen)
+
+        return u'{0}/{1}'.format(self.network.network_address, prefix)
+
+    def locations(self, host):
+        return list(
+            'http://{0}:{1}/{2}'.format(host, UPNP_PORT, location)
+            for location in LOCATIONS
+        )
+
+    def start(self):
+        for index, host in enumerate(self.hosts):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, SSDP_PORT))
+            sock.setblocking(0)
+            self._ssdp[sock] = (index, host)
+
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, UPNP_PORT))
+            sock.listen(128)
+            sock.setblocking(0)
+            self._http[sock] = (index, host)
+
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join(3.0)
+
+        for sock in (
+            list(self._ssdp) + list(self._http) + list(self._clients) +
+            list(item[2] for item in self._delayed)
+        ):
+            sock.close()
+
+        del self._delayed[:]
+
+        self._ssdp.clear()
+        self._http.clear()
+        self._clients.clear()
+
+    def run(self):
+        if selectors is None:
+            selector = None
+        else:
+            selector = selectors.DefaultSelector()
+            for sock in list(self._ssdp) + list(self._http):
+                selector.register(sock, selectors.EVENT_READ)
+
+        while not self._stop_event.is_set():
+            timeout = 0.2
+            if self._delayed:
+                due = self._delayed[0][0] - time.time()
+                timeout = max(min(timeout, due), 0)
+
+            if selector is None:
+                ready = select.select(
+                    list(self._ssdp) + list(self._http) + list(self._clients),
+                    [],
+                    [],
+                    timeout
+                )[0]
+            else:
+                ready = list(
+                    key.fileobj for key, _ in selector.select(timeout)
+                )
+
+            for sock in ready:
+                if sock in self._ssdp:
+                    self._answer_search(sock)
+                elif sock in self._http:
+                    client = self._accept(sock)
+                    if client is not None and selector is not None:
+                        selector.register(client, selectors.EVENT_READ)
+                elif sock in self._clients:
+                    response = self._read_request(sock)
+                    if response is None:
+                        continue
+
+                    if selector is not None:
+                        selector.unregister(sock)
+                    del self._clients[sock]
+
+                    if self.latency and response:
+                        heapq.heappush(
+                            self._delayed,
+                            (
+                                time.time() + self.latency,
+                                self.requests,
+                                sock,
+                                response
+                            )
+                        )
+                    else:
+                        self._respond(sock, response)
+
+            while self._delayed and self._delayed[0][0] <= time.time():
+                _, _, sock, response = heapq.heappop(self._delayed)
+                self._respond(sock, response)
+
+        if selector is not None:
+            selector.close()
+
+    def _answer_search(self, sock):
+        index, host = self._ssdp[sock]
+
+        while True:
+            try:
+                data, addr = sock.recvfrom(1024)
+            except socket.error as err:
+                if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                return
+
+            if not data.startswith(b'M-SEARCH'):
+                continue
+
+            self.searches += 1
+
+            for i, location in enumerate(LOCATIONS):
+                packet = SSDP_RESPONSE.format(
+                    ip=host,
+                    port=UPNP_PORT,
+                    location=location,
+                    uuid=device_uuid(index, i)
+                )
+                try:
+                    sock.sendto(packet.encode('utf-8'), addr)
+                except socket.error:
+                    pass
+
+    def _accept(self, sock):
+        try:
+            client, _ = sock.accept()
+        except socket.error:
+            return None
+
+        client.setblocking(0)
+        self._clients[client] = (self._http[sock][0], b'')
+        return client
+
+    def _read_request(self, sock):
+        # returns the response once the request is in, an empty response
+        # when the connection went away
+        index, data = self._clients[sock]
+
+        try:
+            chunk = sock.recv(4096)
+        except socket.error as err:
+            if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return None
+            return b''
+
+        if not chunk:
+            return b''
+
+        data += chunk
+        if b'\r\n\r\n' not in data:
+            self._clients[sock] = (index, data)
+            return None
+
+        self.requests += 1
+
+        path = data.split(b'\r\n', 1)[0].split(b' ')[1].decode('utf-8')
+        name = path.rstrip('/').rsplit('/', 1)[-1]
+        content = self.files.get((index, name), self._fixtures.get(name))
+
+        if content is None:
+            status = '404 Not Found'
+            content = ''
+        else:
+            status = '200 OK'
+            if name in LOCATIONS:
+                content = _UDN.sub(
+                    '<UDN>uuid:{0}</UDN>'.format(
+                        device_uuid(index, LOCATIONS.index(name))
+                    ),
+                    content
+                )
+
+        content = content.encode('utf-8')
+        header = HTTP_RESPONSE.format(status=status, length=len(content))
+        return header.encode('utf-8') + content
+
+    @staticmethod
+    def _respond(sock, response):
+        if response:
+            # the responses fit in the send buffer of a loopback connection
+            sock.setblocking(1)
+            sock.settimeout(1.0)
+            try:
+                sock.sendall(response)
+            except socket.error:
+                pass
+
+        sock.close()
+
+
+def _max_rss():
+    if resource is None:
+        return 0
+
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Measurement(object):
+    """
+    Measures the wall time, peak number of threads and peak memory of
+    whatever runs inside of it.
+
+    The memory is how much the peak size of the process grew by, with
+    `trace_memory` set it is the peak of what Python allocated. Tracing
+    the allocations makes everything a few times slower.
+
+    :param name: name of the stage
+    :type name: `str`
+    :param trace_memory: use `tracemalloc` (Python 3 only)
+    :type trace_memory: `bool`
+    """
+
+    def __init__(self, name, trace_memory=False):
+        self.name = name
+        self.trace_memory = trace_memory and tracemalloc is not None
+        self.found = 0
+        self.duration = 0.0
+        self.peak_threads = 0
+        self.peak_memory = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._baseline = 0
+
+    def _sample(self):
+        while not self._stop_event.wait(0.005):
+            self.peak_threads = max(
+                self.peak_threads,
+                threading.active_count() - self._baseline
+            )
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._sample)
+        self._thread.daemon = True
+        self._thread.start()
+        self._baseline = threading.active_count()
+
+        if self.trace_memory:
+            tracemalloc.start()
+        else:
+            self._start_rss = _max_rss()
+
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *_):
+        self.duration = time.time() - self._start
+
+        if self.trace_memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            self.peak_memory = _max_rss() - self._start_rss
+
+        self._stop_event.set()
+        self._thread.join()
+
+
+def run(
+    count,
+    timeout=5.0,
+    rate=5000,
+    stages=('search', 'sweep', 'classify'),
+    trace_memory=False
+):
+    """
+    Runs discovery against `count` virtual devices.
+
+    :return: the measurement of every stage along with the devices the
+        search found with all four of their locations
+    :rtype: (`list` of `Measurement`, `int`)
+    """
+    devices = VirtualDevices(count)
+    devices.start()
+
+    measurements = []
+    found = []
+
+    try:
+        if 'search' in stages:
+            with Measurement('search', trace_memory) as measurement:
+                found = list(
+                    discover(
+                        timeout,
+                        search_ips=devices.hosts,
+                        settle=SETTLE_TIME,
+                        cache=False
+                    )
+                )
+            measurement.found = len(found)
+            measurements.append(measurement)
+
+        if 'sweep' in stages:
+            with Measurement('sweep', trace_memory) as measurement:
+                swept = list(
+                    sweep(
+                        [devices.sweep_network],
+                        rate=rate,
+                        timeout=1.0,
+                        settle=SETTLE_TIME
+                    )
+                )
+            measurement.found = len(swept)
+            measurements.append(measurement)
+
+            if not found:
+                found = swept
+
+        if 'classify' in stages:
+            models.set_database(models.ModelDatabase())
+            try:
+                with Measurement('classify', trace_memory) as measurement:
+                    configs = list(classify_devices(found))
+            finally:
+                models.set_database(None)
+
+            measurement.found = len(configs)
+            measurements.append(measurement)
+
+    finally:
+        devices.stop()
+
+    complete = sum(
+        1 for _, locations in found if len(locations) == len(LOCATIONS)
+    )
+    return measurements, complete
+
+
+def raise_file_limit(count):
+    # two sockets for every device plus the connections
+    if resource is None:
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = count * 2 + 256
+
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        if hard != resource.RLIM_INFINITY:
+            needed = min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tests.upnp.load_harness')
+    parser.add_argument(
+        '--devices',
+        type=int,
+        nargs='+',
+        default=[10, 100, 1000]
+    )
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--rate', type=int, default=5000)
+    parser.add_argument(
+        '--stages',
+        nargs='+',
+        default=['search', 'sweep', 'classify'],
+        choices=['search', 'sweep', 'classify']
+    )
+    parser.add_argument(
+        '--trace-memory',
+        action='store_true',
+        help='measure the memory Python allocates, this is a lot slower'
+    )
+    parser.add_argument(
+        '--min-found',
+        type=float,
+        default=1.0,
+        help='exit with an error if a stage finds less then this share '
+             'of the devices'
+    )
+    args = parser.parse_args()
+
+    # a virtual device has no MAC address, which gets logged as an error
+    logging.getLogger('UPNP_Devices').setLevel(logging.CRITICAL)
+    logging.getLogger('samsungctl').setLevel(logging.CRITICAL)
+    raise_file_limit(max(args.devices))
+
+    print(
+        '{0:>8}{1:>10}{2:>10}{3:>10}{4:>10}{5:>12}'.format(
+            'devices',
+            'stage',
+            'found',
+            'seconds',
+            'threads',
+            'memory kB'
+        )
+    )
+
+    failed = False
+
+    for count in args.devices:
+        measurements, complete = run(
+            count,
+            args.timeout,
+            args.rate,
+            args.stages,
+            args.trace_memory
+        )
+
+        for measurement in measurements:
+            print(
+                '{0:>8}{1:>10}{2:>9.1f}%{3:>10.3f}{4:>10}{5:>12.0f}'.format(
+                    count,
+                    measurement.name,
+                    100.0 * measurement.found / count,
+                    measurement.duration,
+                    measurement.peak_threads,
+                    measurement.peak_memory / 1024.0
+                )
+            )
+
+            if measurement.found < count * args.min_found:
+                failed = True
+
+        if 'search' in args.stages:
+            print(
+                '{0:>8}{1:>10}{2:>9.1f}%'.format(
+                    count,
+                    'complete',
+                    100.0 * complete / count
+                )
+            )
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
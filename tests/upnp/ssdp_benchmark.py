@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the SSDP packet parser.
+
+Measures packets per second for the old decode and split parser and for
+`SSDPPacket`, both when only the type of the packet is checked and when
+the LOCATION is read, and for receiving packets over the loopback
+adapter.
+
+    python -m tests.upnp.ssdp_benchmark --packets 100000
+"""
+
+from __future__ import print_function
+import argparse
+import socket
+import threading
+import time
+
+from samsungctl.upnp.UPNP_Device import ssdp
+
+PACKET = (
+    'HTTP/1.1 200 OK\r\n'
+    'CACHE-CONTROL: max-age=1800\r\n'
+    'DATE: Thu, 01 Jan 1970 02:33:09 GMT\r\n'
+    'EXT: \r\n'
+    'LOCATION: http://192.168.1.100:7676/smp_2_\r\n'
+    'SERVER: SHP, UPnP/1.0, Samsung UPnP SDK/1.0\r\n'
+    'ST: upnp:rootdevice\r\n'
+    'USN: uuid:068e7781-006e-1000-bbbf-f877b8a47bf1::upnp:rootdevice\r\n'
+    'Content-Length: 0\r\n'
+    '\r\n'
+).encode('utf-8')
+
+
+def old_parser(packet):
+    # the parser discover used to have
+    packet_type, packet = packet.decode('utf-8').split('\n', 1)
+    if '200 OK' in packet_type:
+        packet_type = 'response'
+    elif 'MSEARCH' in packet_type:
+        packet_type = 'search'
+    elif 'NOTIFY' in packet_type:
+        packet_type = 'notify'
+    else:
+        packet_type = 'unknown'
+
+    packet = dict(
+        (
+            line.split(':', 1)[0].strip().upper(),
+            line.split(':', 1)[1].strip()
+        ) for line in packet.split('\n') if line.strip()
+    )
+
+    packet['TYPE'] = packet_type
+    return packet
+
+
+def rate(func, count):
+    start = time.time()
+    for _ in range(count):
+        func()
+    return count / (time.time() - start)
+
+
+def receive_rate(count):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.setblocking(0)
+    address = receiver.getsockname()
+
+    def send():
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for _ in range(count):
+            sender.sendto(PACKET, address)
+        sender.close()
+
+    t = threading.Thread(target=send)
+    buf = ssdp.create_buffer()
+    received = 0
+
+    start = time.time()
+    t.start()
+
+    # stops once the sender is done and nothing more shows up
+    idle = None
+    while received < count:
+        got = 0
+        for packet, _ in ssdp.receive(receiver, buf):
+            packet.get('LOCATION')
+            got += 1
+
+        received += got
+
+        if got:
+            idle = None
+        elif not t.is_alive():
+            if idle is None:
+                idle = time.time()
+            elif time.time() - idle > 0.5:
+                break
+
+    duration = time.time() - start
+    t.join()
+    receiver.close()
+
+    return received, received / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tests.upnp.ssdp_benchmark')
+    parser.add_argument('--packets', type=int, default=100000)
+    args = parser.parse_args()
+
+    count = args.packets
+
+    results = [
+        ('old parser', rate(lambda: old_parser(PACKET)['TYPE'], count)),
+        (
+            'type only',
+            rate(lambda: ssdp.SSDPPacket(PACKET).type, count)
+        ),
+        (
+            'type + LOCATION',
+            rate(lambda: ssdp.SSDPPacket(PACKET).get('LOCATION'), count)
+        ),
+    ]
+
+    print('{0:<20}{1:>16}'.format('parser', 'packets/s'))
+    for name, value in results:
+        print('{0:<20}{1:>16.0f}'.format(name, value))
+
+    received, value = receive_rate(count)
+    print()
+    print(
+        'received {0} of {1} packets over loopback, {2:.0f} packets/s'.format(
+            received,
+            count,
+            value
+        )
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of building the UPNP device tree of a TV.
+
+A virtual TV from `tests.upnp.load_harness` answers every HTTP request
+after a delay. The tree gets built with the files fetched one at a time
+and with all of them fetched at once, which only fetches the descriptions
+as the SCPD files are loaded the first time a service is used. Then every
+service gets used right away, once fetching everything and once from a
+model cache that already has the TV in it.
+
+    python -m tests.upnp.tree_benchmark --latency 0.1
+"""
+
+from __future__ import print_function
+import argparse
+import time
+
+from samsungctl import utils
+from samsungctl.upnp.UPNP_Device import fetch
+from samsungctl.upnp.UPNP_Device.model_cache import ModelCache
+from samsungctl.upnp.UPNP_Device.upnp_class import UPNPObject
+
+from .load_harness import VirtualDevices
+
+
+def run(devices, max_workers, model_cache=False, use_services=False):
+    host = devices.hosts[0]
+    locations = devices.locations(host)
+
+    old_max_workers = fetch.MAX_WORKERS
+    fetch.MAX_WORKERS = max_workers
+    # the sessions get their pool size when they are made
+    utils._sessions.clear()
+    requests = devices.requests
+
+    try:
+        start = time.time()
+        device = UPNPObject(host, locations, model_cache=model_cache)
+        if use_services:
+            for service in device.services:
+                service.methods
+        duration = time.time() - start
+    finally:
+        fetch.MAX_WORKERS = old_max_workers
+
+    return duration, devices.requests - requests, len(device._services)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tests.upnp.tree_benchmark')
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--workers', type=int, default=fetch.MAX_WORKERS)
+    args = parser.parse_args()
+
+    devices = VirtualDevices(1, u'127.3.0.0/30', args.latency)
+    devices.start()
+
+    model_cache = ModelCache()
+
+    try:
+        serial = run(devices, 1)
+        concurrent = run(devices, args.workers)
+        used = run(devices, args.workers, use_services=True)
+        # the first build fills the cache
+        run(devices, args.workers, model_cache, True)
+        cached = run(devices, args.workers, model_cache, True)
+    finally:
+        devices.stop()
+
+    print('{0:<12}{1:>12}{2:>12}{3:>12}'.format(
+        'workers',
+        'seconds',
+        'requests',
+        'services'
+    ))
+    for workers, result in (
+        (1, serial),
+        (args.workers, concurrent),
+        ('all used', used),
+        ('cached', cached)
+    ):
+        print('{0:<12}{1:>12.4f}{2:>12}{3:>12}'.format(workers, *result))
+
+    print('speedup: {0:.1f}x'.format(serial[0] / concurrent[0]))
+    print('cached speedup: {0:.1f}x'.format(used[0] / cached[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of removing the namespaces from the XML a TV sends.
+
+Measures documents per second for the old recursive `strip_xmlns`, the
+new `strip_xmlns` on a tree that has already been parsed and for
+`parse_xml`, both with the time it takes to parse the document. The
+documents are the description and SCPD files of the encrypted TV in
+``tests/upnp/encrypted/upnp``, a SOAP response and an SCPD file the size
+of ``upnp_methods.txt``, which is what every service of a TV put
+together comes to.
+
+    python -m tests.upnp.xmlns_benchmark --seconds 1
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import time
+
+from lxml import etree
+
+from samsungctl.upnp.UPNP_Device.xmlns import parse_xml, strip_xmlns
+
+from .load_harness import load_fixtures
+
+METHODS_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+    'upnp_methods.txt'
+)
+
+SOAP_RESPONSE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+    's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+    '<s:Body>'
+    '<u:GetVolumeResponse '
+    'xmlns:u="urn:schemas-upnp-org:service:RenderingControl:1">'
+    '<CurrentVolume>12</CurrentVolume>'
+    '</u:GetVolumeResponse>'
+    '</s:Body>'
+    '</s:Envelope>'
+).encode('utf-8')
+
+
+def old_strip_xmlns(root):
+    # the strip_xmlns there used to be
+    def iter_node(n):
+        nsmap = n.nsmap
+        for child in n:
+            nsmap.update(iter_node(child))
+        return nsmap
+
+    xmlns = list('{' + item + '}' for item in iter_node(root).values())
+
+    def strip_node(n):
+        for item in xmlns:
+            n.tag = n.tag.replace(item, '')
+
+        for child in n[:]:
+            try:
+                strip_node(child)
+            except AttributeError:
+                n.remove(child)
+    strip_node(root)
+
+    return root
+
+
+def large_scpd(fixtures, size):
+    """
+    Makes an SCPD file of about `size` bytes by repeating the actions of
+    the biggest one in the fixtures.
+    """
+    content = max(fixtures.values(), key=len)
+    head, rest = content.split('<actionList>', 1)
+    actions, tail = rest.split('</actionList>', 1)
+
+    count = max(size // len(actions), 1)
+    return (
+        head + '<actionList>' + actions * count + '</actionList>' + tail
+    ).encode('utf-8')
+
+
+def documents():
+    """
+    :return: [(name, contents of the document)]
+    :rtype: `list`
+    """
+    fixtures = load_fixtures()
+
+    if os.path.exists(METHODS_FILE):
+        size = os.path.getsize(METHODS_FILE)
+    else:
+        size = 128 * 1024
+
+    docs = list(
+        (name, fixtures[name].encode('utf-8'))
+        for name in sorted(fixtures, key=lambda n: int(n.split('_')[1]))
+    )
+    docs.append(('soap response', SOAP_RESPONSE))
+    docs.append(('upnp_methods', large_scpd(fixtures, size)))
+    return docs
+
+
+def rate(func, content, seconds):
+    count = 0
+    start = time.time()
+
+    while time.time() - start < seconds:
+        func(content)
+        count += 1
+
+    return count / (time.time() - start)
+
+
+def rate_parsed(func, content, seconds):
+    # the documents get parsed up front so only the stripping is timed
+    count = 0
+    duration = 0.0
+
+    while duration < seconds:
+        roots = list(etree.fromstring(content) for _ in range(100))
+        start = time.time()
+        for root in roots:
+            func(root)
+        duration += time.time() - start
+        count += len(roots)
+
+    return count / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tests.upnp.xmlns_benchmark')
+    parser.add_argument(
+        '--seconds',
+        type=float,
+        default=0.5,
+        help='seconds each measurement runs for'
+    )
+    args = parser.parse_args()
+
+    print('{0:<16}{1:>9}{2:>12}{3:>12}{4:>12}{5:>12}'.format(
+        'document',
+        'bytes',
+        'old strip',
+        'new strip',
+        'old parse',
+        'parse_xml'
+    ))
+
+    for name, content in documents():
+        results = (
+            rate_parsed(old_strip_xmlns, content, args.seconds),
+            rate_parsed(strip_xmlns, content, args.seconds),
+            rate(
+                lambda c: old_strip_xmlns(etree.fromstring(c)),
+                content,
+                args.seconds
+            ),
+            rate(parse_xml, content, args.seconds)
+        )
+
+        print('{0:<16}{1:>9}{2:>12.0f}{3:>12.0f}{4:>12.0f}{5:>12.0f}'.format(
+            name,
+            len(content),
+            *results
+        ))
+
+    print('documents per second')
+
+
+if __name__ == '__main__':
+    main()